@@ -0,0 +1,75 @@
+"""
+   Benchmarks of the bunnies platform.
+
+   Each benchmark is a function decorated with @benchmark, which takes a problem
+   size, prepares its inputs, and returns the callable to time. It is called anew
+   for every repetition, so memoized state (e.g. canonical ids) doesn't carry over.
+   The callable may return a dict of extra counters to record (e.g. api calls).
+
+   AWS services are replaced with local stand-ins (see standins.py). Run with:
+
+      pip install -e platform/python3.6
+      python -m benchmarks --profile default --output results.json
+      python -m benchmarks --compare baseline.json results.json
+"""
+import gc
+import statistics
+import time
+
+from collections import OrderedDict
+
+BENCHMARKS = OrderedDict()
+
+# problem sizes, by profile
+PROFILES = ("quick", "default", "full")
+
+
+class Benchmark(object):
+    __slots__ = ("name", "func", "sizes", "unit", "repeat")
+
+    def __init__(self, name, func, sizes, unit, repeat):
+        self.name = name
+        self.func = func
+        self.sizes = sizes
+        self.unit = unit
+        self.repeat = repeat
+
+    def run(self, size, repeat=None):
+        """times the benchmark at the given size. returns a result row."""
+        repeat = repeat or self.repeat
+        wall, cpu, extra = [], [], {}
+        for _ in range(repeat):
+            timed = self.func(size)
+            gc.collect()
+            start, start_cpu = time.perf_counter(), time.process_time()
+            counters = timed()
+            wall.append(time.perf_counter() - start)
+            cpu.append(time.process_time() - start_cpu)
+            extra = counters or extra
+        best = min(wall)
+        return OrderedDict([
+            ('name', self.name),
+            ('size', size),
+            ('unit', self.unit),
+            ('repeat', repeat),
+            ('min_s', round(best, 6)),
+            ('median_s', round(statistics.median(wall), 6)),
+            ('cpu_s', round(min(cpu), 6)),
+            ('per_s', round(size / best, 1) if best > 0 else None),
+            ('counters', extra)
+        ])
+
+
+def benchmark(name, quick, default, full=None, unit="nodes", repeat=3):
+    """registers a benchmark, with its problem sizes for each profile"""
+    def _register(func):
+        sizes = {'quick': quick, 'default': default, 'full': full or default}
+        BENCHMARKS[name] = Benchmark(name, func, sizes, unit, repeat)
+        return func
+    return _register
+
+
+def load_all():
+    """imports the modules defining benchmarks"""
+    from . import bench_graph, bench_scheduler, bench_transfers, bench_migrate, bench_kvstore  # noqa: F401
+    return BENCHMARKS
@@ -0,0 +1,121 @@
+"""
+   usage: python -m benchmarks [--profile quick|default|full] [--filter NAME] [--s3 memory|moto|URL]
+                               [--output FILE] [--compare BASELINE [RESULTS]] [--threshold 0.2]
+
+   Results are written as json (one row per benchmark and size), tagged with the git
+   commit of the tree. --compare reports the rows which got slower than the baseline
+   by more than the threshold, and exits with status 1 if there are any.
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+
+from . import PROFILES, load_all
+from . import standins
+
+log = logging.getLogger("benchmarks")
+
+
+def _git(*args):
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        return subprocess.check_output(("git",) + args, cwd=here, stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(profile="default", name_filter=None, s3="memory", repeat=None):
+    benchmarks = load_all()
+    standins.install(s3=s3)
+    doc = {
+        'commit': _git("rev-parse", "HEAD"),
+        'dirty': bool(_git("status", "--porcelain", "--untracked-files=no")),
+        'started': datetime.datetime.utcnow().isoformat() + "Z",
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'profile': profile,
+        's3': s3,
+        'results': []
+    }
+    for bench in benchmarks.values():
+        if name_filter and name_filter not in bench.name:
+            continue
+        for size in bench.sizes[profile]:
+            row = bench.run(size, repeat=repeat)
+            log.info("%-36s %10d %-6s %10.4fs %14s/s", row['name'], size, row['unit'], row['min_s'],
+                     row['per_s'])
+            doc['results'].append(row)
+    return doc
+
+
+def compare(baseline, results, threshold=0.2):
+    """returns the rows of results which are slower than in baseline by more than threshold"""
+    base = {(row['name'], row['size']): row for row in baseline['results']}
+    regressions = []
+    print("%-36s %10s %12s %12s %8s" % ("benchmark", "size", "baseline(s)", "current(s)", "ratio"))
+    for row in results['results']:
+        old = base.get((row['name'], row['size']), None)
+        if old is None or not old['min_s']:
+            continue
+        ratio = row['min_s'] / old['min_s']
+        flag = ""
+        if ratio > 1.0 + threshold:
+            regressions.append(row)
+            flag = "  REGRESSION"
+        print("%-36s %10d %12.4f %12.4f %8.2f%s" % (row['name'], row['size'], old['min_s'], row['min_s'],
+                                                   ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profile", choices=PROFILES, default="default", help="problem sizes to run")
+    parser.add_argument("--filter", dest="name_filter", default=None,
+                        help="only run benchmarks whose name contains this")
+    parser.add_argument("--s3", default="memory",
+                        help="s3 stand-in: 'memory', 'moto' (in-process moto server), or an endpoint url")
+    parser.add_argument("--repeat", type=int, default=None, help="override the number of repetitions")
+    parser.add_argument("--output", default=None, help="write json results to this file (default: stdout)")
+    parser.add_argument("--compare", nargs="+", metavar="JSON", default=None,
+                        help="compare results (a file, or a new run) with a baseline file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown ratio reported as a regression")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    # the code under benchmark logs progress at info
+    logging.getLogger("bunnies").setLevel(logging.WARNING)
+
+    if args.compare and len(args.compare) > 2:
+        parser.error("--compare takes a baseline file, and optionally a results file")
+
+    if args.compare and len(args.compare) == 2:
+        with open(args.compare[1]) as fd:
+            results = json.load(fd)
+    else:
+        results = run(profile=args.profile, name_filter=args.name_filter, s3=args.s3, repeat=args.repeat)
+        if args.output:
+            with open(args.output, "w") as fd:
+                json.dump(results, fd, indent=2)
+            log.info("results written to %s", args.output)
+        elif not args.compare:
+            json.dump(results, sys.stdout, indent=2)
+            sys.stdout.write("\n")
+
+    if args.compare:
+        with open(args.compare[0]) as fd:
+            baseline = json.load(fd)
+        regressions = compare(baseline, results, threshold=args.threshold)
+        if regressions:
+            log.info("%d regression(s) over %.0f%%", len(regressions), args.threshold * 100)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
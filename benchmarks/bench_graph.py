@@ -0,0 +1,114 @@
+"""
+   graph construction, canonical ids, dealiasing and manifests
+
+   canonical documents embed the documents of their inputs, so their size grows
+   as FAN_IN ** DEPTH. the graphs are kept shallow, like typical pipelines.
+"""
+import hashlib
+import random
+
+from bunnies.graph import Transform, ExternalFile
+from bunnies.pipeline import BuildGraph
+from bunnies.unmarshall import unmarshall, register_kind
+
+from . import benchmark
+
+DEPTH = 4
+FAN_IN = 2
+
+
+class Step(Transform):
+    """a transform which can be restored from its manifest"""
+    kind = "bench.Step"
+    __slots__ = ()
+
+    def __init__(self, name=None, params=None, manifest=None):
+        super().__init__(manifest['name'] if manifest else name, version="1", image="bench:latest",
+                         params=dict(params or {}))
+        if manifest is not None:
+            self.params.update(manifest['params'])
+            self.inputs.update(manifest['inputs'])
+
+
+register_kind(Step)
+
+
+def layered_graph(size, depth=DEPTH, fan_in=FAN_IN, seed=0):
+    """about `size` transforms in `depth` layers, each with fan_in inputs from the layer above.
+       returns the nodes in topological order.
+    """
+    rng = random.Random(seed)
+    width = max(1, size // depth)
+    layer = [ExternalFile("s3://bench/sample%d.fq.gz" % (i,),
+                          digests={'md5': hashlib.md5(b"%d" % (i,)).hexdigest()})
+             for i in range(width)]
+    nodes = []
+    for level in range(depth):
+        next_layer = []
+        for i in range(width):
+            node = Step("step%d" % (level,), params={'threads': 4, 'sample': i, 'opts': ["-q", "-k%d" % (level,)]})
+            for j, src in enumerate(rng.sample(layer, min(fan_in, len(layer)))):
+                node.add_input("in%d" % (j,), src)
+            next_layer.append(node)
+        nodes.extend(next_layer)
+        layer = next_layer
+    return nodes
+
+
+def merged(nodes, width):
+    """a transform depending on the last `width` nodes"""
+    root = Step("merge")
+    for i, node in enumerate(nodes[-width:]):
+        root.add_input("in%d" % (i,), node)
+    return root
+
+
+@benchmark("graph.build", quick=[10000], default=[10000, 100000], full=[10000, 100000, 1000000])
+def graph_build(size):
+    def _run():
+        layered_graph(size)
+    return _run
+
+
+@benchmark("graph.canonical_id", quick=[10000], default=[10000, 100000], full=[10000, 100000, 1000000])
+def graph_canonical_id(size):
+    nodes = layered_graph(size)
+
+    def _run():
+        for node in nodes:
+            node.canonical_id
+    return _run
+
+
+@benchmark("pipeline.dealias", quick=[2000], default=[10000, 50000], full=[10000, 100000])
+def pipeline_dealias(size):
+    nodes = layered_graph(size)
+    width = max(1, size // DEPTH)
+
+    def _run():
+        BuildGraph().add_targets(nodes[-width:])
+    return _run
+
+
+@benchmark("manifest.write", quick=[2000], default=[10000, 100000], full=[10000, 100000, 1000000])
+def manifest_write(size):
+    nodes = layered_graph(size)
+    root = merged(nodes, max(1, size // DEPTH))
+    for node in nodes:
+        node.canonical_id
+
+    def _run():
+        return {'manifest_nodes': len(root.manifest()['nodes'])}
+    return _run
+
+
+@benchmark("manifest.unmarshall", quick=[2000], default=[10000, 100000], full=[10000, 100000, 1000000])
+def manifest_unmarshall(size):
+    nodes = layered_graph(size)
+    for node in nodes:
+        node.canonical_id
+    manifest = merged(nodes, max(1, size // DEPTH)).manifest()
+
+    def _run():
+        unmarshall(manifest)
+    return _run
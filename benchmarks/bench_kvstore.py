@@ -0,0 +1,23 @@
+"""
+   job submission records (dynamodb)
+"""
+from bunnies import utils
+from bunnies.kvstore import SubmissionEntry
+
+from . import benchmark
+
+
+@benchmark("kvstore.save_load", quick=[1000], default=[10000], full=[10000, 100000], unit="entries")
+def kvstore_save_load(size):
+    ddb = utils.aws_client('dynamodb')
+    ddb.calls.clear()
+    ddb.tables.clear()
+    names = ["bench-job-%d" % (i,) for i in range(size)]
+
+    def _run():
+        for name in names:
+            SubmissionEntry(name, "bench", jobdata="job-%s" % (name,)).save()
+        for name in names:
+            SubmissionEntry(name).load()
+        return {'calls': sum(ddb.calls.values())}
+    return _run
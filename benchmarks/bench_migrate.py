@@ -0,0 +1,47 @@
+"""
+   planning of bucket migrations (bunnies migrate, in dry-run mode)
+"""
+import datetime
+import os
+import tempfile
+
+from bunnies import constants, migrate, utils
+
+from . import benchmark
+from .standins import ensure_bucket
+
+SRC_BUCKET = "bunnies-bench-src"
+DST_BUCKET = "bunnies-bench-dst"
+FILES_PER_RESULT = 4
+
+
+def _seed_results(count):
+    """`count` objects, grouped in result folders. a third of them already migrated."""
+    ensure_bucket(SRC_BUCKET)
+    ensure_bucket(DST_BUCKET)
+    s3 = utils.aws_client('s3')
+    seed = getattr(s3, "seed", None)
+    put = seed or (lambda bucket, key, body, **kwargs: s3.put_object(Bucket=bucket, Key=key, Body=body))
+    then = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    for i in range(count):
+        folder, n = divmod(i, FILES_PER_RESULT)
+        key = "results/step-1-%08d/%s" % (folder, constants.TRANSFORM_RESULT_FILE if n == 0 else "out%d.bam" % (n,))
+        kwargs = {'LastModified': then} if seed else {}
+        put(SRC_BUCKET, key, b"{}", **kwargs)
+        if i % 3 == 0:
+            put(DST_BUCKET, "moved/" + key, b"{}")
+
+
+@benchmark("migrate.plan", quick=[2000], default=[10000, 100000], full=[10000, 100000, 1000000],
+           unit="objects", repeat=1)
+def migrate_plan(size):
+    _seed_results(size)
+    journal_dir = tempfile.mkdtemp(prefix="bench-migrate-")
+
+    def _run():
+        s3 = utils.aws_client('s3')
+        listed = getattr(s3, "calls", {}).get("ListObjectsV2", 0)
+        migrate._cmd_migrate_bucket("s3://%s/results/" % (SRC_BUCKET,), "s3://%s/moved/" % (DST_BUCKET,),
+                                    journal_path=os.path.join(journal_dir, "journal.txt"), dry_run=True)
+        return {'list_calls': getattr(s3, "calls", {}).get("ListObjectsV2", 0) - listed}
+    return _run
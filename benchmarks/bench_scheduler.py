@@ -0,0 +1,93 @@
+"""
+   scheduler state propagation and batch job polling
+"""
+import random
+
+from bunnies.scheduler import Scheduler
+from bunnies.jobs import JobPollTracker, describe_jobs
+from bunnies import utils
+
+from . import benchmark
+
+
+def _scheduler(size, depth=10, fan_in=3, seed=0, eager_deps=0):
+    rng = random.Random(seed)
+    sched = Scheduler(eager_deps=eager_deps)
+    width = max(1, size // depth)
+    layer = []
+    for level in range(depth):
+        next_layer = [sched.add_node((level, i)) for i in range(width)]
+        for node in next_layer:
+            for dep in rng.sample(layer, min(fan_in, len(layer))):
+                node.depends_on(dep)
+        layer = next_layer
+    return sched
+
+
+@benchmark("scheduler.propagate", quick=[10000], default=[10000, 100000], full=[10000, 100000, 1000000])
+def scheduler_propagate(size):
+    """mimics the build loop: submit what's ready, then complete the submitted jobs"""
+    sched = _scheduler(size)
+
+    def _run():
+        sched.initialize()
+        rounds = 0
+        while True:
+            status = sched.status()
+            if not status['ready'] and not status['submitted']:
+                break
+            rounds += 1
+            for node in status['ready']:
+                node.submit()
+            for node in status['submitted']:
+                node.done()
+        return {'rounds': rounds}
+    return _run
+
+
+@benchmark("scheduler.propagate_eager", quick=[10000], default=[10000, 100000], full=[10000, 100000, 1000000])
+def scheduler_propagate_eager(size):
+    """as above, with eager submission of the nodes waiting on submitted jobs"""
+    sched = _scheduler(size, eager_deps=20)
+
+    def _run():
+        sched.initialize()
+        rounds = 0
+        while True:
+            status = sched.status()
+            if not status['ready'] and not status['submitted'] and not status['blocked']:
+                break
+            rounds += 1
+            for node in status['ready']:
+                node.submit()
+            for node in status['eager']:
+                node.submit_blocked()
+            for node in status['submitted']:
+                node.done()
+        return {'rounds': rounds}
+    return _run
+
+
+@benchmark("jobs.poll", quick=[1000], default=[1000, 10000], full=[1000, 10000, 100000], unit="jobs")
+def jobs_poll(size):
+    """tracks `size` jobs to completion, in virtual time"""
+    clock = [0.0]
+    batch = utils.aws_client('batch')
+    batch.jobs.clear()
+    batch.calls.clear()
+    batch.clock, batch.queued, batch.runtime = (lambda: clock[0]), 60.0, 300.0
+    job_ids = [batch.submit_job("job%d" % (i,), "queue", "jobdef")['jobId'] for i in range(size)]
+
+    def _run():
+        tracker = JobPollTracker(describe_fn=describe_jobs)
+        for job_id in job_ids:
+            tracker.track(job_id, state="SUBMITTED", expected_runtime=300.0, now=clock[0])
+        polls = 0
+        while True:
+            status_map = tracker.poll(now=clock[0])
+            polls += 1
+            if len(status_map.get("SUCCEEDED", [])) == size:
+                break
+            clock[0] = tracker.next_due()
+        return {'polls': polls, 'describe_calls': batch.calls.get("DescribeJobs", 0)}
+    return _run
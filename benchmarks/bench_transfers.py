@@ -0,0 +1,95 @@
+"""
+   hashing and s3 transfer throughput
+"""
+import os
+
+from bunnies import transfers, utils
+
+from . import benchmark
+from .standins import ensure_bucket
+
+MB = 1024 * 1024
+BUCKET = "bunnies-bench"
+
+_BLOCK = os.urandom(MB)
+
+
+class PatternReader(object):
+    """a file of `size` bytes, repeating a random block. reads return at most `size` bytes."""
+
+    def __init__(self, size):
+        self.size = size
+        self.pos = 0
+
+    def read(self, size=-1):
+        remaining = self.size - self.pos
+        if size < 0 or size > remaining:
+            size = remaining
+        out = []
+        want = size
+        while want > 0:
+            offset = (self.pos + size - want) % len(_BLOCK)
+            piece = _BLOCK[offset:offset + want]
+            out.append(piece)
+            want -= len(piece)
+        self.pos += size
+        return b"".join(out)
+
+    def close(self):
+        pass
+
+
+def _seed(key, size):
+    ensure_bucket(BUCKET)
+    utils.aws_client('s3').put_object(Bucket=BUCKET, Key=key, Body=PatternReader(size).read())
+    return "s3://%s/%s" % (BUCKET, key)
+
+
+@benchmark("transfers.hashing_reader", quick=[64 * MB], default=[256 * MB], full=[1024 * MB], unit="bytes")
+def hashing_reader(size):
+    def _run():
+        reader = transfers.HashingReader(PatternReader(size), algorithms=("md5", "sha1", "sha256"))
+        while reader.read(8 * MB):
+            pass
+        reader.release()
+    return _run
+
+
+def _streaming_put(threads):
+    def _bench(size):
+        ensure_bucket(BUCKET)
+
+        def _run():
+            transfers.s3_streaming_put(PatternReader(size), "s3://%s/put-%d" % (BUCKET, threads),
+                                       content_length=size, threads=threads)
+        return _run
+    return _bench
+
+
+benchmark("transfers.streaming_put[threads=1]", quick=[32 * MB], default=[128 * MB], full=[512 * MB],
+          unit="bytes")(_streaming_put(1))
+benchmark("transfers.streaming_put[threads=4]", quick=[32 * MB], default=[128 * MB], full=[512 * MB],
+          unit="bytes")(_streaming_put(4))
+
+
+@benchmark("transfers.copy_object", quick=[32 * MB], default=[128 * MB], full=[512 * MB], unit="bytes")
+def copy_object(size):
+    src_url = _seed("copy-src", size)
+
+    def _run():
+        transfers.s3_copy_object(src_url, "s3://%s/copy-dst" % (BUCKET,))
+    return _run
+
+
+@benchmark("transfers.multipart_copy[threads=4]", quick=[32 * MB], default=[128 * MB], full=[512 * MB],
+           unit="bytes")
+def multipart_copy(size):
+    _seed("mpcopy-src", size)
+    s3 = utils.aws_client('s3')
+
+    def _run():
+        # objects are only copied in parts above 512MB. use small parts instead.
+        transfers.s3_multipart_copy(s3, BUCKET, "mpcopy-src", BUCKET, "mpcopy-dst", size,
+                                    part_size=8 * MB, threads=4)
+        return {'parts': (size + 8 * MB - 1) // (8 * MB)}
+    return _run
@@ -0,0 +1,515 @@
+"""
+   Local stand-ins for the AWS services used by bunnies.
+
+   install() swaps the session behind bunnies.utils.aws_client, so that the code
+   under benchmark runs unmodified:
+
+     - s3: an in-memory object store (default), or any S3-compatible endpoint
+       (e.g. a moto server, started in-process with "moto", or given as a URL).
+     - batch, dynamodb: in-memory fakes of the calls bunnies makes.
+
+   The unit tests of bunnies share these fakes (see platform/python3.6/conftest.py),
+   and Step, a transform which can be scheduled and restored from its manifest.
+"""
+import bisect
+import datetime
+import hashlib
+import io
+import re
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from bunnies.graph import Transform
+from bunnies.unmarshall import register_kind
+
+
+def _client_error(code, operation, message=""):
+    return ClientError({'Error': {'Code': code, 'Message': message or code}}, operation)
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _key_blob(buckets, bucket, key, operation):
+    try:
+        return buckets[bucket][key]
+    except KeyError:
+        raise _client_error("404" if operation == "HeadObject" else "NoSuchKey", operation)
+
+
+class FakeS3(object):
+    """in-memory s3 client: objects, listings, multipart uploads and copies"""
+
+    def __init__(self, record=False):
+        self.lock = threading.Lock()
+        self.buckets = {}        # bucket => {key: blob}
+        self.sorted_keys = {}    # bucket => sorted list of keys, rebuilt on listing
+        self.uploads = {}        # upload id => (bucket, key, meta, {partnum: bytes})
+        self.calls = {}
+        self.requests = [] if record else None  # (operation, url), in order
+        self.upload_seq = 0
+
+    @property
+    def meta(self):
+        # the real model, so that transfers.supports_param sees conditional writes
+        if FakeS3.service_model is None:
+            import botocore.session
+            FakeS3.service_model = botocore.session.get_session().get_service_model('s3')
+        return _ClientMeta(FakeS3.service_model)
+
+    service_model = None
+
+    def _count(self, operation, bucket=None, key=None):
+        self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.requests is not None and bucket is not None:
+            self.requests.append((operation, "s3://%s/%s" % (bucket, key or "")))
+
+    def requested(self, operation):
+        """the urls of the requests of one kind, in order"""
+        return [url for op, url in self.requests if op == operation]
+
+    def objects(self):
+        """{url: body} of all the objects stored"""
+        with self.lock:
+            return {"s3://%s/%s" % (bucket, key): blob['Body']
+                    for bucket, objects in self.buckets.items() for key, blob in objects.items()}
+
+    def _check(self, bucket, key, operation, IfMatch=None, IfNoneMatch=None):
+        """raises like s3 if the conditions on the current object at bucket/key don't hold"""
+        current = self.buckets.get(bucket, {}).get(key, None)
+        if IfNoneMatch == "*" and current is not None:
+            raise _client_error("PreconditionFailed", operation)
+        if IfMatch is not None:
+            if current is None:
+                raise _client_error("404" if operation == "HeadObject" else "NoSuchKey", operation)
+            if current['ETag'] != IfMatch:
+                raise _client_error("PreconditionFailed", operation)
+
+    def _store(self, bucket, key, body, Metadata=None, ContentType=None, ContentEncoding=None,
+               LastModified=None, StorageClass="STANDARD", etag=None):
+        blob = {
+            'Body': body,
+            'Metadata': dict(Metadata or {}),
+            'ContentType': ContentType or "binary/octet-stream",
+            'LastModified': LastModified or _now(),
+            'ETag': etag or '"%s"' % (hashlib.md5(body).hexdigest(),),
+            'StorageClass': StorageClass
+        }
+        if ContentEncoding:
+            blob['ContentEncoding'] = ContentEncoding
+        objects = self.buckets.setdefault(bucket, {})
+        if key not in objects:
+            self.sorted_keys.pop(bucket, None)
+        objects[key] = blob
+        return blob
+
+    def create_bucket(self, Bucket, **kwargs):
+        with self.lock:
+            self.buckets.setdefault(Bucket, {})
+        return {}
+
+    def seed(self, bucket, key, body, **kwargs):
+        """stores an object directly, without counting a call"""
+        with self.lock:
+            self._store(bucket, key, body, **kwargs)
+
+    def head_object(self, Bucket, Key, IfMatch=None, **kwargs):
+        with self.lock:
+            self._count("HeadObject", Bucket, Key)
+            self._check(Bucket, Key, "HeadObject", IfMatch=IfMatch)
+            blob = _key_blob(self.buckets, Bucket, Key, "HeadObject")
+            info = {k: v for k, v in blob.items() if k != 'Body'}
+            info['Metadata'] = dict(blob['Metadata'])
+            info['ContentLength'] = len(blob['Body'])
+        return info
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None, **kwargs):
+        with self.lock:
+            self._count("GetObject", Bucket, Key)
+            self._check(Bucket, Key, "GetObject", IfMatch=IfMatch)
+            blob = _key_blob(self.buckets, Bucket, Key, "GetObject")
+        body = blob['Body']
+        if Range:
+            start, end = Range[len("bytes="):].split("-")
+            body = body[int(start):int(end) + 1]
+        info = {k: v for k, v in blob.items() if k != 'Body'}
+        info['ContentLength'] = len(body)
+        info['Body'] = io.BytesIO(body)
+        return info
+
+    def put_object(self, Bucket, Key, Body=b"", Metadata=None, ContentType=None, ContentEncoding=None,
+                   IfMatch=None, IfNoneMatch=None, **kwargs):
+        if hasattr(Body, "read"):
+            Body = Body.read()
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        with self.lock:
+            self._count("PutObject", Bucket, Key)
+            self._check(Bucket, Key, "PutObject", IfMatch=IfMatch, IfNoneMatch=IfNoneMatch)
+            blob = self._store(Bucket, Key, Body, Metadata=Metadata, ContentType=ContentType,
+                               ContentEncoding=ContentEncoding)
+        return {'ETag': blob['ETag']}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        with self.lock:
+            self._count("DeleteObject", Bucket, Key)
+            if self.buckets.get(Bucket, {}).pop(Key, None) is not None:
+                self.sorted_keys.pop(Bucket, None)
+        return {}
+
+    def copy_object(self, Bucket, Key, CopySource, Metadata=None, ContentType=None, ContentEncoding=None, **kwargs):
+        with self.lock:
+            self._count("CopyObject", Bucket, Key)
+            src = _key_blob(self.buckets, CopySource['Bucket'], CopySource['Key'], "CopyObject")
+            blob = self._store(Bucket, Key, src['Body'], Metadata=Metadata, ContentType=ContentType,
+                               ContentEncoding=ContentEncoding)
+        return {'CopyObjectResult': {'ETag': blob['ETag'], 'LastModified': blob['LastModified']}}
+
+    def list_objects_v2(self, Bucket, Prefix="", ContinuationToken=None, MaxKeys=1000, Delimiter=None, **kwargs):
+        with self.lock:
+            self._count("ListObjectsV2", Bucket, Prefix)
+            objects = self.buckets.get(Bucket, {})
+            keys = self.sorted_keys.get(Bucket, None)
+            if keys is None:
+                keys = self.sorted_keys[Bucket] = sorted(objects)
+            if ContinuationToken:
+                start = bisect.bisect_right(keys, ContinuationToken)
+            else:
+                start = bisect.bisect_left(keys, Prefix)
+            contents, common_prefixes = [], []
+            for key in keys[start:]:
+                if not key.startswith(Prefix) or len(contents) == MaxKeys:
+                    break
+                if Delimiter and Delimiter in key[len(Prefix):]:
+                    common = key[:len(Prefix) + key[len(Prefix):].index(Delimiter) + len(Delimiter)]
+                    if common not in common_prefixes:
+                        common_prefixes.append(common)
+                    continue
+                blob = objects[key]
+                contents.append({'Key': key, 'Size': len(blob['Body']), 'ETag': blob['ETag'],
+                                 'LastModified': blob['LastModified'], 'StorageClass': blob['StorageClass']})
+        resp = {'IsTruncated': False, 'KeyCount': len(contents)}
+        if common_prefixes:
+            resp['CommonPrefixes'] = [{'Prefix': common} for common in common_prefixes]
+        if contents:
+            resp['Contents'] = contents
+            nxt = start + len(contents)
+            if nxt < len(keys) and keys[nxt].startswith(Prefix):
+                resp['IsTruncated'] = True
+                resp['NextContinuationToken'] = contents[-1]['Key']
+        return resp
+
+    def get_paginator(self, operation):
+        if operation != "list_objects_v2":
+            raise ValueError("no stand-in paginator for %s" % (operation,))
+        return _ListPaginator(self)
+
+    def create_multipart_upload(self, Bucket, Key, Metadata=None, ContentType=None, ContentEncoding=None, **kwargs):
+        with self.lock:
+            self._count("CreateMultipartUpload", Bucket, Key)
+            self.upload_seq += 1
+            upload_id = "upload-%d" % (self.upload_seq,)
+            self.uploads[upload_id] = (Bucket, Key, {'Metadata': Metadata, 'ContentType': ContentType,
+                                                     'ContentEncoding': ContentEncoding}, {})
+        return {'UploadId': upload_id, 'Bucket': Bucket, 'Key': Key}
+
+    def upload_part(self, Body, UploadId, PartNumber, **kwargs):
+        data = Body.read() if hasattr(Body, "read") else Body
+        with self.lock:
+            self._count("UploadPart")
+            self.uploads[UploadId][3][PartNumber] = data
+        return {'ETag': '"%s"' % (hashlib.md5(data).hexdigest(),)}
+
+    def upload_part_copy(self, UploadId, PartNumber, CopySource, CopySourceRange=None, CopySourceIfMatch=None,
+                         **kwargs):
+        with self.lock:
+            self._count("UploadPartCopy")
+            src = _key_blob(self.buckets, CopySource['Bucket'], CopySource['Key'], "UploadPartCopy")
+            if CopySourceIfMatch and CopySourceIfMatch != src['ETag']:
+                raise _client_error("PreconditionFailed", "UploadPartCopy")
+            data = src['Body']
+            if CopySourceRange:
+                start, end = CopySourceRange[len("bytes="):].split("-")
+                data = data[int(start):int(end) + 1]
+            self.uploads[UploadId][3][PartNumber] = data
+        return {'CopyPartResult': {'ETag': '"%s"' % (hashlib.md5(data).hexdigest(),), 'LastModified': _now()}}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, IfMatch=None, IfNoneMatch=None,
+                                  **kwargs):
+        with self.lock:
+            self._count("CompleteMultipartUpload", Bucket, Key)
+            self._check(Bucket, Key, "CompleteMultipartUpload", IfMatch=IfMatch, IfNoneMatch=IfNoneMatch)
+            _, _, args, parts = self.uploads.pop(UploadId)
+            body = b"".join(parts[part['PartNumber']] for part in MultipartUpload['Parts'])
+            etag = '"%s-%d"' % (hashlib.md5(body).hexdigest(), len(MultipartUpload['Parts']))
+            blob = self._store(Bucket, Key, body, etag=etag, **args)
+        return {'Bucket': Bucket, 'Key': Key, 'ETag': blob['ETag']}
+
+    def abort_multipart_upload(self, UploadId, **kwargs):
+        with self.lock:
+            self._count("AbortMultipartUpload")
+            self.uploads.pop(UploadId, None)
+        return {}
+
+
+class _ClientMeta(object):
+    __slots__ = ("service_model",)
+
+    def __init__(self, service_model):
+        self.service_model = service_model
+
+
+class _ListPaginator(object):
+    """pages of list_objects_v2, following continuation tokens"""
+    __slots__ = ("client",)
+
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, **kwargs):
+        while True:
+            page = self.client.list_objects_v2(**kwargs)
+            yield page
+            if not page.get('IsTruncated', False):
+                return
+            kwargs['ContinuationToken'] = page['NextContinuationToken']
+
+
+class FakeBatch(object):
+    """batch client whose jobs run for a fixed time after submission (wall clock).
+       jobs seeded with a status keep it.
+    """
+
+    def __init__(self, runtime=0.0, queued=0.0, clock=time.time, record=False):
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.runtime = runtime
+        self.queued = queued
+        self.clock = clock
+        self.calls = {}
+        self.requests = [] if record else None  # (operation, [job id, ...]), in order
+        self.seq = 0
+
+    def _count(self, operation, job_ids=()):
+        self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.requests is not None:
+            self.requests.append((operation, list(job_ids)))
+
+    def requested(self, operation):
+        """the job ids of the requests of one kind, in order"""
+        return [job_ids for op, job_ids in self.requests if op == operation]
+
+    def seed(self, job_id, **desc):
+        """adds a job, described by desc (e.g. status="RUNNING", startedAt=0)"""
+        with self.lock:
+            self.jobs[job_id] = dict(desc, jobId=job_id)
+
+    def submit_job(self, jobName, jobQueue, jobDefinition, dependsOn=(), **kwargs):
+        with self.lock:
+            self.seq += 1
+            job_id = "job-%08d" % (self.seq,)
+            self._count("SubmitJob", [job_id])
+            self.jobs[job_id] = {'jobId': job_id, 'jobName': jobName, 'jobQueue': jobQueue,
+                                 'jobDefinition': jobDefinition, 'dependsOn': list(dependsOn),
+                                 'createdAt': self.clock()}
+        return {'jobId': job_id, 'jobName': jobName}
+
+    def _describe(self, job):
+        if 'status' in job:
+            return dict(job)
+        now = self.clock()
+        doc = dict(job)
+        elapsed = now - job['createdAt']
+        started = job['createdAt'] + self.queued
+        doc['createdAt'] = int(job['createdAt'] * 1000)
+        if elapsed < self.queued:
+            doc['status'] = "RUNNABLE"
+            return doc
+        doc['startedAt'] = int(started * 1000)
+        if elapsed < self.queued + self.runtime:
+            doc['status'] = "RUNNING"
+            return doc
+        doc['status'] = "SUCCEEDED"
+        doc['stoppedAt'] = int((started + self.runtime) * 1000)
+        doc['statusReason'] = "Essential container in task exited"
+        return doc
+
+    def describe_jobs(self, jobs):
+        if len(jobs) > 100:
+            raise _client_error("ClientException", "DescribeJobs", "at most 100 jobs")
+        with self.lock:
+            self._count("DescribeJobs", jobs)
+            return {'jobs': [self._describe(self.jobs[job_id]) for job_id in jobs if job_id in self.jobs]}
+
+
+class FakeDynamoDB(object):
+    """dynamodb client keeping items in memory, for tables with a single (hash) key attribute"""
+
+    def __init__(self, key_attr="jobname", record=False):
+        self.key_attr = key_attr
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.calls = {}
+        self.requests = [] if record else None  # operations, in order
+
+    def _count(self, operation):
+        self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.requests is not None:
+            self.requests.append(operation)
+
+    def _key(self, Key):
+        return tuple(sorted((name, tuple(val.items())) for name, val in Key.items()))
+
+    def seed(self, TableName, Item):
+        """stores an item, unconditionally"""
+        with self.lock:
+            self.tables.setdefault(TableName, {})[self._key({self.key_attr: Item[self.key_attr]})] = dict(Item)
+
+    def item(self, TableName, key):
+        """the item whose key attribute is the string key, or None"""
+        with self.lock:
+            return self.tables.get(TableName, {}).get(self._key({self.key_attr: {'S': key}}), None)
+
+    def _project(self, item, ProjectionExpression=None):
+        if not ProjectionExpression:
+            return dict(item)
+        names = ProjectionExpression.split(",")
+        return {k: v for k, v in item.items() if k in names}
+
+    def get_item(self, TableName, Key, ProjectionExpression=None, **kwargs):
+        with self.lock:
+            self._count("GetItem")
+            item = self.tables.get(TableName, {}).get(self._key(Key), None)
+        if item is None:
+            return {}
+        return {'Item': self._project(item, ProjectionExpression)}
+
+    def _check(self, item, ConditionExpression=None, ExpressionAttributeNames=None,
+               ExpressionAttributeValues=None, **kwargs):
+        """evaluates conditions of the forms attribute_not_exists(name) and name = :value"""
+        if not ConditionExpression:
+            return True
+        names = ExpressionAttributeNames or {}
+        match = re.match(r"^attribute_not_exists\((.+)\)$", ConditionExpression)
+        if match:
+            return item is None or names.get(match.group(1), match.group(1)) not in item
+        name, value = [part.strip() for part in ConditionExpression.split("=")]
+        return item is not None and item.get(names.get(name, name)) == ExpressionAttributeValues[value]
+
+    def put_item(self, TableName, Item, **kwargs):
+        with self.lock:
+            self._count("PutItem")
+            table = self.tables.setdefault(TableName, {})
+            key = self._key({self.key_attr: Item[self.key_attr]})
+            if not self._check(table.get(key, None), **kwargs):
+                raise _client_error("ConditionalCheckFailedException", "PutItem")
+            table[key] = dict(Item)
+        return {}
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        responses = {}
+        with self.lock:
+            self._count("BatchGetItem")
+            if sum(len(req['Keys']) for req in RequestItems.values()) > 100:
+                raise _client_error("ValidationException", "BatchGetItem", "at most 100 keys")
+            for table_name, req in RequestItems.items():
+                table = self.tables.get(table_name, {})
+                found = [table.get(self._key(key), None) for key in req['Keys']]
+                responses[table_name] = [self._project(item, req.get('ProjectionExpression'))
+                                         for item in found if item is not None]
+        return {'Responses': responses, 'UnprocessedKeys': {}}
+
+
+class Step(Transform):
+    """a transform which can be scheduled, and restored from its manifest.
+       params['vcpus'] sets the vcpus it requests (default 2).
+    """
+    kind = "standins.Step"
+    __slots__ = ()
+
+    def __init__(self, name=None, params=None, deps=(), manifest=None):
+        super().__init__(manifest['name'] if manifest else name, version="1", params=dict(params or {}))
+        if manifest is not None:
+            self.params.update(manifest['params'])
+            self.inputs.update(manifest['inputs'])
+        for i, dep in enumerate(deps):
+            self.add_input("dep%d" % (i,), dep)
+
+    def task_template(self, compute_env):
+        return {'jobtype': "batch", 'image': "standins:latest"}
+
+    def task_resources(self, **kwargs):
+        return {'vcpus': self.params.get('vcpus', 2), 'memory': 1024, 'timeout': -1}
+
+
+register_kind(Step)
+
+
+class StandInSession(object):
+    """stands in for the boto3 session which bunnies.utils.aws_client creates clients from"""
+
+    def __init__(self, s3=None, batch=None, dynamodb=None, s3_endpoint=None):
+        self.fakes = {
+            's3': s3 or FakeS3(),
+            'batch': batch or FakeBatch(),
+            'dynamodb': dynamodb or FakeDynamoDB()
+        }
+        self.s3_endpoint = s3_endpoint
+        self.boto_session = None
+        if s3_endpoint:
+            import boto3
+            from bunnies import tracing
+            self.boto_session = boto3.session.Session(aws_access_key_id="bench", aws_secret_access_key="bench",
+                                                      region_name="us-east-1")
+            tracing.instrument_session(self.boto_session)
+
+    def client(self, service, region_name=None, config=None):
+        if service == 's3' and self.boto_session is not None:
+            return self.boto_session.client('s3', endpoint_url=self.s3_endpoint, config=config)
+        if service not in self.fakes:
+            raise ValueError("no stand-in for the %s service" % (service,))
+        return self.fakes[service]
+
+
+def start_moto_server():
+    """starts a moto s3 server in a background thread, returning its endpoint url"""
+    try:
+        from moto.server import ThreadedMotoServer
+    except ImportError:
+        raise RuntimeError("--s3 moto requires moto[server]: pip install 'moto[server]'")
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0)
+    server.start()
+    host, port = server.get_host_and_port()
+    return "http://%s:%d" % (host, port)
+
+
+def install(s3="memory"):
+    """routes bunnies' aws clients to stand-ins. s3 is "memory", "moto", or an endpoint url.
+       returns the session.
+    """
+    from bunnies import utils
+
+    s3_endpoint = None
+    if s3 == "moto":
+        s3_endpoint = start_moto_server()
+    elif s3 != "memory":
+        s3_endpoint = s3
+
+    session = StandInSession(s3_endpoint=s3_endpoint)
+    with utils.aws_client.lock:
+        utils.aws_client.clients.clear()
+        utils.aws_client.session = session
+    return session
+
+
+def ensure_bucket(name):
+    from bunnies import utils
+    s3 = utils.aws_client('s3')
+    try:
+        s3.create_bucket(Bucket=name)
+    except ClientError as clierr:
+        if clierr.response['Error']['Code'] not in ("BucketAlreadyOwnedByYou", "BucketAlreadyExists"):
+            raise
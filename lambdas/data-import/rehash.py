@@ -33,8 +33,17 @@ The response will be:
   "ETag": "xxxxxxxxxxx",
   "LastModified": "date string",
   "digests": {...} # filled in version of request
+  "stats": {"hash_bytes": int, "hash_seconds": float, "hash_mbps": float, "read_threads": int}
 }
 
+The object is read with concurrent ranged GETs. Optional request keys
+"chunk_size" (bytes) and "threads" override the defaults, which are
+sized from the lambda's memory.
+
+The destination is recorded in the digest index of its directory (see
+bunnies.digest_index), unless the request has "index": false. DataImport
+passes it: it records its imports itself, once per directory.
+
 or (in case of an error)
 
 {
@@ -44,19 +53,21 @@ or (in case of an error)
 """
 
 
-import boto3
+import os
 import hashlib
 import concurrent.futures
 import time
 import logging
 
-from bunnies import transfers, constants
+from bunnies import transfers, constants, utils, digest_index
 from botocore.exceptions import ClientError
 
 
 DIGEST_HEADER = constants.DIGEST_HEADER_PREFIX
 MB = 1024*1024
-DEFAULT_CHUNK_SIZE = 16*MB
+DEFAULT_CHUNK_SIZE = 8*MB
+MAX_READ_THREADS = 8
+COPY_THREADS = 16  # concurrent part copies for objects over 5GB (see constants.COPY_PART_SIZE)
 
 def setup_logging(loglevel=logging.INFO):
     """configure custom logging for the platform"""
@@ -66,8 +77,13 @@ def setup_logging(loglevel=logging.INFO):
 setup_logging(logging.DEBUG)
 log = logging.getLogger(__name__)
 
-def _form_response(dst_bucket, dst_key, clen, last_mod, new_etag, new_meta):
-    return {
+def _read_ahead_budget():
+    """bytes of object data buffered while hashing: a quarter of the lambda's memory"""
+    memory_mb = int(os.environ.get("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", "0"), 10) or 128
+    return memory_mb * MB // 4
+
+def _form_response(dst_bucket, dst_key, clen, last_mod, new_etag, new_meta, stats=None):
+    res = {
         "Key": dst_key,
         "Bucket": dst_bucket,
         "ContentLength": clen,
@@ -77,9 +93,19 @@ def _form_response(dst_bucket, dst_key, clen, last_mod, new_etag, new_meta):
         "digests": {algo[len(DIGEST_HEADER):]: hexdigest for algo, hexdigest in new_meta.items()
                     if algo.startswith(DIGEST_HEADER)}
     }
+    if stats:
+        res["stats"] = stats
+    return res
 
 def lambda_handler(event, context):
     """lambda entry point"""
+    res = _rehash(event, context)
+    if constants.USE_DIGEST_INDEX and event.get("index", True) and not res.get("error", None):
+        # keep the destination directory's digest index current
+        digest_index.record("s3://%s/%s" % (res["Bucket"], res["Key"]), res)
+    return res
+
+def _rehash(event, context):
     src_key = event.get("src_key", "")
     src_bucket = event.get("src_bucket", "")
 
@@ -94,7 +120,7 @@ def lambda_handler(event, context):
     else:
         put_copy = False
 
-    client = boto3.client("s3")
+    client = utils.aws_client("s3")
 
     head_res = client.head_object(Bucket=src_bucket, Key=src_key)
     log.debug("HEAD: %s", head_res)
@@ -131,24 +157,32 @@ def lambda_handler(event, context):
                               head_res['ResponseMetadata']['HTTPHeaders']['last-modified'],
                               head_res['ETag'], head_res['Metadata'])
 
-    # GET OBJECT
-    resp = client.get_object(Bucket=src_bucket, Key=src_key, IfMatch=orig_etag)
+    # GET OBJECT -- in concurrent ranges. the HEAD has the same attributes as a GET.
+    resp = head_res
 
     progress = transfers.ProgressPercentage(size=resp['ContentLength'], logger=log)
-    chunk_size = int(event.get("chunk_size", "0"), 10)
+    chunk_size = int(str(event.get("chunk_size", "0")), 10)
     if chunk_size <= 0:
         chunk_size = DEFAULT_CHUNK_SIZE
 
-    chunk_iter = transfers.yield_in_chunks(resp['Body'], chunk_size)
+    read_ahead = max(2, _read_ahead_budget() // chunk_size)
+    threads = int(str(event.get("threads", "0")), 10)
+    if threads <= 0:
+        threads = min(MAX_READ_THREADS, read_ahead)
+
+    chunk_iter = transfers.s3_ranged_chunks(client, src_bucket, src_key, resp['ContentLength'],
+                                            chunk_size=chunk_size, threads=threads, read_ahead=read_ahead,
+                                            etag=orig_etag)
 
     hashers = {algo: getattr(hashlib, algo)() for algo in pending}
 
     def _update_hash(algo, hasher, chunk):
         hasher.update(chunk)
 
-    log.info("Hashing ~%dMB in ~%dMB chunks. Algorithms: %s",
+    log.info("Hashing ~%dMB in ~%dMB chunks over %d connections (read-ahead %d). Algorithms: %s",
              resp['ContentLength'] // MB,
              chunk_size // MB,
+             threads, read_ahead,
              ", ".join(pending)
     )
 
@@ -170,7 +204,14 @@ def lambda_handler(event, context):
     for algo, hasher in hashers.items():
         completed_digests[algo] = hasher.hexdigest()
 
-    log.info("computed %s hashes in %8.3f seconds.", ",".join(pending), time.time() - start_time)
+    hash_secs = time.time() - start_time
+    stats = {
+        "hash_bytes": resp['ContentLength'],
+        "hash_seconds": hash_secs,
+        "hash_mbps": resp['ContentLength'] / (MB * (hash_secs + 0.00001)),
+        "read_threads": threads
+    }
+    log.info("computed %s hashes in %8.3f seconds. (%8.3f MB/s)", ",".join(pending), hash_secs, stats["hash_mbps"])
 
     for digest_type in completed_digests:
         if not digest_type in expected_digests:
@@ -212,70 +253,41 @@ def lambda_handler(event, context):
         return _form_response(dst_bucket, dst_key, total_len,
                               copy_result['CopyObjectResult']['LastModified'].strftime("%a, %d %b %Y %H:%M:%S %Z"),
                               copy_result['CopyObjectResult']['ETag'],
-                              new_meta)
+                              new_meta, stats=stats)
     else:
-        # multipart copy
-        mpart = None
-        parts = []
-        try:
-            mpart = client.create_multipart_upload(Bucket=dst_bucket, Key=dst_key,
-                                               ContentType=orig_ct,
-                                               Metadata=new_meta,
-                                               **copy_attr)
-            for partnum, start in enumerate(range(0, total_len, max_copy_len)):
-                partend = min(start + max_copy_len, total_len) - 1
-                log.info("copying part %d, bytes=%d-%d", partnum, start, partend)
-                part_res = client.upload_part_copy(Bucket=dst_bucket, Key=dst_key,
-                                                   CopySource={"Key": src_key, "Bucket": src_bucket},
-                                                   CopySourceIfMatch=resp['ETag'],
-                                                   CopySourceRange="bytes=%d-%d" % (start, partend),
-                                                   PartNumber=partnum+1,
-                                                   UploadId=mpart['UploadId'])
-                parts.append((partnum+1, part_res['CopyPartResult']['ETag']))
-
-            # finish it
-            parts_document = {
-                'Parts': [{'ETag': etag, 'PartNumber': pnum} for pnum, etag in parts]
-            }
-
-            copy_result = client.complete_multipart_upload(Bucket=dst_bucket, Key=dst_key, UploadId=mpart['UploadId'],
-                                                           MultipartUpload=parts_document)
-            mpart = None
-            log.info("copy result: %s", copy_result)
-            log.info("copy completed in %8.3fseconds", time.time() - start_time)
-
-            # check final object
-            head_attempts = 0
-            head_res2 = None
-            while head_attempts < 5:
-                try:
-                    head_attempts += 1
-                    head_res2 = client.head_object(Bucket=dst_bucket, Key=dst_key, IfMatch=copy_result['ETag'])
-                    break
-                except ClientError as clierr:
-                    if clierr.response['Error']['Code'] == '412':
-                        # bad ETag -- retrieved old version
-                        time.sleep(5.0)
-                        continue
-                    log.error("client error: %s code=%s", str(clierr), clierr.response['Error']['Code'])
-                    raise
-
-            if head_res2:
-                assert head_res['ContentLength'] == head_res2['ContentLength']
-                obj_date = head_res2['ResponseMetadata']['HTTPHeaders']['last-modified']
-            else:
-                log.error("could not retrieve obj HEAD")
-                obj_date = copy_result['ResponseMetadata']['HTTPHeaders']['date']
-
-            return _form_response(dst_bucket, dst_key, head_res['ContentLength'],
-                                  obj_date,
-                                  copy_result['ETag'],
-                                  new_meta)
-        finally:
-            if mpart:
-                try:
-                    client.abort_multipart_upload(Bucket=bucketname, Key=keyname, UploadId=mpart['UploadId'])
-                    log.debug("multipart upload aborted")
-                except Exception as exc:
-                    log.error("could not abort multipart upload:", exc_info=exc)
+        # multipart copy. parts are copied concurrently. aborted on failure.
+        create_args = dict(ContentType=orig_ct, Metadata=new_meta, **copy_attr)
+        copy_result = transfers.s3_multipart_copy(client, src_bucket, src_key, dst_bucket, dst_key, total_len,
+                                                  create_args=create_args,
+                                                  part_args={'CopySourceIfMatch': resp['ETag']},
+                                                  threads=COPY_THREADS)
+        log.info("copy result: %s", copy_result)
+        log.info("copy completed in %8.3fseconds", time.time() - start_time)
 
+        # check final object
+        head_attempts = 0
+        head_res2 = None
+        while head_attempts < 5:
+            try:
+                head_attempts += 1
+                head_res2 = client.head_object(Bucket=dst_bucket, Key=dst_key, IfMatch=copy_result['ETag'])
+                break
+            except ClientError as clierr:
+                if clierr.response['Error']['Code'] == '412':
+                    # bad ETag -- retrieved old version
+                    time.sleep(5.0)
+                    continue
+                log.error("client error: %s code=%s", str(clierr), clierr.response['Error']['Code'])
+                raise
+
+        if head_res2:
+            assert head_res['ContentLength'] == head_res2['ContentLength']
+            obj_date = head_res2['ResponseMetadata']['HTTPHeaders']['last-modified']
+        else:
+            log.error("could not retrieve obj HEAD")
+            obj_date = copy_result['ResponseMetadata']['HTTPHeaders']['date']
+
+        return _form_response(dst_bucket, dst_key, head_res['ContentLength'],
+                              obj_date,
+                              copy_result['ETag'],
+                              new_meta, stats=stats)
@@ -6,6 +6,7 @@ import bunnies.jobs
 import bunnies.environment
 import bunnies.kvstore
 import bunnies.migrate
+import bunnies.usage
 
 log = logging.getLogger(__package__)
 
@@ -21,6 +22,7 @@ def main():
     bunnies.environment.configure_parser(subparsers)
     bunnies.kvstore.configure_parser(subparsers)
     bunnies.migrate.configure_parser(subparsers)
+    bunnies.usage.configure_parser(subparsers)
     args = parser.parse_args(sys.argv[1:])
 
     if args.command is None:
@@ -15,6 +15,12 @@ IMPORT_DIGESTS_HEADER = "import-digests"
 MB = 1024 * 1024
 MAX_SINGLE_UPLOAD_SIZE = 5 * (1024 ** 3)
 UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", "0"), 10) or 6*MB
+# part size of server-side multipart copies
+COPY_PART_SIZE = int(os.environ.get("COPY_PART_SIZE", "0"), 10) or 256*MB
+
+# size of the HTTP connection pool of each shared AWS client (see utils.aws_client).
+# this should be at least as large as the largest thread pool issuing calls concurrently.
+MAX_POOL_CONNECTIONS = int(os.environ.get("BUNNIES_MAX_POOL_CONNECTIONS", "0"), 10) or 50
 
 
 CE_ECS_INSTANCE_ROLE = "bunnies-ecs-instance-role"
@@ -27,6 +33,23 @@ CE_INSTANCE_PROFILE = "bunnies-batch-instance-profile"
 # to represent the "kind" of graph object serialized
 MANIFEST_KIND_ATTR = "_kind"
 
+# manifest v2: a flat table of graph nodes, keyed by canonical id.
+# nodes refer to each other with {MANIFEST_REF_ATTR: "<node name>"}.
+#
+# {
+#   "_kind": MANIFEST_TABLE_KIND,
+#   "version": 2,
+#   "root": "<node name>",
+#   "nodes": {
+#      "<node name>": {"_kind": "...", ..., "inputs": {"x": {"_kind": "bunnies.Input", "node": {"_ref": "..."}}}}
+#   }
+# }
+#
+# v1 manifests (a single nested document) are still understood by unmarshall.
+MANIFEST_TABLE_KIND = "bunnies.ManifestTable"
+MANIFEST_REF_ATTR = "_ref"
+MANIFEST_VERSION = 2
+
 #
 # result file -- if this file exists, the transform has completed successfully
 # and _all_ of its outputs have been successfully saved)
@@ -43,3 +66,34 @@ MANIFEST_KIND_ATTR = "_kind"
 TRANSFORM_RESULT_FILE = PLATFORM + ".transform-result.json"
 JOB_USAGE_FILE = PLATFORM + ".usage.json"
 JOB_LOGS_PREFIX = PLATFORM + ".job."
+
+#
+# sidecar index of blob digests, one per s3 "directory". see digest_index.py
+# set BUNNIES_DIGEST_INDEX=0 to always consult object metadata instead.
+#
+# indexes are only written with conditional writes (PutObject IfMatch/IfNoneMatch),
+# which need botocore 1.36 or later. with the boto3 pinned by the "build" extra
+# (setup.py), indexes written elsewhere (e.g. by the data-rehash lambda) are read,
+# but imports are not recorded.
+#
+DIGEST_INDEX_FILE = PLATFORM + ".digests.jsonl"
+USE_DIGEST_INDEX = os.environ.get("BUNNIES_DIGEST_INDEX", "1") != "0"
+
+# jobscripts carry the result documents of their upstream transforms (see graph.embed_results).
+# when set, jobs check each embedded result's ETag before trusting it.
+VERIFY_EMBEDDED_RESULTS = os.environ.get("BUNNIES_VERIFY_RESULTS", "0") != "0"
+
+# chrome trace of the phases of pipeline builds (see tracing.py). none if empty.
+TRACE_FILE = os.environ.get("BUNNIES_TRACE", "") or None
+
+# builds keep the vcpus requested by the jobs in flight under this multiple of the
+# compute environment's max_vcpus (see scheduler.Admission)
+ADMISSION_VCPU_FACTOR = float(os.environ.get("BUNNIES_ADMISSION_FACTOR", "0")) or 1.2
+
+# local database of the usage of past jobs. see usage.py
+USAGE_DB = os.environ.get("BUNNIES_USAGE_DB", "") or os.path.expanduser("~/.bunnies/usage.sqlite3")
+
+# where the submission records of jobs are kept (see kvstore.BACKENDS). "dynamodb" is
+# shared by builders on many hosts, "sqlite" by the builders of a single host.
+KV_BACKEND = os.environ.get("BUNNIES_KV_BACKEND", "") or "dynamodb"
+KV_DB = os.environ.get("BUNNIES_KV_DB", "") or os.path.expanduser("~/.bunnies/kv.sqlite3")
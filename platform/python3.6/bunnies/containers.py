@@ -2,9 +2,8 @@
 # Tools to manipulate docker container images
 #
 from .constants import PLATFORM
-from .utils import data_files, run_cmd
+from .utils import data_files, run_cmd, aws_client
 
-import boto3
 from botocore.exceptions import ClientError
 
 import os.path
@@ -17,7 +16,7 @@ log = logging.getLogger(__name__)
 
 def _docker_login_to_registry(registry_id, registry_uri):
     log.debug("authenticating docker client to registry id %s url %s...", registry_id, registry_uri)
-    client = boto3.client('ecr')
+    client = aws_client('ecr')
     token = client.get_authorization_token(registryIds=[registry_id])
     decoded_user_pass = base64.b64decode(token['authorizationData'][0]['authorizationToken']).decode('utf-8')
     user, passwd = decoded_user_pass.split(":", 1)
@@ -57,7 +56,7 @@ def wrap_user_image(src_image):
 
     # ensure repo creation
     log.info("image will be hosted in ECR repository %s ...", dst_repo)
-    client = boto3.client("ecr")
+    client = aws_client('ecr')
     try:
         resp = client.create_repository(repositoryName=dst_repo)['repository']
         # perhaps a version mismatch? boto 1.9.35 claims that "tags" keyword
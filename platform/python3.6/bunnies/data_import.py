@@ -6,8 +6,8 @@ import os.path
 import logging
 import json
 import time
-import boto3
-import botocore
+import threading
+import concurrent.futures
 from botocore.exceptions import ClientError
 import uuid
 import bunnies
@@ -17,6 +17,7 @@ from . import lambdas
 from . import utils
 from . import transfers
 from . import constants
+from . import digest_index
 
 from .exc import BunniesException, NoSuchFile
 
@@ -62,12 +63,34 @@ def guess_length(fp):
         except Exception:
             log.error("could not reset file position in %s.", fp)
 
+def resolve_dst(src_url, dst_url):
+    """if dst_url is a key prefix (directory), append the source basename to it"""
+    if dst_url.endswith("/") or urlparse(dst_url).path == "":
+        return os.path.join(dst_url, os.path.basename(urlparse(src_url).path))
+    return dst_url
+
+
+def final_url(result, src_url, dst_url):
+    """the url of the blob an import created, from its result (see DataImport.import_file)"""
+    if result.get('Bucket') and result.get('Key'):
+        return "s3://%s/%s" % (result['Bucket'], result['Key'])
+    return resolve_dst(src_url, dst_url)
+
+
+# digests computed on every local file imported directly
+DIRECT_IMPORT_DIGESTS = ("md5", "sha1", "sha256")
+
+
 class DataImport(object):
 
     """Methods to import data from various sources into AWS (S3)"""
 
-    def __init__(self):
+    def __init__(self, lambda_retries=3, direct_local=True, update_index=True):
         self.num_imports = 0
+        self.lambda_retries = lambda_retries  # retries on transient lambda invocation errors
+        self.direct_local = direct_local      # local files skip the temp object and remote rehash
+        self.update_index = update_index      # record imported blobs in their directory's digest index
+        self._lock = threading.Lock()
 
     # TODO The point of making this into a class is to attribute
     #      a context to the data import operations. This is important
@@ -76,17 +99,19 @@ class DataImport(object):
 
     def __delete(self, objecturl, logprefix=""):
         logpad = logprefix + " " if logprefix else ""
-        session = boto3.session.Session()
-        s3 = session.client('s3', config=botocore.config.Config(read_timeout=300, retries={'max_attempts': 0}))
         bucketname, keyname = utils.s3_split_url(objecturl)
-        s3 = boto3.client('s3')
+        s3 = utils.aws_client('s3')
         log.info("%sS3-DELETE bucket:%s key:%s", logpad, bucketname, keyname)
         return s3.delete_object(Bucket=bucketname, Key=keyname)
 
-    def __match_existing(self, s3url, expected_digests, expected_len=-1, expected_ct=None, expected_ce=None, logprefix=""):
+    def __match_existing(self, s3url, expected_digests, expected_len=-1, expected_ct=None, expected_ce=None,
+                         carried_only=False, logprefix=""):
         """
         Retrieve the information from the target object in S3 (if any). If present,
         ensure it matches what is expected.
+
+        With carried_only, expected digests which the object doesn't carry are not
+        compared (e.g. sha256 on objects created by data-rehash). md5 always is.
         """
         head_res = utils.get_blob_meta(s3url, logprefix=logprefix)
         log.info("RES %s", head_res)
@@ -106,10 +131,12 @@ class DataImport(object):
         head_digests = {key[len(constants.DIGEST_HEADER_PREFIX):]: val for key, val in head_res['Metadata'].items()
                         if key.startswith(constants.DIGEST_HEADER_PREFIX)}
         for dtype, dhex in expected_digests.items():
+            if carried_only and dtype != "md5" and dtype not in head_digests:
+                continue
             if dhex:
-                if dhex != head_digests[dtype]:
+                if dhex != head_digests.get(dtype, None):
                     raise ImportError("destination %s exists. %s digest mismatch: destination has %s, but expected %s" % (
-                        s3url, dtype, head_digests[dtype], dhex))
+                        s3url, dtype, head_digests.get(dtype, None), dhex))
                 else:
                     digest_verifications += 1
 
@@ -136,7 +163,9 @@ class DataImport(object):
             "dst_bucket": cpy_dst[0],
             "dst_key": cpy_dst[1],
             "src_etag": src_etag,
-            "digests": dict(match_digests)
+            "digests": dict(match_digests),
+            # imports are recorded in the digest index by the client (see import_many)
+            "index": False
         }
 
         # compute at least sha1 and md5
@@ -144,7 +173,7 @@ class DataImport(object):
         new_req["digests"].setdefault("md5", None)
 
         log.debug("%sdata-rehash request: %s", logpad, json.dumps(new_req, sort_keys=True, indent=4, separators=(",", ": ")))
-        code, response = lambdas.invoke_sync(lambdas.DATA_REHASH, Payload=new_req)
+        code, response = lambdas.invoke_sync(lambdas.DATA_REHASH, Payload=new_req, retries=self.lambda_retries)
         data = response['Payload'].read().decode("ascii")
         if code != 0:
             raise ImportError("data-rehash failed to complete: %s" % (data,))
@@ -253,6 +282,12 @@ class DataImport(object):
                     except NoSuchFile:
                         pass
 
+                if self.direct_local and transfers.supports_param(utils.aws_client('s3'), "CompleteMultipartUpload",
+                                                                  "IfNoneMatch"):
+                    return self.__upload_local_direct(in_fp, dst_url, expected_digests, content_type=content_type,
+                                                      content_encoding=content_encoding, content_length=content_length,
+                                                      logprefix=logprefix)
+
                 start_time = time.time()
                 # only run the MD5 algorithm
                 pipe_fp = transfers.HashingReader(in_fp, algorithms=("md5",))
@@ -305,6 +340,78 @@ class DataImport(object):
         finally:
             self.__delete(tmp_url)
 
+    def __upload_local_direct(self, in_fp, dst_url, expected_digests, content_type=None, content_encoding=None,
+                              content_length=-1, logprefix=""):
+        """upload the open local file straight to its final destination.
+
+           all digests are computed locally and checked against the expected ones before any
+           data is sent. the object is then created with its digest metadata in one conditional
+           upload, which replaces the temporary object and the data-rehash copy. s3 clients which
+           can't make conditional writes take the temporary object path instead.
+        """
+        logpad = logprefix + " " if logprefix else ""
+        algorithms = sorted(set(DIRECT_IMPORT_DIGESTS) | set(expected_digests.keys()))
+
+        # digests are needed up front, to be part of the object metadata.
+        start_time = time.time()
+        hash_fp = transfers.HashingReader(in_fp, algorithms=algorithms)
+        try:
+            for _ in transfers.yield_in_chunks(hash_fp, constants.UPLOAD_CHUNK_SIZE):
+                pass
+            local_len = hash_fp.tell()
+            local_digests = hash_fp.hexdigests()
+        finally:
+            hash_fp.release()
+        delta_t = time.time() - start_time
+        log.info("%shashed %s bytes in %8.3f seconds. (%8.3f MB/s)", logpad, local_len,
+                 delta_t, local_len / (1024*1024*(delta_t+0.00001)))
+
+        if content_length >= 0 and content_length != local_len:
+            raise ImportError("length mismatch: read %s bytes but expected %s" % (local_len, content_length))
+
+        for algo, expected_digest in expected_digests.items():
+            if local_digests[algo] != expected_digest:
+                log.error("%s%s digest mismatch: got %s but expected %s", logpad, algo, local_digests[algo],
+                          expected_digest)
+                raise ImportError("%s digest mismatch: got %s but expected %s" % (
+                    algo, local_digests[algo], expected_digest))
+            log.info("%s%s digest match OK: %s", logpad, algo, expected_digest)
+
+        meta = {constants.DIGEST_HEADER_PREFIX + algo: hexdigest for algo, hexdigest in local_digests.items()}
+        meta[constants.IMPORT_DIGESTS_HEADER] = ",".join(sorted(expected_digests.keys()))
+
+        in_fp.seek(0)
+        pipe_fp = transfers.HashingReader(in_fp, algorithms=("md5",))
+        start_time = time.time()
+        try:
+            transfers.s3_streaming_put(pipe_fp, dst_url, content_type=content_type, content_encoding=content_encoding,
+                                       content_length=local_len, meta=meta, logprefix=logprefix, if_none_match="*")
+        except ClientError as clierr:
+            if clierr.response['Error']['Code'] != "PreconditionFailed":
+                raise
+            # created concurrently. it must hold the same data.
+            log.info("%sdestination %s was created concurrently. verifying.", logpad, dst_url)
+            return self.__match_existing(dst_url, local_digests, expected_len=local_len, carried_only=True,
+                                         logprefix=logprefix)
+        finally:
+            pipe_fp.close()
+
+        delta_t = time.time() - start_time
+        log.info("%sPUT completed in %8.3f seconds. (%8.3f MB/s)", logpad,
+                 delta_t, local_len / (1024*1024*(delta_t+0.00001)))
+
+        # the file must not have changed between the two reads
+        sent_md5 = pipe_fp.hexdigests()['md5']
+        if pipe_fp.tell() != local_len or sent_md5 != local_digests['md5']:
+            # the conditional upload created it: the destination is ours to remove
+            log.error("%s%s changed during upload. removing destination.", logpad, dst_url)
+            self.__delete(dst_url, logprefix=logprefix)
+            raise ImportError("source file changed during upload to %s" % (dst_url,))
+
+        head_res = utils.get_blob_meta(dst_url, logprefix=logprefix)
+        head_res['digests'] = local_digests
+        return head_res
+
     def __upload_remote_file(self, src_url, dst_url, digest_urls=None, logprefix=""):
         """import an http(s)/ftp file
 
@@ -323,7 +430,7 @@ class DataImport(object):
         }
 
         log.info("%sdata-import request: %s", logpad, json.dumps(req, sort_keys=True, indent=4, separators=(",", ": ")))
-        code, response = lambdas.invoke_sync(lambdas.DATA_IMPORT, Payload=req)
+        code, response = lambdas.invoke_sync(lambdas.DATA_IMPORT, Payload=req, retries=self.lambda_retries)
         data = response['Payload'].read().decode("ascii")
         if code != 0:
             raise BunniesException("data-import failed to complete: %s" % (data,))
@@ -347,7 +454,7 @@ class DataImport(object):
     def ensure_bucket(self, bucket_name, **kwargs):
         default_region = utils.user_region()
         try:
-            s3 = boto3.client("s3")
+            s3 = utils.aws_client('s3')
             bucket_cfg = kwargs.setdefault("CreateBucketConfiguration", {})
             bucket_cfg.setdefault("LocationConstraint", default_region)
             s3.create_bucket(Bucket=bucket_name, **kwargs)
@@ -384,25 +491,150 @@ class DataImport(object):
 
            Returns the equivalent of a head object on the final destination.
         """
+        result = self._import_file(src_url, dst_url, digest_urls=digest_urls)
+        if self.update_index:
+            digest_index.record(final_url(result, src_url, dst_url), result)
+        return result
+
+    def _import_file(self, src_url, dst_url, digest_urls=None):
+        """import_file(), without recording the destination in its digest index"""
         src_parsed = urlparse(src_url)
         dst_parsed = urlparse(dst_url)
         if dst_parsed.scheme != "s3":
             raise ValueError("destination must be on s3")
 
-        logprefix = "[#%04d %s]" % (self.num_imports, os.path.split(src_parsed.path)[1])
-        self.num_imports += 1
+        with self._lock:
+            logprefix = "[#%04d %s]" % (self.num_imports, os.path.split(src_parsed.path)[1])
+            self.num_imports += 1
 
         if src_parsed.scheme in ("http", "https", "ftp"):
-            return self.__upload_remote_file(src_url, dst_url, digest_urls=digest_urls, logprefix=logprefix)
-
-        if src_parsed.scheme in ("s3",):
-            return self.__upload_s3_file(src_url, dst_url, digest_urls=digest_urls, logprefix=logprefix)
-
-        if src_parsed.scheme in ("file",):
-            return self.__upload_local_file(src_url, dst_url, digest_urls=digest_urls, logprefix=logprefix)
-
-        if src_parsed.scheme == "":
+            result = self.__upload_remote_file(src_url, dst_url, digest_urls=digest_urls, logprefix=logprefix)
+        elif src_parsed.scheme in ("s3",):
+            result = self.__upload_s3_file(src_url, dst_url, digest_urls=digest_urls, logprefix=logprefix)
+        elif src_parsed.scheme in ("file",):
+            result = self.__upload_local_file(src_url, dst_url, digest_urls=digest_urls, logprefix=logprefix)
+        elif src_parsed.scheme == "":
             # assume file
-            return self.__upload_local_file("file://" + src_url, dst_url, digest_urls=digest_urls, logprefix=logprefix)
+            result = self.__upload_local_file("file://" + src_url, dst_url, digest_urls=digest_urls,
+                                              logprefix=logprefix)
+        else:
+            raise ValueError("unrecognized scheme: %s" % (src_url,))
+        return result
+
+    def __existing_match(self, dst_url, digest_urls, entry=None, logprefix=""):
+        """returns the head of dst_url if it exists and matches the inline digests given, None otherwise.
+           raises ImportError if the destination exists but does not match.
 
-        raise ValueError("unrecognized scheme: %s" % (src_url,))
+           entry is the digest index entry of dst_url, validated against the directory
+           listing (see digest_index.lookup_many). if its digests match, no HEAD is needed.
+        """
+        try:
+            expected_digests = utils.parse_digests([v for v in (digest_urls or {}).values()])
+        except ValueError:
+            # digests given as urls. can't tell without fetching them.
+            return None
+        if not expected_digests or dst_url.endswith("/"):
+            return None
+
+        if entry and all(entry['digests'].get(algo) == hexdigest for algo, hexdigest in expected_digests.items()):
+            log.info("%s%s matches its digest index entry. skipping.", logprefix + " " if logprefix else "", dst_url)
+            return {'ContentLength': entry['size'], 'ETag': entry['etag'], 'digests': dict(entry['digests'])}
+        try:
+            return self.__match_existing(dst_url, expected_digests, logprefix=logprefix)
+        except NoSuchFile:
+            return None
+
+    def import_many(self, requests, concurrency=8):
+        """import many files concurrently.
+
+           requests is a list of dicts with the arguments of import_file():
+              {'src_url': ..., 'dst_url': ..., 'digest_urls': {...}}
+
+           requests with identical inline source digests (or identical source urls) are
+           imported only once. the other destinations are server-side copies of the first.
+           destinations which already exist with matching digests are skipped.
+           the destinations are recorded in their directory's digest index at the end,
+           with one update per directory.
+
+           Returns one result per request, in the same order:
+              {'src_url': ..., 'dst_url': ...,
+               'status': "imported" | "copied" | "exists" | "error",
+               'result': head object equivalent of the destination (None on error),
+               'error': None or the error message,
+               'elapsed_s': seconds spent on this request}
+        """
+        requests = [dict(req) for req in requests]
+        groups = {}
+        for i, req in enumerate(requests):
+            src_url, dst_url = req['src_url'], req['dst_url']
+            req['dst_url'] = resolve_dst(src_url, dst_url)
+            try:
+                digests = utils.parse_digests([v for v in (req.get('digest_urls') or {}).values()])
+            except ValueError:
+                digests = {}
+            key = tuple(sorted(digests.items())) if digests else src_url
+            groups.setdefault(key, []).append(i)
+
+        indexed = {}
+        if constants.USE_DIGEST_INDEX:
+            # one GET and one LIST per destination directory
+            indexed = digest_index.lookup_many([req['dst_url'] for req in requests], fresh=True)
+
+        results = [None] * len(requests)
+
+        def _one(i, copy_from=None):
+            req = requests[i]
+            start_time = time.time()
+            logprefix = "[%s]" % (os.path.basename(req['dst_url']),)
+            status, result, error = "error", None, None
+            try:
+                result = self.__existing_match(req['dst_url'], req.get('digest_urls'),
+                                               entry=indexed.get(req['dst_url'], None), logprefix=logprefix)
+                if result is not None:
+                    status = "exists"
+                elif copy_from:
+                    result = transfers.s3_copy_object(copy_from, req['dst_url'], logprefix=logprefix)
+                    status = "copied"
+                else:
+                    result = self._import_file(req['src_url'], req['dst_url'], digest_urls=req.get('digest_urls'))
+                    status = "imported"
+            except Exception as exc:
+                log.error("%s import of %s failed: %s", logprefix, req['src_url'], exc, exc_info=exc)
+                error = str(exc)
+            results[i] = {
+                'src_url': req['src_url'],
+                'dst_url': req['dst_url'],
+                'status': status,
+                'result': result,
+                'error': error,
+                'elapsed_s': time.time() - start_time
+            }
+            return results[i]
+
+        def _group(indices):
+            first = _one(indices[0])
+            for i in indices[1:]:
+                if requests[i]['dst_url'] == requests[indices[0]]['dst_url']:
+                    results[i] = dict(first, elapsed_s=0.0)
+                elif first['status'] != "error":
+                    _one(i, copy_from=requests[indices[0]]['dst_url'])
+                else:
+                    _one(i)
+
+        log.info("importing %d file(s) (%d distinct sources) with %d threads...",
+                 len(requests), len(groups), concurrency)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+            futures = [executor.submit(_group, indices) for indices in groups.values()]
+            for done_count, future in enumerate(concurrent.futures.as_completed(futures)):
+                future.result()
+                log.info("progress: %d/%d source(s) done.", done_count + 1, len(futures))
+
+        if self.update_index:
+            digest_index.record_many({final_url(res['result'], res['src_url'], res['dst_url']): res['result']
+                                      for res in results if res['status'] != "error" and
+                                      res['dst_url'] not in indexed})
+
+        errors = [res for res in results if res['status'] == "error"]
+        if errors:
+            log.error("%d import(s) out of %d failed.", len(errors), len(results))
+        return results
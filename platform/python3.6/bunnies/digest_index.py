@@ -0,0 +1,275 @@
+"""
+   Sidecar index of blob digests.
+
+   Each s3 "directory" can hold an index file (constants.DIGEST_INDEX_FILE) listing
+   the size, etag and digests of the blobs imported or rehashed under it. It is a
+   sorted JSON-lines file, one blob per line:
+
+     {"digests":{"md5":"...","sha1":"..."},"etag":"\"...\"","key":"reads_R1.fq.gz","size":123}
+
+   Looking up the digests of many blobs costs one GET and one LIST per directory,
+   instead of one HEAD per blob. The index is a cache of the x-amz-meta-digest-*
+   headers: those remain authoritative. An entry is only used while the directory
+   listing shows its blob with the same etag and size, so blobs deleted or rewritten
+   after they were indexed are looked up again.
+
+   Writes are conditional on the etag of the index read, and are skipped (not
+   forced) where the s3 client cannot make them: they need botocore 1.36 or later,
+   newer than the boto3 pinned by the "build" extra (see constants.USE_DIGEST_INDEX).
+"""
+import json
+import logging
+import os.path
+import random
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from . import constants
+from . import utils
+from .exc import BunniesException
+from .transfers import supports_param
+
+log = logging.getLogger(__name__)
+
+
+def index_url(blob_url):
+    """url of the index file covering the given blob url"""
+    bucket, key = utils.s3_split_url(blob_url)
+    prefix = os.path.dirname(key)
+    return "s3://%s/%s" % (bucket, os.path.join(prefix, constants.DIGEST_INDEX_FILE) if prefix
+                           else constants.DIGEST_INDEX_FILE)
+
+
+def _dir_prefix(url):
+    """(bucket, key prefix of the directory) of an index url"""
+    bucket, key = utils.s3_split_url(url)
+    prefix = os.path.dirname(key)
+    return bucket, prefix + "/" if prefix else ""
+
+
+def entry_from_head(head_res):
+    """builds an index entry (without key) from a head object response, or a data-rehash response"""
+    digests = head_res.get('digests', None)
+    if not digests:
+        pfx = constants.DIGEST_HEADER_PREFIX
+        digests = {key[len(pfx):]: val for key, val in head_res.get('Metadata', {}).items()
+                   if key.startswith(pfx)}
+    return {
+        "size": head_res['ContentLength'],
+        "etag": head_res['ETag'],
+        "digests": dict(digests)
+    }
+
+
+class DigestIndex(object):
+    """the digests of the blobs in one s3 directory"""
+
+    __slots__ = ("url", "entries", "etag", "loaded")
+
+    def __init__(self, url):
+        self.url = url        # url of the index file
+        self.entries = {}     # basename => entry
+        self.etag = None      # etag of the index file when loaded. None if absent.
+        self.loaded = False
+
+    def load(self):
+        bucket, key = utils.s3_split_url(self.url)
+        s3 = utils.aws_client('s3')
+        try:
+            resp = s3.get_object(Bucket=bucket, Key=key)
+        except ClientError as clierr:
+            if clierr.response['Error']['Code'] not in ("NoSuchKey", "404"):
+                raise
+            self.entries, self.etag = {}, None
+        else:
+            with resp['Body'] as body:
+                lines = body.read().decode('utf-8').splitlines()
+            self.entries = {}
+            for line in lines:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                self.entries[entry.pop('key')] = entry
+            self.etag = resp['ETag']
+        self.loaded = True
+        return self
+
+    def get(self, blob_url):
+        """the entry for the given blob url, or None"""
+        if not self.loaded:
+            self.load()
+        return self.entries.get(os.path.basename(utils.s3_split_url(blob_url)[1]), None)
+
+    def serialize(self):
+        lines = [json.dumps(dict(entry, key=key), sort_keys=True, separators=(",", ":"))
+                 for key, entry in sorted(self.entries.items())]
+        return ("\n".join(lines) + "\n").encode('utf-8') if lines else b""
+
+    def _save(self):
+        bucket, key = utils.s3_split_url(self.url)
+        s3 = utils.aws_client('s3')
+        if self.etag is None:
+            cond = {'IfNoneMatch': "*"}
+        else:
+            cond = {'IfMatch': self.etag}
+        resp = s3.put_object(Bucket=bucket, Key=key, Body=self.serialize(),
+                             ContentType="application/x-ndjson", **cond)
+        self.etag = resp['ETag']
+
+    def update(self, new_entries, attempts=10):
+        """merges {blob_url: entry} into the index, and saves it.
+           concurrent updates are detected with conditional writes, and retried.
+
+           returns True if the index was modified.
+        """
+        s3 = utils.aws_client('s3')
+        if not (supports_param(s3, "PutObject", "IfNoneMatch") and supports_param(s3, "PutObject", "IfMatch")):
+            # an unconditional write could drop the entries of a concurrent update
+            log.warning("s3 client cannot make conditional writes (botocore 1.36+). not updating digest index %s.",
+                        self.url)
+            return False
+
+        for attempt in range(attempts):
+            self.load()
+            changed = False
+            for blob_url, entry in new_entries.items():
+                name = os.path.basename(utils.s3_split_url(blob_url)[1])
+                if self.entries.get(name, None) != entry:
+                    self.entries[name] = entry
+                    changed = True
+            if not changed:
+                return False
+            try:
+                self._save()
+                return True
+            except ClientError as clierr:
+                if clierr.response['Error']['Code'] not in ("PreconditionFailed", "ConditionalRequestConflict"):
+                    raise
+                log.debug("concurrent update of %s (attempt %d). retrying.", self.url, attempt + 1)
+                time.sleep(random.uniform(0.1, 0.5) * (attempt + 1))
+        raise BunniesException("could not update digest index %s after %d attempts" % (self.url, attempts))
+
+
+def load_index(url):
+    """returns the loaded DigestIndex at url. indexes are loaded once per process."""
+    with load_index.lock:
+        index = load_index.cache.get(url, None)
+        if index is None:
+            index = load_index.cache[url] = DigestIndex(url)
+    if not index.loaded:
+        try:
+            index.load()
+        except Exception as exc:
+            # unreadable indexes are treated as empty
+            log.warning("could not load digest index %s: %s", url, exc)
+            index.entries, index.loaded = {}, True
+    return index
+
+
+load_index.cache = {}
+load_index.lock = threading.Lock()
+
+
+def load_listing(url):
+    """{basename: (etag, size)} of the blobs in the directory of the index at url.
+       listings are made once per process.
+    """
+    with load_listing.lock:
+        listing = load_listing.cache.get(url, None)
+    if listing is None:
+        bucket, prefix = _dir_prefix(url)
+        listing = {}
+        paginator = utils.aws_client('s3').get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter="/"):
+            for info in page.get('Contents', []):
+                listing[info['Key'][len(prefix):]] = (info['ETag'], info['Size'])
+        with load_listing.lock:
+            load_listing.cache[url] = listing
+    return listing
+
+
+load_listing.cache = {}
+load_listing.lock = threading.Lock()
+
+
+def _forget(url):
+    """drops the cached index and listing of a directory"""
+    with load_index.lock:
+        load_index.cache.pop(url, None)
+    with load_listing.lock:
+        load_listing.cache.pop(url, None)
+
+
+def lookup_many(blob_urls, fresh=False):
+    """resolves the index entries of many blobs, with one GET and one LIST per distinct directory.
+       with fresh, indexes and listings cached by earlier lookups are read again.
+
+       returns {blob_url: entry} for the blobs listed in their index, whose etag and size
+       still match the directory listing.
+    """
+    by_index = {}
+    for blob_url in blob_urls:
+        by_index.setdefault(index_url(blob_url), []).append(blob_url)
+
+    found = {}
+    for url, urls in by_index.items():
+        if fresh:
+            _forget(url)
+        index = load_index(url)
+        entries = {blob_url: index.get(blob_url) for blob_url in urls}
+        if not any(entries.values()):
+            continue
+        try:
+            listing = load_listing(url)
+        except Exception as exc:
+            log.warning("could not list the directory of %s: %s", url, exc)
+            continue
+        for blob_url, entry in entries.items():
+            if entry is None:
+                continue
+            if listing.get(os.path.basename(utils.s3_split_url(blob_url)[1]), None) != (entry['etag'], entry['size']):
+                log.debug("digest index entry of %s is stale. ignoring.", blob_url)
+                continue
+            found[blob_url] = entry
+    return found
+
+
+def lookup(blob_url):
+    """the index entry of a single blob, or None"""
+    return lookup_many([blob_url]).get(blob_url, None)
+
+
+def record_many(heads):
+    """records the blobs described by {blob_url: head_res} (see entry_from_head), with one
+       update per directory. failures are logged, but not raised: the index is an optimization.
+
+       returns the number of indexes modified.
+    """
+    by_index = {}
+    for blob_url, head_res in heads.items():
+        try:
+            entry = entry_from_head(head_res)
+        except KeyError:
+            continue
+        if entry['digests']:
+            by_index.setdefault(index_url(blob_url), {})[blob_url] = entry
+
+    changed = 0
+    for url, entries in by_index.items():
+        try:
+            index = DigestIndex(url)
+            if index.update(entries):
+                changed += 1
+            _forget(url)
+            with load_index.lock:
+                load_index.cache[url] = index
+        except Exception as exc:
+            log.warning("could not record %d blob(s) in digest index %s: %s", len(entries), url, exc)
+    return changed
+
+
+def record(blob_url, head_res):
+    """records a single blob. see record_many"""
+    return record_many({blob_url: head_res}) > 0
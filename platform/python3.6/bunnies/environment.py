@@ -8,7 +8,7 @@ import logging
 import os.path
 
 import base64
-import boto3
+import io
 import botocore
 import botocore.waiter
 import time
@@ -17,8 +17,11 @@ from botocore.exceptions import ClientError
 
 from .config import config
 from . import constants
-from .utils import data_files
+from .utils import data_files, aws_client
 from . import jobs
+from . import kvstore
+from . import runtime
+from . import transfers
 
 logger = logging.getLogger(__name__)
 
@@ -204,7 +207,7 @@ _custom_waiters.model = None
 def wait_batch_ce_ready(ce_names):
     """wait for the given batch environments to be valid and ready ready"""
     logger.info("waiting for batch environments %s to be ready...", ce_names)
-    client = boto3.client('batch')
+    client = aws_client('batch')
     waiter = botocore.waiter.create_waiter_with_client("ComputeEnvironmentReady", _custom_waiters(), client)
     waiter.wait(computeEnvironments=ce_names)
     logger.info("batch environments %s are ready", ce_names)
@@ -318,7 +321,7 @@ class FSxDisk(InstanceMount):
 
     def retrieve_existing(self):
         # FIXME -- the caller should inspect the state of the returned filesystem
-        client = boto3.client('fsx')
+        client = aws_client('fsx')
         page = {'NextToken': None}
 
         def _tags_match(name, tags):
@@ -388,7 +391,7 @@ class FSxDisk(InstanceMount):
                 return None
             fsid = fs['FileSystemId']
 
-        client = boto3.client('fsx')
+        client = aws_client('fsx')
         logger.info("Deleting file system %s (id=%s)...", self.name, fsid)
         client.delete_file_system(FileSystemId=fsid, ClientRequestToken=self.__token)
         self.__fs = None
@@ -403,7 +406,7 @@ class FSxDisk(InstanceMount):
             self.__fs = exists
         else:
             logger.info("creating Lustre FSx filesystem... Name=%s", self.name)
-            client = boto3.client('fsx')
+            client = aws_client('fsx')
             resp = client.create_file_system(
                 ClientRequestToken=self.__token,
                 FileSystemType="LUSTRE",
@@ -422,14 +425,14 @@ class FSxDisk(InstanceMount):
     def wait_allocated(self):
         """wait for the filesystem to be in the READY state"""
         logger.info("waiting for filesystem %s (id=%s) to be ready...", self.name, self.fsid)
-        client = boto3.client('fsx')
+        client = aws_client('fsx')
         waiter = botocore.waiter.create_waiter_with_client("FileSystemReady", _custom_waiters(), client)
         waiter.wait(FileSystemIds=[self.fsid])
         logger.info("filesystem(s) %s (id=%s) ready", self.name, self.fsid)
 
     def wait_deleted(self):
         """wait for the filesystem to be deleted completely"""
-        client = boto3.client('fsx')
+        client = aws_client('fsx')
         if self.fsid:
             logger.info("waiting for filesystem %s (id=%s) to be deleted...", self.name, self.fsid)
             waiter = botocore.waiter.create_waiter_with_client("FileSystemDeleted", _custom_waiters(), client)
@@ -452,6 +455,9 @@ class ComputeEnv(object):
         self.batch_ce = None
         self.max_vcpus = max_vcpus or 4096
         self.submissions = {}      # job_name: submitted_job_obj
+        self.tracker = jobs.JobPollTracker()  # last known state of submissions
+        self.preloaded_entries = {}  # job_name: kvstore.SubmissionEntry (see preload)
+        self.preloaded_jobs = {}     # job_id: job description, or None if batch no longer knows the job
         self.job_definitions = {}  # keyed by (name, image)
 
         if global_scratch_gb > 0:
@@ -486,18 +492,100 @@ class ComputeEnv(object):
             raise ValueError("job object has no id")
 
         self.submissions[job_name] = job_obj
+        # state unknown. it will be described on the next poll.
+        self.tracker.track(job_obj.job_id, expected_runtime=job_obj.meta.get('expected_runtime'),
+                           timeout=job_obj.meta.get('timeout'))
         return job_obj
 
-    def submit_simple_batch_job(self, job_name, job_def, **job_params):
+    def untrack_job(self, job_obj):
+        """stop following the status of a submitted job (e.g. once it's cancelled)"""
+        if self.submissions.get(job_obj.name, None) is job_obj:
+            del self.submissions[job_obj.name]
+        self.tracker.untrack(job_obj.job_id)
+
+    def submit_simple_batch_job(self, job_name, job_def, expected_runtime=None, **job_params):
+        """submit a new job to the environment's queue.
+
+           expected_runtime: the job duration in seconds, as measured on previous runs.
+                             it is used to pace status polls (see jobs.JobPollTracker).
+        """
         if job_name in self.submissions:
             raise ValueError("a job with that name has already been submitted: %s", job_name)
 
         job_obj = jobs.AWSBatchSimpleJob(job_name, job_def, **job_params)
         queue_arn = self.job_queue['jobQueueArn']
         job_obj.submit(queue_arn)
+        job_obj.meta['expected_runtime'] = expected_runtime
+        job_obj.meta['timeout'] = job_params.get('timeout', None)
         self.submissions[job_name] = job_obj
+        self.tracker.track(job_obj.job_id, state="SUBMITTED", expected_runtime=expected_runtime,
+                           timeout=job_obj.meta['timeout'])
         return job_obj
 
+    def submission_context(self, owner_name, jobname):
+        """context holding the submission record of a job (see kvstore.SubmissionEntry)"""
+        return kvstore.submission_context(owner_name, jobname, entry=self.preloaded_entries.pop(jobname, None))
+
+    def job_from_id(self, job_id):
+        """the submitted job with the given id, or None if batch no longer knows about it"""
+        if job_id in self.preloaded_jobs:
+            job_desc = self.preloaded_jobs.pop(job_id)
+            return jobs.AWSBatchSimpleJob.from_desc(job_desc) if job_desc is not None else None
+        return jobs.AWSBatchSimpleJob.from_job_id(job_id)
+
+    def preload(self, owner_name, job_names):
+        """fetches the submission records of the given jobs, and the batch jobs they refer to, in
+           bulk. the first submission_context() and job_from_id() of each are answered from them.
+        """
+        self.preloaded_entries = kvstore.load_entries(owner_name, job_names)
+        job_ids = [entry.jobdata for entry in self.preloaded_entries.values()
+                   if entry.jobdata and entry.jobtype == "batch"]
+        self.preloaded_jobs = {job_id: None for job_id in job_ids}
+        self.preloaded_jobs.update({job_desc['jobId']: job_desc for job_desc in jobs.describe_jobs(job_ids)})
+        logger.info("preloaded %d submission records, referring to %d batch jobs (%d still known)",
+                    len(self.preloaded_entries), len(job_ids),
+                    sum(1 for job_desc in self.preloaded_jobs.values() if job_desc is not None))
+
+    def executor_for(self, build_node, resources, depends_on=()):
+        """the environment to submit a job to. see executors.RoutingComputeEnv"""
+        return self
+
+    def stage_job(self, job_id, build_node, resources):
+        """uploads the job script of a build node, and the user context it runs with.
+           returns the environment variables locating them.
+        """
+        remote_script_url = "s3://%(bucket)s/jobs/%(envname)s/%(jobid)s/jobscript" % {
+            "bucket": config['storage']['tmp_bucket'],
+            "envname": self.name,
+            "jobid": job_id
+        }
+
+        user_deps_prefix = "s3://%(bucket)s/user_context/%(envname)s/" % {
+            "bucket": config['storage']['tmp_bucket'],
+            "envname": self.name
+        }
+
+        user_deps_url = runtime.upload_user_context(user_deps_prefix)
+
+        with io.BytesIO() as exec_fp:
+            script_len = exec_fp.write(build_node.execution_transfer_script(resources).encode('utf-8'))
+            exec_fp.seek(0)
+            logger.debug("  uploading job script for job_id %s at %s ...", job_id, remote_script_url)
+            transfers.s3_streaming_put(exec_fp, remote_script_url, content_type="text/x-python",
+                                       content_length=script_len, logprefix=job_id + " jobscript ")
+
+        return {
+            "BUNNIES_TRANSFER_SCRIPT": remote_script_url,
+            "BUNNIES_USER_DEPS": user_deps_url
+        }
+
+    def usage_collector(self):
+        """shares the lookups of queues, compute environments and instances between jobs"""
+        return jobs.UsageCollector()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
     def get_disk(self, diskname):
         if diskname in self.disks:
             return dict(self.disks[diskname])
@@ -625,7 +713,7 @@ cloud-init-per once docker_options echo 'OPTIONS="${OPTIONS} --default-ulimit no
             dirtag = ("disk-dir-%s" % (diskname,), disk['instance_mountpoint'])
             instance_tags += [dnstag, dirtag]
 
-        client = boto3.client("ec2")
+        client = aws_client('ec2')
         lt_userdata = self._generate_instance_boot_script()
 
         logger.info("creating ec2 launch template %s for environment %s", lt_name, self.name)
@@ -695,7 +783,7 @@ cloud-init-per once docker_options echo 'OPTIONS="${OPTIONS} --default-ulimit no
     @staticmethod
     def _find_matching_ce(name, top_level_match, comp_res_match, client=None):
         if not client:
-            client = boto3.client("batch")
+            client = aws_client('batch')
         # find a compute environment which matches the given settings
         paginator = client.get_paginator("describe_compute_environments")
         iterator = paginator.paginate()
@@ -739,7 +827,7 @@ cloud-init-per once docker_options echo 'OPTIONS="${OPTIONS} --default-ulimit no
 
 
     def _create_batch_ce(self):
-        client = boto3.client("batch")
+        client = aws_client('batch')
 
         ce_type = "SPOT" # "EC2"
 
@@ -833,7 +921,7 @@ cloud-init-per once docker_options echo 'OPTIONS="${OPTIONS} --default-ulimit no
 
         # find all compute-environments defined with that name
         def _find_matching_envs(name):
-            client = boto3.client('batch')
+            client = aws_client('batch')
             paginator = client.get_paginator("describe_compute_environments")
             iterator = paginator.paginate()
             found = []
@@ -852,7 +940,7 @@ cloud-init-per once docker_options echo 'OPTIONS="${OPTIONS} --default-ulimit no
 
             logger.debug("searching for launch templates with LaunchTemplateName=%s and instance_tags=%s", name, tags)
 
-            client = boto3.client("ec2")
+            client = aws_client('ec2')
             paginator = client.get_paginator("describe_launch_template_versions")
             template_iterator = paginator.paginate(LaunchTemplateName=name)
             found = []
@@ -900,7 +988,7 @@ cloud-init-per once docker_options echo 'OPTIONS="${OPTIONS} --default-ulimit no
         ce_arns = {ce['computeEnvironmentArn']: ce for ce in matching_ces}
         job_queue_names = [ce_name + "-jq" for ce_name in ce_names]
 
-        batch = boto3.client('batch')
+        batch = aws_client('batch')
 
         # - update job queues linked to one of the compute environments
         jobqueue_updates = {}
@@ -952,7 +1040,7 @@ cloud-init-per once docker_options echo 'OPTIONS="${OPTIONS} --default-ulimit no
                          ("compute_environment", self.name)]
         job_template_versions = _find_matching_launch_templates(lt_name, instance_tags)
 
-        ec2 = boto3.client('ec2')
+        ec2 = aws_client('ec2')
         lt_names = {version['LaunchTemplateName']: True for version in job_template_versions}
         for lt_name in lt_names:
             logger.info("deleting launch template name=%s", lt_name)
@@ -964,7 +1052,7 @@ cloud-init-per once docker_options echo 'OPTIONS="${OPTIONS} --default-ulimit no
                 LaunchTemplateName=lt_name
             )
         # delete compute env
-        ecs = boto3.client('ecs')
+        ecs = aws_client('ecs')
 
         deleted_clusters = []
         for ce in matching_ces:
@@ -1011,7 +1099,8 @@ cloud-init-per once docker_options echo 'OPTIONS="${OPTIONS} --default-ulimit no
 
     def wait_for_jobs(self, condition=None, interval=2*60):
         """
-        poll submitted jobs repeatedly (every `interval` seconds), until a condition is satisfied.
+        poll submitted jobs repeatedly (at most `interval` seconds apart), until a condition is satisfied.
+        each poll only describes the jobs which are due for an update (see jobs.JobPollTracker).
 
         condition(status_map) -> bool   (True if and only if the condition is satisfied)
         status_map is a dictionary of job states:
@@ -1038,12 +1127,14 @@ cloud-init-per once docker_options echo 'OPTIONS="${OPTIONS} --default-ulimit no
             logger.debug("waiting for job name=%s job_id=%s", job_name, job_obj.job_id)
 
         if self.submissions:
-            id_status = jobs.wait_for_jobs([job_id for job_id in id_map], condition=condition, interval=interval)
+            id_status = jobs.wait_for_jobs([job_id for job_id in id_map], condition=condition, interval=interval,
+                                           tracker=self.tracker)
 
             # convert Ids back into job objects
             obj_status = {}
             for state in id_status:
-                obj_status[state] = [(id_map[job_id], reason) for (job_id, reason) in id_status[state]]
+                obj_status[state] = [(id_map[job_id], reason) for (job_id, reason) in id_status[state]
+                                     if job_id in id_map]
 
             # clear submitted jobs from list of submissions.
             #
@@ -1055,6 +1146,7 @@ cloud-init-per once docker_options echo 'OPTIONS="${OPTIONS} --default-ulimit no
                 logger.debug("clearing %d submission(s)...", len(completed))
             for (job_obj, status) in completed:
                 del self.submissions[job_obj.name]
+                self.tracker.untrack(job_obj.job_id)
 
             return obj_status
 
@@ -1070,7 +1162,7 @@ cloud-init-per once docker_options echo 'OPTIONS="${OPTIONS} --default-ulimit no
 
 def _create_ecs_instance_role():
     # create ecs instance role
-    client = boto3.client("iam")
+    client = aws_client('iam')
     ecs_role_name = constants.CE_ECS_INSTANCE_ROLE
     logger.info("creating IAM role %s", ecs_role_name)
     try:
@@ -1099,7 +1191,7 @@ def _create_ecs_instance_role():
 
 def _create_ec2_spot_fleet_role():
     # allow bunnies ec2 to join spot fleets
-    client = boto3.client("iam")
+    client = aws_client('iam')
     role_name = constants.CE_SPOT_ROLE
     logger.info("creating IAM role %s", role_name)
     try:
@@ -1126,7 +1218,7 @@ def _create_ec2_spot_fleet_role():
 
 def _create_batch_service_role():
     # allow aws to issue batch calls for bunnies
-    client = boto3.client("iam")
+    client = aws_client('iam')
     role_name = constants.CE_BATCH_SERVICE_ROLE
 
     logger.info("creating IAM role %s", role_name)
@@ -1157,7 +1249,7 @@ def _create_batch_service_role():
 
 def _create_batch_instance_profile(instance_role_name):
     profile_name = constants.CE_INSTANCE_PROFILE
-    client = boto3.client("iam")
+    client = aws_client('iam')
     try:
         logger.info("creating instance profile %s", profile_name)
         client.create_instance_profile(InstanceProfileName=profile_name, Path="/")
@@ -1209,7 +1301,7 @@ def _setup_roles(**kwargs):
                 role_settings)
 
 def _list_env(**kwargs):
-    client = boto3.client('batch')
+    client = aws_client('batch')
 
     def _find_matching_envs():
         paginator = client.get_paginator("describe_compute_environments")
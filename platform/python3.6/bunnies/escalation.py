@@ -0,0 +1,98 @@
+"""
+   Classification of failed job attempts, and the adjustment of the resources of
+   the next attempt.
+
+   BuildNode.schedule() consults the build's EscalationPolicy before resubmitting a
+   failed job, so that jobs killed for lack of memory or time get more of it, without
+   each transform interpreting the attempt number in task_resources().
+"""
+import logging
+
+from . import jobs
+
+log = logging.getLogger(__name__)
+
+# kinds of failures
+OOM = "oom"                # killed for exceeding its memory
+TIMEOUT = "timeout"        # exceeded the attempt's timeout
+RECLAIMED = "reclaimed"    # the (spot) instance went away
+APPLICATION = "app"        # the job exited in error
+DEPENDENCY = "dependency"  # never ran: a job it depended on failed
+UNKNOWN = "unknown"
+
+OOM_EXIT_CODE = 137  # SIGKILL, sent by the OOM killer
+
+
+def last_attempt(job_desc):
+    """the last attempt of a described job, or an empty dict"""
+    attempts = job_desc.get('attempts', None) or []
+    return attempts[-1] if attempts else {}
+
+
+def classify(job_desc):
+    """the kind of failure of a described (FAILED) job. see jobs.AWSBatchSimpleJob.get_desc"""
+    reason = job_desc.get('statusReason', None) or ""
+    attempt = last_attempt(job_desc)
+    container = attempt.get('container', None) or {}
+    container_reason = container.get('reason', None) or ""
+    attempt_reason = attempt.get('statusReason', None) or ""
+
+    if jobs.is_dependency_failure(reason):
+        return DEPENDENCY
+    if reason.startswith(jobs.TIMEOUT_REASON) or attempt_reason.startswith(jobs.TIMEOUT_REASON):
+        return TIMEOUT
+    if container_reason.startswith("OutOfMemoryError") or container.get('exitCode', None) == OOM_EXIT_CODE:
+        return OOM
+    if any(r.startswith("Host EC2") and "terminated" in r for r in (reason, attempt_reason)):
+        return RECLAIMED
+    if container.get('exitCode', None) or reason.startswith(jobs.CONTAINER_EXIT_REASON):
+        return APPLICATION
+    return UNKNOWN
+
+
+class EscalationPolicy(object):
+    """the resources of the attempt following a failure.
+
+       memory_factor: multiplies the memory of the attempt killed for lack of memory
+       timeout_factor: multiplies the timeout of the attempt which timed out
+       max_memory (MiB), max_timeout (s): caps. None is unbounded.
+
+       escalations are relative to what the failed attempt ran with, so they compound
+       over successive attempts. other failures are retried with the resources
+       task_resources() asks for.
+    """
+    __slots__ = ("memory_factor", "timeout_factor", "max_memory", "max_timeout")
+
+    def __init__(self, memory_factor=1.5, timeout_factor=2.0, max_memory=None, max_timeout=None):
+        self.memory_factor = memory_factor
+        self.timeout_factor = timeout_factor
+        self.max_memory = max_memory
+        self.max_timeout = max_timeout
+
+    def escalate(self, resources, job_desc):
+        """returns a copy of resources (see Transform.task_resources) adjusted for the failure
+           of the described job.
+        """
+        kind = classify(job_desc)
+        resources = dict(resources)
+        container = job_desc.get('container', None) or {}
+
+        if kind == OOM:
+            previous = container.get('memory', None) or resources.get('memory', None)
+            if previous:
+                memory = int(previous * self.memory_factor)
+                if self.max_memory is not None:
+                    memory = min(memory, self.max_memory)
+                resources['memory'] = max(memory, resources.get('memory', None) or 0)
+
+        elif kind == TIMEOUT:
+            previous = (job_desc.get('timeout', None) or {}).get('attemptDurationSeconds', None) or \
+                resources.get('timeout', None)
+            if previous and previous > 0:
+                timeout = int(previous * self.timeout_factor)
+                if self.max_timeout is not None:
+                    timeout = min(timeout, self.max_timeout)
+                resources['timeout'] = max(timeout, resources.get('timeout', None) or 0)
+
+        log.debug("job %s failed (%s): next attempt with %s", job_desc.get('jobName', None), kind, resources)
+        return resources
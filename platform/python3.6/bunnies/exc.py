@@ -11,6 +11,10 @@ class NoSuchFile(BunniesException):
         super(NoSuchFile, self).__init__("no such file: " + url)
         self.url = url
 
+class SubmissionConflict(BunniesException):
+    """ a job's submission record was updated concurrently """
+    pass
+
 class IntegrityException(BunniesException):
     pass
 
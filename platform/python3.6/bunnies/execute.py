@@ -1,12 +1,12 @@
 import logging
-import boto3
 from .config import config
+from .utils import aws_client
 
 log = logging.getLogger(__package__)
 
 
 def ecs_describe_tasks(tasks):
-    ecs = boto3.client('ecs')
+    ecs = aws_client('ecs')
     cluster = config['cluster_arn']
     log.info("ECS-describe-tasks %s", ",".join(tasks))
     return ecs.describe_tasks(cluster=cluster, tasks=tasks)
@@ -16,7 +16,7 @@ def ecs_wait_for_tasks(tasks):
     if not isinstance(tasks, (list, tuple)):
         tasks = [tasks]
 
-    ecs = boto3.client('ecs')
+    ecs = aws_client('ecs')
     cluster = config['cluster_arn']
     waiter = ecs.get_waiter('tasks_stopped')
     waiter.wait(cluster=cluster, tasks=tasks, WaiterConfig={
@@ -52,7 +52,7 @@ def ecs_run_task(task_name, overrides=None):
     if overrides is None:
         overrides = []
 
-    ecs = boto3.client('ecs')
+    ecs = aws_client('ecs')
     cluster = config['cluster_arn']
 
     req = {
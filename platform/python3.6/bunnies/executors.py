@@ -0,0 +1,373 @@
+"""
+   Executors run the jobs of build nodes.
+
+   BuildNode.schedule() submits each job to the executor the compute environment
+   picks for it (ComputeEnv.executor_for). An executor provides:
+
+     stage_job(job_id, build_node, resources) -> {'BUNNIES_TRANSFER_SCRIPT': ..., 'BUNNIES_USER_DEPS': ...}
+     submit_simple_batch_job(job_name, job_def, expected_runtime=None, **job_params) -> job object
+     job_from_id(job_id), track_existing_job(job_obj), untrack_job(job_obj)
+     wait_for_jobs(condition=None, interval=...) -> {state: [(job_obj, reason), ...]}
+     collect(job_ids) -> {job_id: usage}  (see jobs.UsageCollector)
+
+   environment.ComputeEnv (aws batch) and simulate.SimComputeEnv are executors.
+   LocalPoolExecutor runs jobs on the build host, which spares small jobs the minutes
+   of batch scheduling. Pair it with batch using RoutingComputeEnv:
+
+   >>> build_pipeline(targets).build("run", local_executor=LocalPoolExecutor(max_workers=4))
+
+   Only jobs whose task_resources() opt in ('executor': "local") go to the local executor.
+   They run with the build host's python and tools, not in the container image of their
+   job definition. The build shuts the local executor down when it ends.
+"""
+import concurrent.futures
+import logging
+import os
+import os.path
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from . import jobs
+from . import kvstore
+from .exc import SubmissionConflict
+
+log = logging.getLogger(__name__)
+
+LOCAL_JOB_PREFIX = "local-"
+
+# the submission record of a running local job is claimed again this often (see LocalPoolExecutor.hold_claim)
+CLAIM_RENEWAL = kvstore.CLAIM_TTL / 4
+
+
+class LocalJob(object):
+    """a job run by a LocalPoolExecutor. mirrors jobs.AWSBatchSimpleJob"""
+
+    jobtype = "local"
+
+    __slots__ = ("executor", "name", "job_id", "overrides", "meta", "status", "reason", "exit_code",
+                 "created_at", "started_at", "stopped_at", "proc", "future", "claim")
+
+    def __init__(self, executor, name, **overrides):
+        self.executor = executor
+        self.name = name
+        self.job_id = LOCAL_JOB_PREFIX + str(uuid.uuid4())
+        self.overrides = overrides
+        self.meta = {}
+        self.status = "SUBMITTED"
+        self.reason = ""
+        self.exit_code = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.stopped_at = None
+        self.proc = None
+        self.future = None
+        self.claim = None
+
+    def get_desc(self, client=None):
+        return self.executor.describe(self)
+
+    def cancel(self, reason=None, terminate=True, client=None):
+        return self.executor.cancel(self, reason=reason)
+
+    def get_usage(self, collector=None):
+        return self.executor.collect([self.job_id])[self.job_id]
+
+
+class LocalPoolExecutor(object):
+    """runs the job scripts of small transforms in subprocesses of the build host, at most
+       max_workers at a time. the job scripts are the same as in batch containers: they
+       read their inputs and write their results to the storage repositories.
+
+       max_vcpus, max_memory (MiB): jobs requesting more are left to batch (see accepts)
+       workdir: parent of the jobs' working directories (default: a new temporary directory)
+
+       other builders can't look up the jobs of this executor. their submission records
+       stay claimed while they run (see hold_claim), so that they aren't submitted twice.
+    """
+
+    def __init__(self, max_workers=None, max_vcpus=None, max_memory=None, workdir=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_vcpus = max_vcpus or os.cpu_count() or 1
+        self.max_memory = max_memory
+        self.workdir = workdir or tempfile.mkdtemp(prefix="bunnies-local-")
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        self.lock = threading.Lock()
+        self.jobs = {}         # job_id: LocalJob
+        self.submissions = {}  # job_name: LocalJob
+
+    def accepts(self, build_node, resources, depends_on=()):
+        """True if the job of build_node (about to be submitted with resources) should run locally.
+           jobs must opt in: only their container image is known to have their tools.
+        """
+        if resources.get('executor', None) != "local" or depends_on:
+            return False
+        if (resources.get('vcpus') or 1) > self.max_vcpus:
+            return False
+        return self.max_memory is None or (resources.get('memory') or 0) <= self.max_memory
+
+    def stage_job(self, job_id, build_node, resources):
+        """writes the job script in the job's directory"""
+        jobdir = os.path.join(self.workdir, job_id)
+        os.makedirs(jobdir, exist_ok=True)
+        script_path = os.path.join(jobdir, "jobscript")
+        with open(script_path, "w") as fd:
+            fd.write(build_node.execution_transfer_script(resources))
+        # the user's code is already importable on the build host
+        return {'BUNNIES_TRANSFER_SCRIPT': script_path, 'BUNNIES_USER_DEPS': ""}
+
+    def submit_simple_batch_job(self, job_name, job_def, expected_runtime=None, **job_params):
+        if job_name in self.submissions:
+            raise ValueError("a job with that name has already been submitted: %s", job_name)
+        job_obj = LocalJob(self, job_name, **job_params)
+        job_obj.meta['expected_runtime'] = expected_runtime
+        with self.lock:
+            self.jobs[job_obj.job_id] = job_obj
+            self.submissions[job_name] = job_obj
+            job_obj.future = self.pool.submit(self._run, job_obj)
+        log.info("submitted local job %s (%s)", job_obj.job_id, job_name)
+        return job_obj
+
+    def job_from_id(self, job_id):
+        """local jobs are only known to the process which ran them"""
+        return self.jobs.get(job_id, None)
+
+    def track_existing_job(self, job_obj):
+        self.submissions[job_obj.name] = job_obj
+        return job_obj
+
+    def untrack_job(self, job_obj):
+        if self.submissions.get(job_obj.name, None) is job_obj:
+            del self.submissions[job_obj.name]
+
+    def wait_for_jobs(self, condition=None, interval=2*60):
+        """wait until the status of the submitted jobs satisfies the condition (see ComputeEnv.wait_for_jobs).
+           completed jobs are no longer tracked after they're reported.
+        """
+        while True:
+            with self.lock:
+                submitted = list(self.submissions.values())
+                obj_status = {}
+                for job_obj in submitted:
+                    obj_status.setdefault(job_obj.status, []).append((job_obj, job_obj.reason))
+            id_status = {state: [(job_obj.job_id, reason) for (job_obj, reason) in pairs]
+                         for state, pairs in obj_status.items()}
+            pending = [job_obj.future for job_obj in submitted if not job_obj.future.done()]
+            if not pending or condition is None or condition(id_status):
+                break
+            concurrent.futures.wait(pending, timeout=interval, return_when=concurrent.futures.FIRST_COMPLETED)
+
+        for (job_obj, _) in obj_status.get('SUCCEEDED', []) + obj_status.get('FAILED', []):
+            self.untrack_job(job_obj)
+        return obj_status
+
+    def usage_collector(self):
+        return self
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def cancel(self, job_obj, reason=None):
+        with self.lock:
+            if job_obj.status in ("SUCCEEDED", "FAILED"):
+                return
+            if job_obj.proc is not None:
+                # the worker releases the claim once the process is gone
+                job_obj.proc.kill()
+                self._stop(job_obj, "FAILED", reason or "cancelled")
+                return
+            job_obj.future.cancel()
+            self._stop(job_obj, "FAILED", reason or "cancelled")
+        self._release_claim(job_obj)
+
+    def hold_claim(self, job_obj, entry):
+        """keeps the submission record entry (kvstore.SubmissionEntry), claimed by this builder, claimed
+           until the job finishes. builders loading it meanwhile wait instead of submitting the job again.
+        """
+        with self.lock:
+            if job_obj.status not in ("SUCCEEDED", "FAILED"):
+                job_obj.claim = entry
+                return
+        self._release_claim(job_obj, entry)
+
+    def _renew_claim(self, job_obj):
+        entry = job_obj.claim
+        if entry is None:
+            return
+        try:
+            entry.claim()
+        except SubmissionConflict:
+            # the claim expired, and another builder took over the record
+            log.warning("local job %s (%s) lost its claim on its submission record", job_obj.job_id, job_obj.name)
+            job_obj.claim = None
+
+    def _release_claim(self, job_obj, entry=None):
+        with self.lock:
+            entry = entry or job_obj.claim
+            job_obj.claim = None
+        if entry is None:
+            return
+        try:
+            entry.save()
+        except SubmissionConflict:
+            log.warning("local job %s (%s) lost its claim on its submission record", job_obj.job_id, job_obj.name)
+
+    def shutdown(self, wait=True):
+        """cancels the jobs which haven't finished, and releases the workers"""
+        for job_obj in list(self.jobs.values()):
+            if job_obj.status in ("SUBMITTED", "RUNNING"):
+                self.cancel(job_obj, reason="executor shut down")
+        self.pool.shutdown(wait=wait)
+
+    def _stop(self, job_obj, status, reason):
+        job_obj.status = status
+        job_obj.reason = reason
+        job_obj.stopped_at = time.time()
+
+    def _run(self, job_obj):
+        jobdir = os.path.join(self.workdir, job_obj.name)
+        env = dict(os.environ)
+        env.update(job_obj.overrides.get('environment', {}))
+        env['BUNNIES_WORKDIR'] = jobdir
+        env['PYTHONPATH'] = os.pathsep.join(entry or os.getcwd() for entry in sys.path)
+        script_path = env['BUNNIES_TRANSFER_SCRIPT']
+        timeout = job_obj.overrides.get('timeout', -1)
+        deadline = time.time() + timeout if timeout and timeout > 0 else None
+
+        with open(os.path.join(jobdir, "%s.log" % (job_obj.job_id,)), "wb") as logfd:
+            with self.lock:
+                if job_obj.status != "SUBMITTED":
+                    return
+                job_obj.proc = subprocess.Popen([sys.executable, script_path], cwd=jobdir, env=env,
+                                                stdout=logfd, stderr=subprocess.STDOUT)
+                job_obj.status = "RUNNING"
+                job_obj.started_at = time.time()
+            while True:
+                wait_s = CLAIM_RENEWAL if deadline is None else max(0, min(CLAIM_RENEWAL, deadline - time.time()))
+                try:
+                    exit_code = job_obj.proc.wait(timeout=wait_s)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+                if deadline is not None and time.time() >= deadline:
+                    job_obj.proc.kill()
+                    exit_code = job_obj.proc.wait()
+                    with self.lock:
+                        self._stop(job_obj, "FAILED", jobs.TIMEOUT_REASON)
+                    break
+                self._renew_claim(job_obj)
+
+        with self.lock:
+            job_obj.exit_code = exit_code
+            if job_obj.status == "RUNNING":
+                if exit_code == 0:
+                    self._stop(job_obj, "SUCCEEDED", "")
+                else:
+                    self._stop(job_obj, "FAILED", jobs.CONTAINER_EXIT_REASON)
+                log.info("local job %s (%s) %s after %.1fs", job_obj.job_id, job_obj.name, job_obj.status.lower(),
+                         job_obj.stopped_at - job_obj.started_at)
+        self._release_claim(job_obj)
+
+    def describe(self, job_obj):
+        """the job, described the way batch describes jobs"""
+        return jobs.describe_unbatched_job(job_obj, job_obj.overrides.get('vcpus', None),
+                                           job_obj.overrides.get('memory', None),
+                                           timeout=job_obj.overrides.get('timeout', None),
+                                           container={'exitCode': job_obj.exit_code})
+
+    def describe_jobs(self, job_ids):
+        return [self.describe(self.jobs[job_id]) for job_id in job_ids if job_id in self.jobs]
+
+    def collect(self, job_ids):
+        """usage documents of the given jobs, as a jobs.UsageCollector would return"""
+        return {job_id: jobs.unbatched_job_usage(self.describe(self.jobs[job_id]),
+                                                 self.jobs[job_id].overrides.get('vcpus') or 1,
+                                                 self.jobs[job_id].overrides.get('memory') or 0)
+                for job_id in job_ids}
+
+
+class RoutingComputeEnv(object):
+    """a compute environment which sends the jobs the local executor accepts to it, and
+       the others to compute_env (see LocalPoolExecutor.accepts)
+    """
+
+    def __init__(self, compute_env, local):
+        self.compute_env = compute_env
+        self.local = local
+        self._collector = None
+
+    @property
+    def name(self):
+        return self.compute_env.name
+
+    @property
+    def tracker(self):
+        return self.compute_env.tracker
+
+    def get_disk(self, diskname):
+        return self.compute_env.get_disk(diskname)
+
+    def create(self):
+        self.compute_env.create()
+
+    def wait_ready(self):
+        self.compute_env.wait_ready()
+
+    def register_simple_batch_jobdef(self, name, container_image):
+        return self.compute_env.register_simple_batch_jobdef(name, container_image)
+
+    def submission_context(self, owner_name, jobname):
+        return self.compute_env.submission_context(owner_name, jobname)
+
+    def preload(self, owner_name, job_names):
+        self.compute_env.preload(owner_name, job_names)
+
+    def executor_for(self, build_node, resources, depends_on=()):
+        if self.local.accepts(build_node, resources, depends_on=depends_on):
+            return self.local
+        return self.compute_env.executor_for(build_node, resources, depends_on=depends_on)
+
+    def job_from_id(self, job_id):
+        if job_id.startswith(LOCAL_JOB_PREFIX):
+            return self.local.job_from_id(job_id)
+        return self.compute_env.job_from_id(job_id)
+
+    def _executor_of(self, job_obj):
+        return self.local if job_obj.jobtype == LocalJob.jobtype else self.compute_env
+
+    def track_existing_job(self, job_obj):
+        return self._executor_of(job_obj).track_existing_job(job_obj)
+
+    def untrack_job(self, job_obj):
+        self._executor_of(job_obj).untrack_job(job_obj)
+
+    def wait_for_jobs(self, condition=None, interval=2*60):
+        """reports the local jobs without waiting. while local jobs run, batch jobs are only
+           polled when they're due, so that local completions are seen promptly.
+        """
+        obj_status = self.local.wait_for_jobs()
+        next_due = self.compute_env.tracker.next_due()
+        if self.compute_env.submissions and \
+           (not self.local.submissions or next_due is None or next_due <= time.time()):
+            for state, pairs in self.compute_env.wait_for_jobs(condition=condition, interval=interval).items():
+                obj_status.setdefault(state, []).extend(pairs)
+        return obj_status
+
+    def usage_collector(self):
+        return self
+
+    def collect(self, job_ids):
+        local_ids = [job_id for job_id in job_ids if job_id.startswith(LOCAL_JOB_PREFIX)]
+        batch_ids = [job_id for job_id in job_ids if not job_id.startswith(LOCAL_JOB_PREFIX)]
+        usages = self.local.collect(local_ids)
+        if batch_ids:
+            if self._collector is None:
+                self._collector = self.compute_env.usage_collector()
+            usages.update(self._collector.collect(batch_ids))
+        return usages
+
+    def sleep(self, seconds):
+        self.compute_env.sleep(seconds)
@@ -3,12 +3,20 @@
 """
     Models for constructing a Bunnies pipeline
 """
+import copy
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from . import constants
 from . import utils
 from . import config
+from . import digest_index
 from .exc import NotImpl, NoSuchFile, IntegrityException
 from . import unmarshall
 
+log = logging.getLogger(__name__)
+
 
 class Cacheable(object):
     """a cacheable resource, canonically named according to its contents or provenance"""
@@ -30,8 +38,14 @@ class Cacheable(object):
 
         concrete implementations might want to cache the result of the computation
         """
-        canon_doc = self.canonical()
-        return utils.canonical_hash(canon_doc)
+        return utils.canonical_hash_encoded(self.canonical_encoding())
+
+    def canonical_encoding(self):
+        """
+        the canonical representation, encoded as a string (see utils.canonical_encode).
+        implementations may memoize it if the canonical representation cannot change.
+        """
+        return utils.canonical_encode(self.canonical())
 
     def __hash__(self):
         return hash(self.canonical_id)
@@ -159,10 +173,17 @@ class S3Blob(Cacheable, Target):
 
     def manifest(self):
         if not self._manifest:
-            meta = utils.get_blob_meta(self.url)
-            pfx = constants.DIGEST_HEADER_PREFIX
-            head_digests = {key[len(pfx):]: val for key, val in meta['Metadata'].items()
-                            if key.startswith(pfx)}
+            # the digest index of the blob's directory spares a HEAD per blob. entries are
+            # only returned while the directory listing agrees with their etag and size.
+            entry = digest_index.lookup(self.url) if constants.USE_DIGEST_INDEX else None
+            if entry and entry['digests'].get('md5'):
+                meta = {'ContentLength': entry['size']}
+                head_digests = dict(entry['digests'])
+            else:
+                meta = utils.get_blob_meta(self.url)
+                pfx = constants.DIGEST_HEADER_PREFIX
+                head_digests = {key[len(pfx):]: val for key, val in meta['Metadata'].items()
+                                if key.startswith(pfx)}
             try:
                 md5_digest = head_digests['md5']
                 if "md5" in self.digests and md5_digest != self.digests['md5']:
@@ -226,14 +247,20 @@ class Input(Cacheable):
         # node it is referencing.
         return self.node.canonical()
 
+    def canonical_encoding(self):
+        return self.node.canonical_encoding()
+
     def ls(self):
         return self.node.ls()
 
     def manifest(self):
+        return self.manifest_entry(lambda node: node.manifest())
+
+    def manifest_entry(self, ref):
         return {
             constants.MANIFEST_KIND_ATTR: self.kind, # fixme meta class?
             "name": self.name,
-            "node": self.node.manifest(),
+            "node": ref(self.node),
             "desc": self.desc
         }
 
@@ -248,7 +275,7 @@ class Transform(Target, Cacheable):
     """
     A transformation of inputs performed by a program, with the given parameters
     """
-    __slots__ = ("name", "desc", "version", "image", "inputs", "params", "_canonical_id")
+    __slots__ = ("name", "desc", "version", "image", "inputs", "params", "_canonical_id", "_canonical_enc")
 
     kind = "bunnies.Transform"
 
@@ -271,6 +298,7 @@ class Transform(Target, Cacheable):
         self.params = kwargs.get('params', {})
 
         self._canonical_id = None
+        self._canonical_enc = None
 
     def __str__(self):
         return "Transform(%(name)s, %(version)s, %(params)s)" % {
@@ -284,6 +312,14 @@ class Transform(Target, Cacheable):
         self.inputs[key] = Input(key, node, desc=desc)
 
     def manifest(self):
+        """the manifest of the graph rooted at this transform (v2: a table of nodes)"""
+        return manifest_table(self)
+
+    def manifest_entry(self, ref):
+        """
+        the manifest of this transform alone. ref(node) returns what stands in
+        for each upstream node.
+        """
         obj = {}
         obj[constants.MANIFEST_KIND_ATTR] = self.kind # fixme meta class?
         obj['type']    = "transform"
@@ -291,7 +327,7 @@ class Transform(Target, Cacheable):
         obj['desc']    = self.desc
         obj['version'] = self.version
         obj['image']   = self.image
-        obj['inputs']  = {k: self.inputs[k].manifest() for k in self.inputs}
+        obj['inputs']  = {k: self.inputs[k].manifest_entry(ref) for k in self.inputs}
         obj['params']  = self.params
         return obj
 
@@ -321,16 +357,34 @@ class Transform(Target, Cacheable):
         parameters should be as small as possible.
 
         """
+        return self._canonical_doc({k: self.inputs[k].canonical() for k in self.inputs})
+
+    def _canonical_doc(self, inputs):
         obj = {
             'type': "transform",
             'name': self.name,
             'version': self.version,
             'image': self.image,
             'params': self.params,
-            'inputs': {k: self.inputs[k].canonical() for k in self.inputs}
+            'inputs': inputs
         }
         return obj
 
+    def canonical_encoding(self):
+        if type(self).canonical is not Transform.canonical:
+            # can't make assumptions about the shape of the document
+            return super(Transform, self).canonical_encoding()
+
+        if self._canonical_enc is None:
+            # each input is encoded once, and its encoding reused by every
+            # downstream transform. placeholders stand in for them in the doc.
+            inputs, memo = {}, {}
+            for k in self.inputs:
+                placeholder = inputs[k] = object()
+                memo[id(placeholder)] = self.inputs[k].canonical_encoding()
+            self._canonical_enc = utils.canonical_encode(self._canonical_doc(inputs), memo=memo)
+        return self._canonical_enc
+
     @property
     def canonical_id(self):
         if not self._canonical_id:
@@ -351,21 +405,28 @@ class Transform(Target, Cacheable):
         }
 
         return "%(repo_path)s%(tail)s/" % {
-            'output_path': self.repo_path(write_url=write_url),
+            'repo_path': self.repo_path(write_url=write_url),
             'tail': tail
         }
 
+    def result_urls(self):
+        """urls where the result file of the transformation may be found, in order of preference"""
+        paths = [config['storage']['write_url']] + config['storage']['read_urls']
+        return ["%(prefix)s%(result)s" % {
+            'prefix': self.output_prefix(pfx),
+            'result': constants.TRANSFORM_RESULT_FILE
+        } for pfx in paths]
+
     def exists(self):
         """
         check if the results of the transformation exist
         """
-        paths = [config['storage']['write_url']] + config['storage']['read_urls']
-        for pfx in paths:
+        loaded = load_result.cache.get(self.canonical_id, None)
+        if loaded is not None:
+            return loaded[0]
+
+        for candidate in self.result_urls():
             try:
-                candidate = "%(prefix)s%(result)s" % {
-                    'prefix': self.output_prefix(pfx),
-                    'result': constants.TRANSFORM_RESULT_FILE
-                }
                 _ = utils.get_blob_meta(candidate, logprefix=self.kind)
                 return candidate
             except NoSuchFile:
@@ -389,18 +450,167 @@ class Transform(Target, Cacheable):
                'memory': 4000,
                'timeout': 4*3600
            }
+
+           'executor' can be set to "local" or "batch" to pick where the task runs, when
+           the build has a local executor (see executors.LocalPoolExecutor).
+
+           After an attempt is killed for lack of memory or time, the build raises the
+           memory or timeout returned here (see escalation.EscalationPolicy).
         """
         raise NotImplementedError("subclasses must implement task_resources")
 
     def ls(self):
-        transform_result = self.exists()
-        if not transform_result:
+        loaded = load_result(self)
+        if loaded is None:
             raise NoSuchFile("target is not available")
+        return copy.deepcopy(loaded[1]['output'])
 
-        with utils.get_blob_ctx(transform_result, logprefix=self.kind) as (body, info):
-            doc = utils.load_json(body)
+unmarshall.register_kind(Transform)
 
-        return doc['output']
 
-unmarshall.register_kind(Transform)
+def load_result(transform):
+    """
+    returns (url, doc, etag) for the result file of the transform, or None if it's not available.
+
+    the result repositories are tried in order, with one GET each. results found are
+    memoized for the lifetime of the process, by canonical id. they don't change once
+    written.
+    """
+    cid = transform.canonical_id
+    loaded = load_result.cache.get(cid, None)
+    if loaded is not None:
+        return loaded
+
+    for candidate in transform.result_urls():
+        try:
+            with utils.get_blob_ctx(candidate, logprefix=transform.kind) as (body, info):
+                doc = utils.load_json(body)
+        except NoSuchFile:
+            continue
+        with load_result.lock:
+            return load_result.cache.setdefault(cid, (candidate, doc, info.get('ETag')))
+    return None
+
+
+load_result.cache = {}
+load_result.lock = threading.Lock()
+
+
+def prefetch_ls(transforms, threads=8):
+    """
+    loads the result files of many transforms concurrently, so that their ls() is answered
+    from memory.
+
+    returns {canonical_id: ls() output, or None if the transform has no result}
+    """
+    pending = {}
+    for transform in transforms:
+        pending.setdefault(transform.canonical_id, transform)
+    if not pending:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(threads, len(pending)))) as pool:
+        loaded = dict(zip(pending, pool.map(load_result, pending.values())))
+    return {cid: copy.deepcopy(res[1]['output']) if res else None for cid, res in loaded.items()}
+
 
+def manifest_table(root):
+    """
+    builds the v2 manifest of the graph under root: each node appears once in
+    the table, keyed by its canonical id. see constants.MANIFEST_TABLE_KIND.
+    """
+    nodes = {}
+    names = {}  # id(node) => name in table
+
+    def _name(node):
+        cid = node.canonical_id
+        if isinstance(node, Transform):
+            # transforms with the same canonical id are equivalent
+            if cid not in nodes:
+                nodes[cid] = node.manifest_entry(_ref)
+            return cid
+
+        # different files can have the same contents
+        doc = node.manifest()
+        name, n = cid, 0
+        while name in nodes and nodes[name] != doc:
+            n += 1
+            name = "%s#%d" % (cid, n)
+        nodes[name] = doc
+        return name
+
+    def _ref(node):
+        name = names.get(id(node), None)
+        if name is None:
+            name = names[id(node)] = _name(node)
+        return {constants.MANIFEST_REF_ATTR: name}
+
+    root_ref = _ref(root)
+    return {
+        constants.MANIFEST_KIND_ATTR: constants.MANIFEST_TABLE_KIND,
+        'version': constants.MANIFEST_VERSION,
+        'root': root_ref[constants.MANIFEST_REF_ATTR],
+        'nodes': nodes
+    }
+
+
+
+def embed_results(transforms, threads=8):
+    """
+    resolves the results of the given transforms, to ship them along with a job.
+    transforms without results are left out.
+
+    returns {
+      'nodes': {canonical_id: {'url': result url, 'etag': etag, 'result': content hash}},
+      'results': {content hash: result doc}
+    }
+    """
+    prefetch_ls(transforms, threads=threads)
+    nodes, results = {}, {}
+    for transform in transforms:
+        loaded = load_result.cache.get(transform.canonical_id, None)
+        if loaded is None:
+            continue
+        url, doc, etag = loaded
+        digest = utils.canonical_hash(doc)
+        results[digest] = doc
+        nodes[transform.canonical_id] = {'url': url, 'etag': etag, 'result': digest}
+    return {'nodes': nodes, 'results': results}
+
+
+def load_embedded_results(embedded, verify=False, threads=8):
+    """
+    seeds the memo of load_result() with results from embed_results(), so that ls()
+    is answered without network access.
+
+    with verify, the result files are HEADed, and entries whose etag has changed since
+    they were embedded are skipped (they are then fetched again on use).
+
+    returns the number of results seeded.
+    """
+    entries = {}
+    for cid, node in embedded.get('nodes', {}).items():
+        doc = embedded['results'].get(node['result'], None)
+        if doc is None or utils.canonical_hash(doc) != node['result']:
+            log.warning("embedded result for %s is corrupt. ignored.", cid)
+            continue
+        entries[cid] = (node['url'], doc, node['etag'])
+
+    if verify and entries:
+        def _current(entry):
+            try:
+                return utils.get_blob_meta(entry[0]).get('ETag', None) == entry[2]
+            except NoSuchFile:
+                return False
+
+        with ThreadPoolExecutor(max_workers=max(1, min(threads, len(entries)))) as pool:
+            current = dict(zip(entries, pool.map(_current, entries.values())))
+        for cid, ok in current.items():
+            if not ok:
+                log.warning("embedded result %s has changed since submission. ignored.", entries[cid][0])
+                del entries[cid]
+
+    with load_result.lock:
+        for cid, entry in entries.items():
+            load_result.cache.setdefault(cid, entry)
+    return len(entries)
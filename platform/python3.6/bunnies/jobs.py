@@ -1,12 +1,11 @@
 #!/usr/bin/env python3
 
-import boto3
 from .constants import PLATFORM, JOB_LOGS_PREFIX, JOB_USAGE_FILE
-from .utils import data_files, read_log_stream, get_blob_meta, hash_data, UIOutput
+from .utils import data_files, read_log_stream, get_blob_meta, hash_data, UIOutput, aws_client
 from .containers import wrap_user_image
 from .config import config
 from .exc import BunniesException, NoSuchFile
-from .transfers import s3_streaming_put, s3_streaming_put_simple
+from .transfers import s3_streaming_put, s3_streaming_put_simple, gzip_chunks, IterReader
 
 import os
 import json
@@ -15,20 +14,34 @@ import os.path
 import botocore.waiter
 import time
 import io
+import concurrent.futures
 
 from datetime import datetime, timedelta
 
 from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
 logger = logging.getLogger(__name__)
 
+# a batch job can depend on at most this many jobs
+MAX_DEPENDS_ON = 20
 
-def batch_client():
-    if not batch_client.client:
-        batch_client.client = boto3.client('batch')
-    return batch_client.client
+# status reason of jobs withdrawn because a job they depend on failed. jobs failed
+# by batch for the same reason get DEPENDENCY_FAILED_REASON.
+REVOKED_REASON = "revoked: a job it depends on failed"
+DEPENDENCY_FAILED_REASON = "Dependent Job failed"
+
+# status reasons of attempts which ran, and failed
+CONTAINER_EXIT_REASON = "Essential container in task exited"
+TIMEOUT_REASON = "Job attempt duration exceeded timeout"
 
 
-batch_client.client = None
+def is_dependency_failure(reason):
+    """True if a job failed (only) because one of the jobs it depends on failed"""
+    reason = reason or ""
+    return reason.startswith(REVOKED_REASON) or reason.startswith(DEPENDENCY_FAILED_REASON)
+
+
+def batch_client():
+    return aws_client('batch')
 
 
 class AWSBatchSimpleJobDef(object):
@@ -62,6 +75,8 @@ class AWSBatchSimpleJobDef(object):
 
 
 class AWSBatchSimpleJob(object):
+    jobtype = "batch"
+
     def __init__(self, name, jobdef, **overrides):
         """
         Overrides (optional):
@@ -83,8 +98,14 @@ class AWSBatchSimpleJob(object):
         self.job_id = None
         self.foreign = False
         self.meta = {}
+        # description obtained along with the job (see from_desc), returned by the next get_desc()
+        self.prefetched_desc = None
 
     def get_desc(self, client=None):
+        if self.prefetched_desc is not None:
+            job_desc, self.prefetched_desc = self.prefetched_desc, None
+            return job_desc
+
         if client is None:
             client = batch_client()
 
@@ -104,11 +125,14 @@ class AWSBatchSimpleJob(object):
         if not job_descs:
             logger.debug("no batch jobs match id %s", job_id)
             return None
-        job_desc = job_descs[0]
-        job_name = job_desc['jobName']
-        job_def = job_desc['jobDefinition']
-        inst = cls(job_name, job_def)
-        inst.job_id = job_id
+        return cls.from_desc(job_descs[0])
+
+    @classmethod
+    def from_desc(cls, job_desc):
+        """the job of a description (see describe_jobs)"""
+        inst = cls(job_desc['jobName'], job_desc['jobDefinition'])
+        inst.job_id = job_desc['jobId']
+        inst.prefetched_desc = job_desc
 
         # FIXME extract overrides: memory, vcpu, timeout, etc.
         return inst
@@ -165,10 +189,10 @@ class AWSBatchSimpleJob(object):
         attempt = job_desc['attempts'][attempt]
         return attempt, job_desc
 
-    def save_usage(self, dest_url=None):
+    def save_usage(self, dest_url=None, collector=None):
         """extracts usage information and saves it in the folder designateg by dest_url (s3 folder)
            if the destination url is omitted, it is extracted from the bunnies output directory for
-           the job.
+           the job. an optional UsageCollector can be provided to share lookups between jobs.
 
            Returns:
                 usage_url, usage_info, is_written
@@ -196,7 +220,7 @@ class AWSBatchSimpleJob(object):
                     return False
             return True
 
-        usage = self.get_usage()
+        usage = self.get_usage(collector=collector)
         no_instance_info = [attempt for attempt in usage['attempts']
                             if not _attempt_has_instance_info(attempt)]
 
@@ -227,10 +251,13 @@ class AWSBatchSimpleJob(object):
                                     logprefix=os.path.basename(logdest))
         return logdest, usage, True
 
-    def save_logs(self, dest_url=None):
+    def save_logs(self, dest_url=None, threads=4):
         """saves all job logs for all attempts in the folder designated by dest_url prefix (s3 folder).
            if the destination url is omitted, it is extracted from the bunnies output directory for the
            job
+
+           logs are streamed from cloudwatch and stored gzip-compressed (Content-Encoding: gzip). All
+           attempts are exported concurrently, each with up to `threads` parts uploading at once.
         """
         job_desc = self.get_desc()
         if not job_desc:
@@ -256,8 +283,29 @@ class AWSBatchSimpleJob(object):
         def _get_time(ms):
             return datetime.fromtimestamp(ms/1000.0).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
 
-        all_dests = []
-
+        def _log_lines(attempt, details):
+            for event in read_log_stream("/aws/batch/job", details['logstream'], startFromHead=True):
+                logmsg = _get_time(event['timestamp']) + " " + event['message'] + "\n"
+                yield logmsg.encode('utf-8')
+
+            secs = (attempt["stoppedAt"] - attempt["startedAt"]) / 1000.0
+            from_submit = (attempt['stoppedAt'] - job_desc['createdAt']) / 1000.0
+            run_t = timedelta(seconds=secs)
+            submit_t = timedelta(seconds=from_submit)
+            tailmsgs = ["exit code: %d\n" % (details['code']),
+                        "run time: %6.3fs (%s)\n" % (secs, str(run_t)),
+                        "from submission: %6.3f (%s)\n" % (from_submit, str(submit_t))]
+            for tailmsg in tailmsgs:
+                yield tailmsg.encode("utf-8")
+
+        def _export(logdest, attempt, details):
+            # write log events to a compressed stream, uploaded as it is produced
+            log_fp = IterReader(gzip_chunks(_log_lines(attempt, details)))
+            s3_streaming_put(log_fp, logdest, content_type="text/plain", content_encoding="gzip",
+                             logprefix=os.path.basename(logdest), threads=threads)
+            return logdest
+
+        exports = []
         for attempti, attempt in enumerate(job_desc['attempts']):
             containers = _get_containers(attempt)
             for details in containers:
@@ -266,185 +314,31 @@ class AWSBatchSimpleJob(object):
                 else:
                     basename = "%s.attempt-%d.log" % (details['name'], attempti)
                 logdest = os.path.join(dest_url, JOB_LOGS_PREFIX + basename)
+                exports.append((logdest, attempt, details))
+
+        if not exports:
+            return []
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(exports)) as executor:
+            futures = [executor.submit(_export, *export) for export in exports]
+            return [future.result() for future in futures]
 
-                all_dests.append(logdest)
-                # write log events to binary file
-                with io.BytesIO() as log_fp:
-                    for event in read_log_stream("/aws/batch/job", details['logstream'], startFromHead=True):
-                        logmsg = _get_time(event['timestamp']) + " " + event['message'] + "\n"
-                        log_fp.write(logmsg.encode('utf-8'))
-
-                    secs = (attempt["stoppedAt"] - attempt["startedAt"]) / 1000.0
-                    from_submit = (attempt['stoppedAt'] - job_desc['createdAt']) / 1000.0
-                    run_t = timedelta(seconds=secs)
-                    submit_t = timedelta(seconds=from_submit)
-                    tailmsgs = ["exit code: %d\n" % (details['code']),
-                                "run time: %6.3fs (%s)\n" % (secs, str(run_t)),
-                                "from submission: %6.3f (%s)\n" % (from_submit, str(submit_t))]
-                    for tailmsg in tailmsgs:
-                        log_fp.write(tailmsg.encode("utf-8"))
-                    file_len = log_fp.tell()
-                    log_fp.seek(0)
-                    s3_streaming_put(log_fp, logdest, content_type="text/plain", content_length=file_len,
-                                     logprefix=os.path.basename(logdest))
-        return all_dests
-
-    def get_usage(self):
+    def get_usage(self, collector=None):
         """obtain a dictionary of information about this job.
 
            Call this while the job is running, between attempts, or shortly after the job is complete.
            This call will access information about the ec2 instance, which is only available for a short
            amount of time after the instance/ecs agent is terminated.
 
-          Permissions needed:
-           batch:DescribeJobs
-           batch:DescribeJobQueues
-           batch:DescribeComputeEnvironments
-           ecs:DescribeContainerInstances
-           ec2:DescribeInstances
+           Pass a UsageCollector to share its lookups with other jobs. See UsageCollector for the
+           permissions needed.
         """
-        batch = batch_client()
-        job_desc = self.get_desc(client=batch)
-        if not job_desc:
+        if collector is None:
+            collector = UsageCollector()
+        usage = collector.collect([self.job_id]).get(self.job_id, None)
+        if usage is None:
             raise BunniesException("cannot retrieve job information %s" % (self.job_id,))
-
-        def _container_name(logName):
-            return logName.split("/")[1]
-
-        def _attempt_info(attempt, job_desc):
-            resources = [{"vcpus": job_desc['container']['vcpus'], "memory": job_desc['container']['memory']}]
-            return {
-                "containerInstanceArn": [attempt['container']['containerInstanceArn']],
-                "resources": resources,
-                "startedAt": attempt['startedAt'],
-                "stoppedAt": attempt['stoppedAt'],
-                "logs": [attempt['container']['logStreamName']]
-            }
-
-        attempt_info = [_attempt_info(attempt, job_desc) for attempt in job_desc['attempts']]
-
-        job_queue_arn = job_desc['jobQueue']
-
-        job_queue = get_jobqueue(job_queue_arn)
-        compute_env_arns = [item['computeEnvironment'] for item in job_queue['computeEnvironmentOrder']]
-
-        compute_envs = [batch.describe_compute_environments(computeEnvironments=[name])['computeEnvironments'][0]
-                        for name in compute_env_arns]
-        cluster_arns = [compute_env['ecsClusterArn'] for compute_env in compute_envs]
-
-        ecs = boto3.client('ecs')
-        ec2 = boto3.client('ec2')
-
-        def _container_instance_info(ecs_instance_arn, cluster_arns):
-            if ecs_instance_arn not in _container_instance_info.cache:
-                for cluster_arn in cluster_arns:
-                    instances = ecs.describe_container_instances(
-                        containerInstances=[ecs_instance_arn],
-                        cluster=cluster_arn
-                    )['containerInstances']
-                    if not instances:
-                        continue
-                    _container_instance_info.cache[ecs_instance_arn] = instances[0]
-                    return instances[0]
-                _container_instance_info.cache[ecs_instance_arn] = None
-                return None
-            return _container_instance_info.cache[ecs_instance_arn]
-
-        _container_instance_info.cache = {}
-
-        def _ec2_instance_info(ec2_instance_id):
-            if ec2_instance_id not in _ec2_instance_info.cache:
-                instances = ec2.describe_instances(
-                    InstanceIds=[ec2_instance_id])
-                if not instances or not instances['Reservations']:
-                    logger.info("cannot obtain details on instance %s", ec2_instance_id)
-                    _ec2_instance_info.cache[ec2_instance_id] = None
-                    return None
-                res = instances['Reservations'][0]
-                if not res['Instances']:
-                    logger.info("cannot obtain details on instance %s", ec2_instance_id)
-                    _ec2_instance_info.cache[ec2_instance_id] = None
-                    return None
-                _ec2_instance_info.cache[ec2_instance_id] = res['Instances'][0]
-            return _ec2_instance_info.cache[ec2_instance_id]
-
-        _ec2_instance_info.cache = {}
-
-        container_instance_info = {}
-
-        for attempt in attempt_info:
-            attempt['instance'] = []
-            for container_instance_arn in attempt['containerInstanceArn']:
-                container_instance_info = _container_instance_info(container_instance_arn, cluster_arns)
-                if not container_instance_info:
-                    logger.info("could not obtain container instance info for arn %s",
-                                container_instance_arn)
-                    attempt['instance'].append(None)
-                    continue
-
-                instance_id = container_instance_info['ec2InstanceId']
-                instance_info = {'instanceId': instance_id,
-                                 'instanceType': None,
-                                 'coreCount': None,
-                                 'threadsPerCore': None}
-                attempt['instance'].append(instance_info)
-
-                ec2_info = _ec2_instance_info(instance_id)
-                if ec2_info:
-                    instance_info['instanceType'] = ec2_info['InstanceType']
-                    instance_info['startedAt'] = int(ec2_info['LaunchTime'].timestamp() * 1000)
-                    instance_info['coreCount'] = ec2_info['CpuOptions']['CoreCount']
-                    instance_info['threadsPerCore'] = ec2_info['CpuOptions']['ThreadsPerCore']
-
-        def _update_totals(info):
-            vcpu_s = 0
-            memory_s = 0
-            compute_time = 0
-            min_time = job_desc['createdAt']
-            min_start_time = float("+inf")
-            max_time = 0
-
-            for attempt in info['attempts']:
-                if attempt['startedAt'] < min_time:
-                    min_time = attempt['startedAt']
-                if attempt['startedAt'] < min_start_time:
-                    min_start_time = attempt['startedAt']
-                if attempt['stoppedAt'] > max_time:
-                    max_time = attempt['stoppedAt']
-                attempt_duration = (attempt['stoppedAt'] - attempt['startedAt'])/1000.0
-                attempt_vcpus = sum([cont['vcpus'] for cont in attempt['resources']])
-                attempt_mem = sum([cont['memory'] for cont in attempt['resources']])
-                compute_time += attempt_duration
-                vcpu_s += attempt_vcpus * attempt_duration
-                memory_s += attempt_mem * attempt_duration
-
-            total = info['total']
-            if min_time == float("+inf"):
-                min_time = 0
-                max_time = 0
-            total.update(vcpu_secs=vcpu_s,
-                         memory_secs=memory_s,
-                         compute_time_s=compute_time,
-                         total_time_s=(max_time - min_time)/1000.0)
-            info.update(finishedAt=max_time,
-                        startedAt=min_start_time)
-
-        usage_obj = {
-            'total': {
-                'vcpu_secs': 0,      # cpu*seconds
-                'memory_secs': 0,    # memory(mb)*seconds
-                'compute_time_s': 0, # time spent computing (not counting scheduling time and time between attempts)
-                'total_time_s': 0,   # overall time spent (between submission and end of last attempt)
-                'network': {},       # data transferred over net
-                'credits': 0         # estimation of $ costs
-            },
-            'createdAt': job_desc['createdAt'],
-            'startedAt': 0,
-            'finishedAt': 0,
-            'attempts': attempt_info
-        }
-        _update_totals(usage_obj)
-        return usage_obj
+        return usage
 
     def log_stream(self, attempt=-1, startTime=None, endTime=None, startFromHead=False):
         """yields each log event of the job,
@@ -632,7 +526,7 @@ def create_job_role():
         ]
     }
 
-    client = boto3.client("iam")
+    client = aws_client('iam')
 
     logger.info("creating IAM role %s", ecs_role_name)
     try:
@@ -872,7 +766,8 @@ def make_jobdef(name, job_role_arn, image, vcpus=1, memory=128, mounts=None, reu
     return jd
 
 
-def submit_job(name, queue, jobdef, command=None, vcpus=None, memory=None, environment=None, attempts=1, timeout=1000):
+def submit_job(name, queue, jobdef, command=None, vcpus=None, memory=None, environment=None, attempts=1, timeout=1000,
+               depends_on=None):
     """
     args:
       name: name of the job
@@ -883,7 +778,13 @@ def submit_job(name, queue, jobdef, command=None, vcpus=None, memory=None, envir
       memory: int  (MiB. overrides job def)
       attempts: number of times to move the job into runnable state (1 <= n <= 10) (overrides job def)
       environment: key-value pairs. adds or redefines environment variables from job definition. keys must not start with AWS_BATCH.
+      depends_on: [jobid, jobid, ...] the job stays PENDING until these have succeeded, and fails if one of them fails.
+                  at most MAX_DEPENDS_ON.
     """
+    depends_on = list(depends_on or [])
+    if len(depends_on) > MAX_DEPENDS_ON:
+        raise ValueError("a job can depend on at most %d jobs, not %d" % (MAX_DEPENDS_ON, len(depends_on)))
+
     logger.info("submitting job %(name)s/%(jobdef)s to queue=%(queue)s vcpus=%(vcpus)s mem=%(memory)sMiB cmd=%(command)s",
                 {"name": name,
                  "queue": queue,
@@ -907,7 +808,7 @@ def submit_job(name, queue, jobdef, command=None, vcpus=None, memory=None, envir
     job_settings = {
         'jobName': name,
         'jobQueue': queue,
-        'dependsOn': [],
+        'dependsOn': [{'jobId': job_id} for job_id in depends_on],
         'jobDefinition': jobdef,
         'parameters': {},
         'containerOverrides': cont_overrides
@@ -926,7 +827,7 @@ def describe_jobs(jobs):
     # max 100 at a time
     all_jobs = []
 
-    client = boto3.client("batch")
+    client = aws_client('batch')
 
     sleep_time = 10
 
@@ -953,7 +854,417 @@ def describe_jobs(jobs):
     return all_jobs
 
 
-def wait_for_jobs(jobs, interval=2*60, condition=None):
+def describe_unbatched_job(job_obj, vcpus, memory, timeout=-1, container=None, **extra):
+    """the job, described the way batch describes jobs, for jobs run outside of batch
+       (executors.LocalJob, simulate.SimJob). job_obj has the job_id, name, status, reason,
+       and the created_at, started_at and stopped_at times (seconds, None until then) of the job.
+       container: the container of the attempt, once stopped. extra: other fields of the description.
+    """
+    desc = {
+        'jobId': job_obj.job_id,
+        'jobName': job_obj.name,
+        'status': job_obj.status,
+        'statusReason': job_obj.reason,
+        'createdAt': int(job_obj.created_at * 1000),
+        'container': {'vcpus': vcpus, 'memory': memory},
+        'attempts': []
+    }
+    desc.update(extra)
+    if (timeout or -1) > 0:
+        desc['timeout'] = {'attemptDurationSeconds': timeout}
+    if job_obj.started_at is not None:
+        desc['startedAt'] = int(job_obj.started_at * 1000)
+        if job_obj.stopped_at is not None:
+            desc['stoppedAt'] = int(job_obj.stopped_at * 1000)
+            desc['attempts'] = [{'startedAt': desc['startedAt'], 'stoppedAt': desc['stoppedAt'],
+                                 'container': container or {}, 'statusReason': job_obj.reason}]
+    return desc
+
+
+def unbatched_job_usage(desc, vcpus, memory):
+    """the usage document (as UsageCollector.collect returns) of a job described by describe_unbatched_job"""
+    attempts = [{'resources': [{'vcpus': vcpus, 'memory': memory}],
+                 'startedAt': attempt['startedAt'], 'stoppedAt': attempt['stoppedAt'],
+                 'instance': [], 'logs': []} for attempt in desc['attempts']]
+    compute_s = sum((attempt['stoppedAt'] - attempt['startedAt']) / 1000.0 for attempt in attempts)
+    return {
+        'total': {'vcpu_secs': compute_s * vcpus, 'memory_secs': compute_s * memory,
+                  'compute_time_s': compute_s,
+                  'total_time_s': (desc.get('stoppedAt', desc['createdAt']) - desc['createdAt']) / 1000.0,
+                  'network': {}, 'credits': 0},
+        'createdAt': desc['createdAt'],
+        'startedAt': desc.get('startedAt', 0),
+        'finishedAt': desc.get('stoppedAt', 0),
+        'attempts': attempts
+    }
+
+
+def _id_batches(ids, size=100):
+    """split a list of ids into lists of at most size elements"""
+    ids = list(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i+size]
+
+
+class UsageCollector(object):
+    """gathers usage information for many jobs at once.
+
+       Describe calls are issued with up to 100 ids per request, and the job queue,
+       compute environment, container instance and ec2 instance lookups are cached for
+       the lifetime of the collector. Keep one around for the duration of a build.
+
+       Permissions needed:
+        batch:DescribeJobs
+        batch:DescribeJobQueues
+        batch:DescribeComputeEnvironments
+        ecs:DescribeContainerInstances
+        ec2:DescribeInstances
+    """
+    batch_size = 100
+
+    def __init__(self, describe_fn=None, batch=None, ecs=None, ec2=None):
+        self.describe_fn = describe_fn if describe_fn else describe_jobs
+        self._batch = batch
+        self._ecs = ecs
+        self._ec2 = ec2
+        self.queue_envs = {}           # job queue arn => [compute env arn]
+        self.env_clusters = {}         # compute env arn => ecs cluster arn (or None)
+        self.container_instances = {}  # container instance arn => description (or None)
+        self.ec2_instances = {}        # ec2 instance id => description (or None)
+
+    @property
+    def batch(self):
+        return self._batch if self._batch else batch_client()
+
+    @property
+    def ecs(self):
+        return self._ecs if self._ecs else aws_client('ecs')
+
+    @property
+    def ec2(self):
+        return self._ec2 if self._ec2 else aws_client('ec2')
+
+    def _resolve_queues(self, queue_arns):
+        missing = sorted(set(arn for arn in queue_arns if arn not in self.queue_envs))
+        for chunk in _id_batches(missing, self.batch_size):
+            for queue in self.batch.describe_job_queues(jobQueues=chunk)['jobQueues']:
+                env_arns = [item['computeEnvironment'] for item in queue['computeEnvironmentOrder']]
+                self.queue_envs[queue['jobQueueArn']] = env_arns
+                self.queue_envs[queue['jobQueueName']] = env_arns
+            for arn in chunk:
+                if arn not in self.queue_envs:
+                    logger.info("cannot obtain details on job queue %s", arn)
+                    self.queue_envs[arn] = []
+
+        env_arns = [env_arn for arn in queue_arns for env_arn in self.queue_envs[arn]]
+        missing = sorted(set(arn for arn in env_arns if arn not in self.env_clusters))
+        for chunk in _id_batches(missing, self.batch_size):
+            for env in self.batch.describe_compute_environments(computeEnvironments=chunk)['computeEnvironments']:
+                self.env_clusters[env['computeEnvironmentArn']] = env.get('ecsClusterArn', None)
+                self.env_clusters[env['computeEnvironmentName']] = env.get('ecsClusterArn', None)
+            for arn in chunk:
+                if arn not in self.env_clusters:
+                    logger.info("cannot obtain details on compute environment %s", arn)
+                    self.env_clusters[arn] = None
+
+    def _cluster_arns(self, queue_arn):
+        clusters = [self.env_clusters[env_arn] for env_arn in self.queue_envs[queue_arn]]
+        return [cluster for cluster in clusters if cluster]
+
+    def _resolve_container_instances(self, instance_arns, cluster_arns):
+        missing = sorted(set(arn for arn in instance_arns if arn not in self.container_instances))
+        for cluster_arn in cluster_arns:
+            if not missing:
+                break
+            for chunk in _id_batches(missing, self.batch_size):
+                instances = self.ecs.describe_container_instances(
+                    containerInstances=chunk,
+                    cluster=cluster_arn
+                )['containerInstances']
+                for instance in instances:
+                    self.container_instances[instance['containerInstanceArn']] = instance
+            missing = [arn for arn in missing if arn not in self.container_instances]
+
+        for arn in missing:
+            logger.info("could not obtain container instance info for arn %s", arn)
+            self.container_instances[arn] = None
+
+    def _describe_ec2_instances(self, instance_ids):
+        try:
+            reservations = self.ec2.describe_instances(InstanceIds=instance_ids)['Reservations']
+        except ClientError as clierr:
+            if clierr.response['Error']['Code'] != "InvalidInstanceID.NotFound":
+                raise
+            if len(instance_ids) == 1:
+                return []
+            # one unknown id fails the whole request. split it up.
+            return [instance for instance_id in instance_ids
+                    for instance in self._describe_ec2_instances([instance_id])]
+        return [instance for res in reservations for instance in res['Instances']]
+
+    def _resolve_ec2_instances(self, instance_ids):
+        missing = sorted(set(iid for iid in instance_ids if iid not in self.ec2_instances))
+        for chunk in _id_batches(missing, self.batch_size):
+            for instance in self._describe_ec2_instances(chunk):
+                self.ec2_instances[instance['InstanceId']] = instance
+            for iid in chunk:
+                if iid not in self.ec2_instances:
+                    logger.info("cannot obtain details on instance %s", iid)
+                    self.ec2_instances[iid] = None
+
+    def collect(self, job_ids):
+        """returns a dictionary {job_id: usage_info} for each of the given jobs that can be described.
+           see AWSBatchSimpleJob.get_usage()
+        """
+        job_descs = self.describe_fn(list(job_ids))
+        if not job_descs:
+            return {}
+
+        queue_arns = [job_desc['jobQueue'] for job_desc in job_descs]
+        self._resolve_queues(queue_arns)
+
+        # container instances are looked up in the clusters of each job's queue
+        by_clusters = {}
+        for job_desc in job_descs:
+            clusters = tuple(self._cluster_arns(job_desc['jobQueue']))
+            arns = by_clusters.setdefault(clusters, [])
+            arns += [attempt['container'].get('containerInstanceArn', None) for attempt in job_desc['attempts']]
+        for clusters, instance_arns in by_clusters.items():
+            self._resolve_container_instances([arn for arn in instance_arns if arn], clusters)
+
+        ec2_ids = [info['ec2InstanceId'] for info in self.container_instances.values() if info]
+        self._resolve_ec2_instances(ec2_ids)
+
+        return {job_desc['jobId']: self._usage(job_desc) for job_desc in job_descs}
+
+    def _instance_info(self, container_instance_arn):
+        container_instance_info = self.container_instances.get(container_instance_arn, None)
+        if not container_instance_info:
+            return None
+
+        instance_id = container_instance_info['ec2InstanceId']
+        instance_info = {'instanceId': instance_id,
+                         'instanceType': None,
+                         'coreCount': None,
+                         'threadsPerCore': None}
+
+        ec2_info = self.ec2_instances.get(instance_id, None)
+        if ec2_info:
+            instance_info['instanceType'] = ec2_info['InstanceType']
+            instance_info['startedAt'] = int(ec2_info['LaunchTime'].timestamp() * 1000)
+            instance_info['coreCount'] = ec2_info['CpuOptions']['CoreCount']
+            instance_info['threadsPerCore'] = ec2_info['CpuOptions']['ThreadsPerCore']
+        return instance_info
+
+    def _usage(self, job_desc):
+        """build the usage dictionary of one job from its description and the cached lookups"""
+
+        def _attempt_info(attempt, job_desc):
+            resources = [{"vcpus": job_desc['container']['vcpus'], "memory": job_desc['container']['memory']}]
+            return {
+                "containerInstanceArn": [attempt['container'].get('containerInstanceArn', None)],
+                "resources": resources,
+                "startedAt": attempt['startedAt'],
+                "stoppedAt": attempt['stoppedAt'],
+                "logs": [attempt['container']['logStreamName']]
+            }
+
+        attempt_info = [_attempt_info(attempt, job_desc) for attempt in job_desc['attempts']]
+
+        for attempt in attempt_info:
+            attempt['instance'] = [self._instance_info(arn) for arn in attempt['containerInstanceArn']]
+
+        def _update_totals(info):
+            vcpu_s = 0
+            memory_s = 0
+            compute_time = 0
+            min_time = job_desc['createdAt']
+            min_start_time = float("+inf")
+            max_time = 0
+
+            for attempt in info['attempts']:
+                if attempt['startedAt'] < min_time:
+                    min_time = attempt['startedAt']
+                if attempt['startedAt'] < min_start_time:
+                    min_start_time = attempt['startedAt']
+                if attempt['stoppedAt'] > max_time:
+                    max_time = attempt['stoppedAt']
+                attempt_duration = (attempt['stoppedAt'] - attempt['startedAt'])/1000.0
+                attempt_vcpus = sum([cont['vcpus'] for cont in attempt['resources']])
+                attempt_mem = sum([cont['memory'] for cont in attempt['resources']])
+                compute_time += attempt_duration
+                vcpu_s += attempt_vcpus * attempt_duration
+                memory_s += attempt_mem * attempt_duration
+
+            total = info['total']
+            if min_time == float("+inf"):
+                min_time = 0
+                max_time = 0
+            total.update(vcpu_secs=vcpu_s,
+                         memory_secs=memory_s,
+                         compute_time_s=compute_time,
+                         total_time_s=(max_time - min_time)/1000.0)
+            info.update(finishedAt=max_time,
+                        startedAt=min_start_time)
+
+        usage_obj = {
+            'total': {
+                'vcpu_secs': 0,      # cpu*seconds
+                'memory_secs': 0,    # memory(mb)*seconds
+                'compute_time_s': 0, # time spent computing (not counting scheduling time and time between attempts)
+                'total_time_s': 0,   # overall time spent (between submission and end of last attempt)
+                'network': {},       # data transferred over net
+                'credits': 0         # estimation of $ costs
+            },
+            'createdAt': job_desc['createdAt'],
+            'startedAt': 0,
+            'finishedAt': 0,
+            'attempts': attempt_info
+        }
+        _update_totals(usage_obj)
+        return usage_obj
+
+
+class JobPollTracker(object):
+    """Keeps the last known state of a set of batch jobs, and the time at which
+       each of them is next due for a status update.
+
+       Polling only describes the jobs which are due. The delay before the next
+       poll of a job adapts to its state:
+
+          - SUBMITTED, PENDING, RUNNABLE: `queued_interval` seconds.
+          - STARTING: `min_interval` seconds.
+          - RUNNING: a fraction (`backoff`) of the time it has been running for, at most
+                     `running_interval` seconds. when the job's runtime has been measured
+                     before (expected_runtime), the cap is lifted until the job approaches
+                     it. polls also tighten as the job approaches its timeout.
+
+       All delays are clamped between `min_interval` and `max_interval`.
+    """
+    TERMINAL_STATES = ("SUCCEEDED", "FAILED")
+    QUEUED_STATES = ("SUBMITTED", "PENDING", "RUNNABLE")
+
+    __slots__ = ("min_interval", "max_interval", "queued_interval", "running_interval", "backoff",
+                 "_describe", "_entries")
+
+    def __init__(self, min_interval=10, max_interval=5*60, queued_interval=60, running_interval=30, backoff=0.1,
+                 describe_fn=None):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.queued_interval = queued_interval
+        self.running_interval = running_interval
+        self.backoff = backoff
+        self._describe = describe_fn or describe_jobs
+        self._entries = {}  # job_id => {state, reason, started_at, expected_runtime, timeout, due}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, job_id):
+        return job_id in self._entries
+
+    def track(self, job_id, state=None, expected_runtime=None, timeout=None, now=None):
+        """start tracking job_id.
+
+           state: the state of the job, if known. jobs of unknown state (e.g. jobs
+                  reused from a previous build) are due immediately.
+           expected_runtime: the job's running time measured on previous runs, in seconds.
+           timeout: the most the job can run for, in seconds.
+        """
+        now = time.time() if now is None else now
+        entry = {
+            'state': state,
+            'reason': "",
+            'started_at': None,
+            'expected_runtime': expected_runtime,
+            'timeout': timeout,
+            'due': now
+        }
+        if state is not None:
+            entry['due'] = now + self._interval(entry, now)
+        self._entries[job_id] = entry
+
+    def untrack(self, job_id):
+        self._entries.pop(job_id, None)
+
+    def expedite(self, job_id, now=None):
+        """make a tracked job due for a status update on the next poll"""
+        entry = self._entries.get(job_id, None)
+        if entry is not None:
+            entry['due'] = time.time() if now is None else now
+
+    def state(self, job_id):
+        return self._entries[job_id]['state']
+
+    def _interval(self, entry, now):
+        state = entry['state']
+        if state in self.QUEUED_STATES:
+            interval = self.queued_interval
+        elif state == "RUNNING":
+            started_at = entry['started_at'] if entry['started_at'] is not None else now
+            elapsed = max(0.0, now - started_at)
+            interval = elapsed * self.backoff
+            expected = entry['expected_runtime']
+            if expected and expected > elapsed:
+                # poll more often as the expected end approaches
+                interval = min(interval, (expected - elapsed) / 2.0)
+            else:
+                # the job could end at any time
+                interval = min(interval, self.running_interval)
+            timeout = entry['timeout']
+            if timeout and timeout > elapsed:
+                interval = min(interval, (timeout - elapsed) / 2.0)
+        else:
+            interval = self.min_interval
+        return min(self.max_interval, max(self.min_interval, interval))
+
+    def due_jobs(self, now=None):
+        """ids of the active jobs that need a status update"""
+        now = time.time() if now is None else now
+        return [job_id for job_id, entry in self._entries.items()
+                if entry['due'] <= now and entry['state'] not in self.TERMINAL_STATES]
+
+    def next_due(self):
+        """returns the earliest time at which an active job is due, or None"""
+        dues = [entry['due'] for entry in self._entries.values()
+                if entry['state'] not in self.TERMINAL_STATES]
+        return min(dues) if dues else None
+
+    def poll(self, now=None):
+        """describe the jobs that are due, in batches, and return the status map of all tracked jobs.
+
+           The status map has the same format as the return value of wait_for_jobs(). Jobs which
+           were not due are reported in their last known state. Jobs of unknown state are omitted.
+        """
+        now = time.time() if now is None else now
+        due = self.due_jobs(now=now)
+        if due:
+            logger.debug("polling %d of %d tracked job(s)", len(due), len(self._entries))
+            for job in self._describe(due):
+                entry = self._entries.get(job['jobId'])
+                if entry is None:
+                    continue
+                entry['state'] = job['status']
+                entry['reason'] = job.get('statusReason', '')
+                if job.get('startedAt') is not None:
+                    entry['started_at'] = job['startedAt'] / 1000.0
+                entry['due'] = now + self._interval(entry, now)
+
+            # jobs no longer known to batch are retried later
+            for job_id in due:
+                entry = self._entries[job_id]
+                if entry['due'] <= now:
+                    entry['due'] = now + self.max_interval
+
+        status_map = {}
+        for job_id, entry in self._entries.items():
+            if entry['state'] is None:
+                continue
+            status_map.setdefault(entry['state'], []).append((job_id, entry['reason']))
+        return status_map
+
+
+def wait_for_jobs(jobs, interval=2*60, condition=None, tracker=None):
     """wait for the job ids in `jobs` to satisfy some condition
 
        jobs: [ jobid0, jobid1, ... ]
@@ -965,24 +1276,29 @@ def wait_for_jobs(jobs, interval=2*60, condition=None):
                 'FAILED': [(jobid2, reason)],
                 ...
             }
+
+       Only the jobs which are due are described at each step (see JobPollTracker).
+       `interval` is the longest time to wait between two polls.
     """
     if not condition:
         def condition(x): return True
 
-    job_ids = [jobid for jobid in jobs]
-    while True:
-        desc = describe_jobs(job_ids)
-        status_map = {}
-        for job in desc:
-            if not job['status'] in status_map:
-                status_map[job['status']] = []
-            status_map[job['status']].append((job['jobId'], job.get('statusReason', '')))
+    if tracker is None:
+        tracker = JobPollTracker(max_interval=interval)
 
+    for jobid in jobs:
+        if jobid not in tracker:
+            tracker.track(jobid)
+
+    while True:
+        status_map = tracker.poll()
         if condition(status_map):
             break
 
-        time.sleep(interval)
-        continue
+        next_due = tracker.next_due()
+        if next_due is None:
+            break
+        time.sleep(min(interval, max(0.0, next_due - time.time())))
 
     return status_map
 
@@ -3,13 +3,19 @@
 """
    Helper functions to work with lambda submission and log collection
 """
-import boto3
+from . import constants
 from .constants import PLATFORM
+from .exc import SubmissionConflict
 from .version import __version__
+from .utils import aws_client
 from botocore.exceptions import ClientError
 
 from contextlib import contextmanager
 
+import os
+import os.path
+import sqlite3
+import threading
 import time
 import logging
 log = logging.getLogger(__name__)
@@ -17,38 +23,21 @@ log = logging.getLogger(__name__)
 TABLE_VERSION = "1"
 TABLE_NAME = PLATFORM + "_" + TABLE_VERSION
 
+# a builder has this many seconds to submit a job it has claimed (see SubmissionEntry.claim)
+CLAIM_TTL = 120
+CLAIM_POLL_INTERVAL = 1.0
 
-def lock_client():
-    # this is called only during build.
-    # not used at runtime.
-    from python_dynamodb_lock.python_dynamodb_lock import DynamoDBLockClient
-
-    if not lock_client.client:
-        # get a reference to the DynamoDB resource
-        dynamodb_resource = boto3.resource('dynamodb')
-        # create the lock-client
-        lock_client.client = DynamoDBLockClient(dynamodb_resource)
-
-        # FIXME close the lock_client on shutdown
-        #lock_client.close()
-    return lock_client.client
-
-
-lock_client.client = None
+# keys per BatchGetItem call
+BATCH_GET_SIZE = 100
 
 
 def ddb_client():
-    if not ddb_client.client:
-        ddb_client.client = boto3.client("dynamodb")
-    return ddb_client.client
-
-
-ddb_client.client = None
+    return aws_client('dynamodb')
 
 
 def _create_job_table(client=None):
     if client is None:
-        client = boto3.client("dynamodb")
+        client = aws_client('dynamodb')
 
     log.info("creating job submission table")
     try:
@@ -97,37 +86,229 @@ def _create_job_table(client=None):
             raise
 
 
-def _setup_kv(**kwargs):
-    """setup lock table and job completion tables in dynamodb"""
-    ddb = boto3.client("dynamodb")
-    # https://python-dynamodb-lock.readthedocs.io/en/latest/python_dynamodb_lock.html
-    log.info("creating dynamodb_lock table")
-    try:
-        DynamoDBLockClient.create_dynamodb_table(ddb)
-    except ClientError as clierr:
-        if clierr.response['Error']['Code'] == 'ResourceInUseException':
-            log.info("table already exists. skipping...")
-            pass
+# record attributes, and their dynamodb types
+ATTRIBUTES = {
+    "jobname": "S",
+    "submitter": "S",
+    "jobtype": "S",
+    "jobdata": "S",
+    "jobattempt": "N",
+    "updated_on": "N",
+    "revision": "N",
+    "claim_expires": "N"
+}
+
+
+def _to_item(record):
+    """the dynamodb item of a record"""
+    def _convert(x):
+        if x == "":
+            # values cannot be empty
+            return "-"
         else:
+            return str(x)
+    return {attrname: {attrtype: _convert(record[attrname])} for attrname, attrtype in ATTRIBUTES.items()
+            if record.get(attrname, None) is not None}
+
+
+def _from_item(item):
+    """the record of a dynamodb item"""
+    def _convert(vval):
+        if 'S' in vval:
+            x = vval['S']
+            if x == "-":
+                x = ""
+            return x
+        if 'N' in vval:
+            return float(vval['N'])
+    return {attrname: _convert(vval) for attrname, vval in item.items()}
+
+
+class DynamoDBBackend(object):
+    """submission records in a dynamodb table, shared by builders on many hosts"""
+    __slots__ = ()
+
+    name = "dynamodb"
+
+    def setup(self):
+        _create_job_table(ddb_client())
+
+    def get(self, jobname):
+        """the record of a job, or None"""
+        response = ddb_client().get_item(
+            TableName=TABLE_NAME,
+            Key={
+                'jobname': {'S': jobname}
+            },
+            ConsistentRead=True,
+            ProjectionExpression=",".join(ATTRIBUTES)
+        )
+        if 'Item' not in response:
+            return None
+        return _from_item(response['Item'])
+
+    def get_many(self, jobnames):
+        """the records found for many jobs, 100 per BatchGetItem call"""
+        client = ddb_client()
+        jobnames = list(jobnames)
+        records = []
+        for i in range(0, len(jobnames), BATCH_GET_SIZE):
+            keys = [{'jobname': {'S': jobname}} for jobname in jobnames[i:i + BATCH_GET_SIZE]]
+            request = {TABLE_NAME: {'Keys': keys, 'ConsistentRead': True,
+                                    'ProjectionExpression': ",".join(ATTRIBUTES)}}
+            while request:
+                response = client.batch_get_item(RequestItems=request)
+                records.extend(_from_item(item) for item in response.get('Responses', {}).get(TABLE_NAME, []))
+                # throttled keys are returned for another call
+                request = response.get('UnprocessedKeys', None)
+        return records
+
+    def put(self, record, expected):
+        """writes a record, if the stored one is at revision `expected` (None: there is none,
+           0: it has no revision). raises SubmissionConflict otherwise.
+        """
+        item = _to_item(record)
+        condition = {'ExpressionAttributeNames': {'#rev': "revision"}}
+        if expected is None:
+            condition = {'ConditionExpression': "attribute_not_exists(jobname)"}
+        elif expected == 0:
+            condition['ConditionExpression'] = "attribute_not_exists(#rev)"
+        else:
+            condition['ConditionExpression'] = "#rev = :rev"
+            condition['ExpressionAttributeValues'] = {':rev': {'N': str(expected)}}
+
+        try:
+            response = ddb_client().put_item(
+                TableName=TABLE_NAME,
+                Item=item,
+                **condition)
+        except ClientError as clierr:
+            if clierr.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                raise SubmissionConflict("submission record of %s was updated concurrently" % (record['jobname'],))
             raise
+        log.debug("updated item: %s", response)
+
 
-    _create_job_table(ddb)
+class SQLiteBackend(object):
+    """submission records in a sqlite database, shared by the builders of one host.
+
+       the database is in WAL mode, so that reads don't wait on writers. conditional
+       writes check the stored revision in an IMMEDIATE transaction, which holds the
+       database's write lock across processes until the record is written.
+    """
+    __slots__ = ("path", "conn", "lock")
+
+    name = "sqlite"
+
+    # sqlite limits the number of variables in a statement
+    MAX_VARIABLES = 500
+
+    def __init__(self, path=None):
+        self.path = path or constants.KV_DB
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        # transactions are explicit (isolation_level=None)
+        self.conn = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.setup()
+
+    def setup(self):
+        self.conn.execute("CREATE TABLE IF NOT EXISTS submissions (%s, PRIMARY KEY (jobname))" % (
+            ", ".join("%s %s" % (attrname, "TEXT" if attrtype == "S" else "REAL")
+                      for attrname, attrtype in ATTRIBUTES.items()),))
+
+    def close(self):
+        self.conn.close()
+
+    def get(self, jobname):
+        """the record of a job, or None"""
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM submissions WHERE jobname = ?", (jobname,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def get_many(self, jobnames):
+        """the records found for many jobs"""
+        jobnames = list(jobnames)
+        records = []
+        with self.lock:
+            for i in range(0, len(jobnames), self.MAX_VARIABLES):
+                chunk = jobnames[i:i + self.MAX_VARIABLES]
+                query = "SELECT * FROM submissions WHERE jobname IN (%s)" % (",".join("?" * len(chunk)),)
+                records.extend(dict(row) for row in self.conn.execute(query, chunk))
+        return records
+
+    def put(self, record, expected):
+        """see DynamoDBBackend.put"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.conn.execute("SELECT revision FROM submissions WHERE jobname = ?",
+                                        (record['jobname'],)).fetchone()
+                if expected is None:
+                    ok = row is None
+                elif expected == 0:
+                    ok = row is not None and row['revision'] is None
+                else:
+                    ok = row is not None and row['revision'] == expected
+                if not ok:
+                    raise SubmissionConflict("submission record of %s was updated concurrently" % (record['jobname'],))
+                self.conn.execute("INSERT OR REPLACE INTO submissions (%s) VALUES (%s)" % (
+                    ", ".join(ATTRIBUTES), ", ".join("?" * len(ATTRIBUTES))),
+                    [record.get(attrname, None) for attrname in ATTRIBUTES])
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+
+BACKENDS = {
+    DynamoDBBackend.name: DynamoDBBackend,
+    SQLiteBackend.name: SQLiteBackend
+}
+
+
+def backend():
+    """the store of submission records, chosen by constants.KV_BACKEND"""
+    with backend.lock:
+        if backend.instance is None:
+            if constants.KV_BACKEND not in BACKENDS:
+                raise ValueError("unknown kv backend %s. choose one of: %s" % (
+                    constants.KV_BACKEND, ", ".join(sorted(BACKENDS))))
+            backend.instance = BACKENDS[constants.KV_BACKEND]()
+        return backend.instance
+
+
+backend.instance = None
+backend.lock = threading.Lock()
+
+
+def _setup_kv(**kwargs):
+    """setup the job submission table"""
+    backend().setup()
 
 
 class SubmissionEntry(object):
+    """
+    the submission record of a job, shared by all builders.
+
+    writes are conditional on the revision of the record last loaded (optimistic
+    concurrency): save() raises exc.SubmissionConflict if another builder wrote the
+    record in the meantime. a builder claims the record (claim()) before submitting
+    the job, and releases the claim when it saves the job's id. builders loading a
+    record claimed by another wait for the claim to be released, or to expire.
+
+    the records of jobs other builders can't look up (local jobs) are saved claimed,
+    and claimed again until the jobs finish (see executors.LocalPoolExecutor.hold_claim).
+    """
 
     __slots__ = ("jobname", "submitter",
                  "jobtype", "jobdata", "jobattempt",
-                 "updated_on")
+                 "updated_on", "revision", "claim_expires", "owner", "prefetched")
 
-    TBL_ATTRIBUTES = {
-        "jobname": "S",
-        "submitter": "S",
-        "jobtype": "S",
-        "jobdata": "S",
-        "jobattempt": "N",
-        "updated_on": "N"
-    }
+    TBL_ATTRIBUTES = ATTRIBUTES
 
     def __init__(self, jobname, submitter="", jobtype="batch", jobdata="", jobattempt=1, updated_on=0):
         super(SubmissionEntry, self).__init__()
@@ -137,61 +318,77 @@ class SubmissionEntry(object):
         self.jobdata = jobdata
         self.jobattempt = jobattempt
         self.updated_on = updated_on or time.time()
-
-    # invoke while lock is held
-    def load(self):
-        client = ddb_client()
-        response = client.get_item(
-            TableName=TABLE_NAME,
-            Key={
-                'jobname': {'S': self.jobname}
-            },
-            ConsistentRead=True,
-            ProjectionExpression=",".join(self.TBL_ATTRIBUTES)
-        )
-        if 'Item' not in response:
+        self.revision = None  # None: not in the table. 0: written before revisions.
+        self.claim_expires = 0
+        self.owner = submitter
+        self.prefetched = False
+
+    def claimed_elsewhere(self, now=None):
+        return self.claim_expires > (now or time.time()) and self.submitter != self.owner
+
+    def load(self, wait=CLAIM_TTL):
+        """reads the record. if another builder has claimed it, waits (at most `wait` seconds)
+           for the claim to be released. returns None if there is no record.
+
+           the first load of a record fetched by load_entries() is answered from it.
+        """
+        if self.prefetched:
+            self.prefetched = False
+            if not self.claimed_elsewhere():
+                return self if self.revision is not None else None
+
+        deadline = time.time() + wait
+        while True:
+            found = self._get()
+            if not self.claimed_elsewhere() or time.time() >= deadline:
+                return found
+            log.debug("key %s is claimed by %s. waiting...", self.jobname, self.submitter)
+            time.sleep(CLAIM_POLL_INTERVAL)
+
+    def _get(self):
+        record = backend().get(self.jobname)
+        if record is None:
             log.debug("key %s not found", self.jobname)
+            self.revision = None
             return None
 
-        log.debug("loading key %s: resp=%s", self.jobname, response)
-        item = response['Item']
-
-        def _convert(vval):
-            if 'S' in vval:
-                x = vval['S']
-                if x == "-":
-                    x = ""
-                return x
-            if 'N' in vval:
-                return float(vval['N'])
-
-        for attrname, vval in item.items():
-            setattr(self, attrname, _convert(vval))
+        log.debug("loading key %s: %s", self.jobname, record)
+        self.set_record(record)
+        return self
+
+    def set_record(self, record):
+        """loads the attributes of a stored record"""
+        self.revision = 0
+        self.claim_expires = 0
+        for attrname, value in record.items():
+            if value is not None:
+                setattr(self, attrname, value)
+        self.revision = int(self.revision)
+
+    def set_item(self, item):
+        """loads the attributes of a dynamodb item"""
+        self.set_record(_from_item(item))
+
+    def claim(self, ttl=CLAIM_TTL):
+        """claims the record for the submission of a new attempt"""
+        self.submitter = self.owner
+        self.claim_expires = time.time() + ttl
+        self._put()
 
-    # invoke while lock is held
     def save(self):
-        client = ddb_client()
-        self.updated_on = time.time()
-
-        def _convert(x):
-            if x == "":
-                # values cannot be empty
-                return "-"
-            else:
-                return str(x)
-
-        item = {attrname: {attrtype: _convert(getattr(self, attrname))}
-                for attrname, attrtype in self.TBL_ATTRIBUTES.items()}
+        """writes the record, if it hasn't changed since it was loaded. a claim is released."""
+        self.claim_expires = 0
+        self._put()
 
-        # validate fields -- no empty strings allowed
-        for itemk, itemv in item.items():
-            if "S" in itemv and not itemv['S']:
-                raise ValueError("item attribute %s cannot be empty" % (itemk,))
-
-        response = client.put_item(
-            TableName=TABLE_NAME,
-            Item=item)
-        log.debug("updated item: %s", response)
+    def _put(self):
+        self.updated_on = time.time()
+        expected = self.revision
+        self.revision = (expected or 0) + 1
+        try:
+            backend().put({attrname: getattr(self, attrname) for attrname in ATTRIBUTES}, expected)
+        except BaseException:
+            self.revision = expected
+            raise
 
     def submitted(self, jobtype, jobdata, attempt):
         self.jobtype = jobtype
@@ -215,20 +412,29 @@ class SubmissionEntry(object):
         return ("RUNNING", self.jobdata, self.jobattempt)
 
 
+def load_entries(owner_name, jobnames):
+    """fetches the submission records of many jobs in bulk (see DynamoDBBackend.get_many).
+
+       returns {jobname: SubmissionEntry}, for all jobnames. those without a record
+       have a revision of None. the entries' next load() is answered from what was fetched.
+    """
+    entries = {}
+    for jobname in jobnames:
+        entry = entries[jobname] = SubmissionEntry(jobname, owner_name)
+        entry.prefetched = True
+        entry.revision = None
+
+    for record in backend().get_many(entries):
+        entries[record['jobname']].set_record(record)
+    return entries
+
+
 @contextmanager
-def submit_lock_context(owner_name, jobname):
-    lock = None
-    try:
-        # acquire the lock
-        lock = lock_client().acquire_lock("lock." + jobname)
-        entry = SubmissionEntry(jobname, owner_name)
-        yield entry
-    finally:
-        if lock:
-            try:
-                lock.release()
-            except Exception as exc:
-                log.error("could not release lock: lock.%s", jobname, exc_info=exc)
+def submission_context(owner_name, jobname, entry=None):
+    """the submission record of a job, for the builder owner_name. see SubmissionEntry.
+       entry can be one fetched ahead of time (see load_entries).
+    """
+    yield entry if entry is not None else SubmissionEntry(jobname, owner_name)
 
 
 def configure_parser(main_subparsers):
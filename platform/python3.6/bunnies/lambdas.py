@@ -7,13 +7,15 @@
 import sys
 import os, os.path
 
-import boto3
-import botocore.config
+from .utils import aws_client
 
 import json
 import logging
 import base64
 import io
+import time
+
+from botocore.exceptions import ClientError, EndpointConnectionError, ConnectionClosedError
 
 log = logging.getLogger(__package__)
 
@@ -23,17 +25,7 @@ DATA_REHASH = "data-rehash"
 
 def get_lambda_client():
     """return a client that can wait more than 60 seconds for the result of a lambda"""
-    if get_lambda_client.client:
-        return get_lambda_client.client
-    session = boto3.session.Session()
-    lambda_client = session.client('lambda', config=botocore.config.Config(read_timeout=910, retries={
-        'max_attempts': 0
-    }))
-    get_lambda_client.client = lambda_client
-    return lambda_client
-
-
-get_lambda_client.client = None
+    return aws_client('lambda', read_timeout=910, retries={'max_attempts': 0})
 
 
 def default_context():
@@ -60,7 +52,26 @@ def default_context():
     }
 
 
-def invoke_sync(function_name, client_context=None, Payload=None, LogType='Tail', Qualifier="$LATEST"):
+# Invoke errors worth trying again. The lambda did not run, or could not start.
+TRANSIENT_ERRORS = ("ServiceException", "TooManyRequestsException", "EC2ThrottledException",
+                    "ENILimitReachedException", "ResourceNotReadyException")
+
+
+def _is_transient(err):
+    if isinstance(err, (EndpointConnectionError, ConnectionClosedError)):
+        return True
+    if isinstance(err, ClientError):
+        return err.response.get('Error', {}).get('Code', "") in TRANSIENT_ERRORS
+    return False
+
+
+def invoke_sync(function_name, client_context=None, Payload=None, LogType='Tail', Qualifier="$LATEST",
+                retries=0, retry_delay=5.0):
+    """invoke the lambda and wait for its result. returns (exit_code, response). see main().
+
+       invocations failing with transient errors (throttling, service errors, connection
+       errors) are retried up to `retries` times, with exponential backoff.
+    """
 
     obj_context = default_context()
 
@@ -87,9 +98,23 @@ def invoke_sync(function_name, client_context=None, Payload=None, LogType='Tail'
     #
     #
     # botocore.errorfactory.KMSAccessDeniedException: An error occurred (KMSAccessDeniedException) when calling the Invoke operation (reached max retries: 0): Lambda was unable to decrypt the environment variables because KMS access was denied. Please check the function's KMS key settings. KMS Exception: AccessDeniedExceptionKMS Message: The ciphertext refers to a customer master key that does not exist, does not exist in this region, or you are not allowed to access.
-    log.info("Invoking lambda name:%s qualifier:%s", function_name, Qualifier)
-    response = l.invoke(FunctionName=function_name, ClientContext=context_b64, Payload=Payload, LogType=LogType,
-                        Qualifier=Qualifier)
+    attempt = 0
+    while True:
+        log.info("Invoking lambda name:%s qualifier:%s", function_name, Qualifier)
+        try:
+            response = l.invoke(FunctionName=function_name, ClientContext=context_b64, Payload=Payload,
+                                LogType=LogType, Qualifier=Qualifier)
+            break
+        except (ClientError, EndpointConnectionError, ConnectionClosedError) as err:
+            if attempt >= retries or not _is_transient(err):
+                raise
+            delay = retry_delay * (2 ** attempt)
+            attempt += 1
+            log.warning("transient error invoking %s (attempt %d/%d). retrying in %.1fs: %s",
+                        function_name, attempt, retries, delay, err)
+            time.sleep(delay)
+            if hasattr(Payload, 'seek'):
+                Payload.seek(0)
 
     resp_payload = response['Payload']
     if 'LogResult' in response:
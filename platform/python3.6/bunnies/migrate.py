@@ -6,7 +6,6 @@ import logging
 import os.path
 
 from collections import OrderedDict
-import boto3
 from botocore.exceptions import ClientError
 from . import constants
 from . import utils
@@ -90,7 +89,7 @@ class Journal(MutableMapping):
 
 def _bucket_keys(bucket, prefix, client=None):
     if not client:
-        client = boto3.client('s3')
+        client = utils.aws_client('s3')
 
     base_args = {
         "Bucket": bucket,
@@ -124,7 +123,7 @@ def _rewrite_results_file(src_url, dst_url, translations, client=None):
     """parse it and translate all recognized URLs"""
 
     if not client:
-        client = boto3.client('s3')
+        client = utils.aws_client('s3')
 
     def _walk_obj(obj):
         if isinstance(obj, str):
@@ -177,7 +176,7 @@ def _is_nested(fpath, indirs):
 
 
 def _cmd_migrate_restore(srcpath, tier, dry_run=False, days=3, **kwargs):
-    s3 = boto3.client("s3")
+    s3 = utils.aws_client('s3')
     src_bucket, src_keypart = utils.s3_split_url(srcpath)
 
     src_keys = [sk for sk in _bucket_keys(src_bucket, src_keypart, client=s3)]
@@ -240,7 +239,7 @@ def _cmd_migrate_bucket(srcpath, dstprefix, src_keyprefix="",
                         journal_path="migrate.journal.txt", dry_run=False,
                         keep_source=False, migrate_all=False, threads=1, **kwargs):
 
-    s3 = boto3.client('s3')
+    s3 = utils.aws_client('s3')
     src_bucket, src_keypart = utils.s3_split_url(srcpath)
     if not src_keypart.startswith(src_keyprefix):
         raise ValueError("key portion of SRCPATH (%s) should start with KEYPREFIX (%s)" % (repr(src_keypart), repr(src_keyprefix)))
@@ -6,25 +6,29 @@
 from . import runtime
 from . import exc
 from . import constants
-from . import kvstore
-from .jobs import AWSBatchSimpleJob
+from . import jobs
+from . import graph
+from . import tracing
+from . import simulate
+from . import executors
 from .version import __version__
 from .graph import Cacheable, Transform, Target
 from .environment import ComputeEnv
-from .transfers import s3_streaming_put
-from .config import config
-from .scheduler import Scheduler
+from .scheduler import Admission, Scheduler
+from .escalation import EscalationPolicy
 
+from botocore.exceptions import ClientError
 from datetime import datetime
 import json
 import logging
-import io
 import os.path
-import time
 import uuid
 
 log = logging.getLogger(__name__)
 
+# attempts at scheduling a job whose submission record other builders keep updating
+MAX_SUBMISSION_CONFLICTS = 5
+
 
 def _get_default_region():
     if not _get_default_region.cached:
@@ -44,7 +48,7 @@ class PipelineException(Exception):
 class BuildNode(object):
     """graph of buildable things with dependencies"""
     __slots__ = ("data", "deps", "_uid", "_output_ready", "_jobdef",
-                 "_sched_node", "_attempt", "_attempt_ids", "_usage")
+                 "_sched_node", "_attempt", "_attempt_ids", "_usage", "_held_on", "_requested")
 
     def __init__(self, data):
         self.data = data  # Cacheable
@@ -56,12 +60,15 @@ class BuildNode(object):
         self._attempt = None     # surrogate submitted to the compute environment
         self._attempt_ids = []
         self._usage = []
+        self._held_on = None     # upstream job ids of a revoked eager submission
+        self._requested = None   # (attempt_no, task_resources of that attempt). see requested_resources
 
     @property
     def uid(self):
         if not self._uid:
             if isinstance(self.data, Cacheable):
-                self._uid = self.data.canonical_id
+                with tracing.accumulate("canonical_id"):
+                    self._uid = self.data.canonical_id
                 if not isinstance(self._uid, str):
                     raise ValueError("Node %s computes a non string canonical id: %s", self.data, self._uid)
             else:
@@ -95,11 +102,9 @@ class BuildNode(object):
 
     @property
     def output_url(self):
-        if self._output_ready is None:
-            if not isinstance(self.data, Target):
-                return None
-            return "%s%s" % (self.data.output_prefix(), constants.TRANSFORM_RESULT_FILE)
-        return self._output_ready
+        if not isinstance(self.data, Target):
+            return None
+        return "%s%s" % (self.data.output_prefix(), constants.TRANSFORM_RESULT_FILE)
 
     @property
     def output_ready(self):
@@ -107,15 +112,18 @@ class BuildNode(object):
         if self._output_ready is None:
             if not isinstance(self.data, Target):
                 raise TypeError("only valid on Targets")
-            self._output_ready = self.data.exists()
+            with tracing.accumulate("exists"):
+                self._output_ready = self.data.exists()
         return self._output_ready
 
-    def job_done(self, success):
+    def job_done(self, success, usage=None):
         """
         must be called when the currently submitted job is completed.
         we update the total job usage, (and save logs).
+
+        usage can be provided if it was collected ahead of time (see jobs.UsageCollector)
         """
-        run_usage = self._attempt.get_usage()
+        run_usage = usage if usage is not None else self._attempt.get_usage()
         self._usage.append(run_usage)
 
         log.debug("job_done job_id=%s success=%s (last attempt %s", self.job_id, success, self._attempt_ids[-1])
@@ -150,9 +158,75 @@ class BuildNode(object):
         pairs.sort()
         return pairs
 
+    def measured_runtime(self):
+        """the longest duration of the previous attempts of this node in seconds, or None"""
+        durations = [(attempt['stoppedAt'] - attempt['startedAt']) / 1000.0
+                     for usage in self._usage for attempt in usage['attempts']
+                     if attempt.get('startedAt') and attempt.get('stoppedAt')]
+        return max(durations) if durations else None
+
+    def requested_resources(self, attempt_no=None):
+        """the resources the given attempt (default: the next) of this node is expected to request.
+           the task resources of the last attempt asked about are remembered.
+        """
+        if attempt_no is None:
+            attempt_no = len(self._attempt_ids) + 1
+        if self._requested is None or self._requested[0] != attempt_no:
+            self._requested = (attempt_no, self.data.task_resources(attempt=attempt_no) or {})
+        return self._requested[1]
+
+    def eager_deps(self):
+        """
+        the batch job ids of the unfinished dependencies an eager submission of this node
+        would wait on, sorted. None if the node can't be submitted eagerly.
+        """
+        job_ids = []
+        for dep in self.deps:
+            if dep._sched_node is None or dep._sched_node.state == 'done':
+                continue
+            if dep._sched_node.state not in ('submitted', 'blocked') or dep._attempt is None:
+                return None
+            if dep._attempt.jobtype != "batch":
+                # only batch jobs can wait on each other
+                return None
+            job_ids.append(dep._attempt.job_id)
+        return sorted(job_ids) if job_ids else None
+
+    def can_submit_eagerly(self):
+        job_ids = self.eager_deps()
+        return job_ids is not None and tuple(job_ids) != self._held_on
+
+    def revoke(self, compute_env, cancel=True, hold=False):
+        """
+        withdraws the current (blocked) submission of this node. its attempt number
+        isn't used up.
+
+        with hold, the node isn't submitted eagerly again until the jobs it depended
+        on change (i.e. until their failure is seen).
+        """
+        job_obj = self._attempt
+        if job_obj is None:
+            return
+        self._attempt = None
+        self._held_on = tuple(job_obj.overrides.get('depends_on', ())) if hold else None
+        compute_env.untrack_job(job_obj)
+        for dep in self.deps:
+            if dep._attempt is not None and dep._attempt.job_id in (self._held_on or ()):
+                compute_env.tracker.expedite(dep._attempt.job_id)
+        if cancel:
+            log.debug("revoking job %s (%s)", job_obj.job_id, self.job_id)
+            try:
+                job_obj.cancel(reason=jobs.REVOKED_REASON)
+            except ClientError as clierr:
+                log.warning("could not cancel revoked job %s: %s", job_obj.job_id, clierr)
+
     def schedule(self, compute_env, scheduler_node, build_id="", **kwargs):
         """schedule this build node to execute on the compute_env compute
-           environment. The scheduler node provides historical information"""
+           environment. The scheduler node provides historical information
+
+           if the scheduler node is waiting, the job is submitted eagerly: it will
+           wait in batch for the jobs of its dependencies (see eager_deps).
+        """
 
         if not isinstance(self.data, Transform):
             raise NotImplementedError("cannot schedule non-Transform objects")
@@ -165,11 +239,25 @@ class BuildNode(object):
 
         max_attempt = kwargs.pop("max_attempt", 1)
         min_attempt = kwargs.pop("min_attempt", 1)
+        escalation_policy = kwargs.pop("escalation", None)
+
+        depends_on = []
+        if scheduler_node.state == "waiting":
+            depends_on = self.eager_deps()
+            if not depends_on:
+                raise ValueError("node %s cannot be submitted eagerly" % (job_id,))
+
+        def _mark_submitted():
+            # tell the bunnies scheduler that the job has been submitted
+            if depends_on:
+                scheduler_node.submit_blocked()
+            else:
+                scheduler_node.submit()
 
         log.debug("build %s scheduling job %s...", build_id, job_id)
         assert self._attempt is None
 
-        def _submit_new_job(ctx, attempt_no=1):
+        def _submit_new_job(ctx, attempt_no=1, failed_desc=None):
             # fixme calculate attempts:
             if attempt_no < min_attempt:
                 log.debug("  jump starting job %s at attempt %d",
@@ -185,29 +273,20 @@ class BuildNode(object):
                 scheduler_node.cancel()
                 return
 
-            # let the user's object calculate its resource requirements
-            resources = self.data.task_resources(attempt=attempt_no) or {}
-
-            remote_script_url = "s3://%(bucket)s/jobs/%(envname)s/%(jobid)s/jobscript" % {
-                "bucket": config['storage']['tmp_bucket'],
-                "envname": compute_env.name,
-                "jobid": job_id
-            }
+            # other builders wait until the job is submitted (see kvstore.SubmissionEntry)
+            ctx.claim()
 
-            user_deps_prefix = "s3://%(bucket)s/user_context/%(envname)s/" % {
-                "bucket": config['storage']['tmp_bucket'],
-                "envname": compute_env.name,
-                "jobid": job_id
-            }
+            # let the user's object calculate its resource requirements
+            resources = dict(self.requested_resources(attempt_no))
+            if failed_desc is not None and escalation_policy is not None:
+                # more memory after OOM kills, more time after timeouts
+                resources = escalation_policy.escalate(resources, failed_desc)
 
-            user_deps_url = runtime.upload_user_context(user_deps_prefix)
+            # small jobs can run outside of batch (see executors.RoutingComputeEnv)
+            executor = compute_env.executor_for(self, resources, depends_on=depends_on)
 
-            with io.BytesIO() as exec_fp:
-                script_len = exec_fp.write(self.execution_transfer_script(resources).encode('utf-8'))
-                exec_fp.seek(0)
-                log.debug("  uploading job script for job_id %s at %s ...", job_id, remote_script_url)
-                s3_streaming_put(exec_fp, remote_script_url, content_type="text/x-python", content_length=script_len,
-                                 logprefix=job_id + " jobscript ")
+            # the job script and user context
+            staged = executor.stage_job(job_id, self, resources)
 
             settings = {
                 'vcpus': resources.get('vcpus', None),
@@ -216,40 +295,64 @@ class BuildNode(object):
                 'environment': {
                     "BUNNIES_VERSION": __version__,
                     "BUNNIES_SUBMIT_TIME": str(int(datetime.utcnow().timestamp()*1000)),
-                    "BUNNIES_TRANSFER_SCRIPT": remote_script_url,
-                    "BUNNIES_USER_DEPS": user_deps_url,
+                    "BUNNIES_TRANSFER_SCRIPT": staged['BUNNIES_TRANSFER_SCRIPT'],
+                    "BUNNIES_USER_DEPS": staged['BUNNIES_USER_DEPS'],
                     "BUNNIES_JOBID": job_id,
                     "BUNNIES_ATTEMPT": "%d %d" % (attempt_no, max_attempt),
                     "BUNNIES_RESULT": os.path.join(self.data.output_prefix(), constants.TRANSFORM_RESULT_FILE),
-                    "BUNNIES_BUILDID": build_id
+                    "BUNNIES_BUILDID": build_id,
+                    "BUNNIES_VERIFY_RESULTS": "1" if constants.VERIFY_EMBEDDED_RESULTS else "0"
                 }
             }
+            if depends_on:
+                settings['depends_on'] = depends_on
 
             if settings.get('timeout') <= 0:
                 settings['timeout'] = 24*3600*7 # 7 days
 
-            self._attempt = compute_env.submit_simple_batch_job(job_id, self._jobdef, **settings)
+            self._attempt = executor.submit_simple_batch_job(job_id, self._jobdef,
+                                                             expected_runtime=self.measured_runtime(),
+                                                             **settings)
             self._attempt.meta['attempt_no'] = attempt_no
             self._attempt_ids.append({'attempt_no': attempt_no, 'job_id': self._attempt.job_id})
             # commit the new batch job id to the global kv store
-            ctx.jobtype = "batch"
+            ctx.jobtype = self._attempt.jobtype
             ctx.jobdata = self._attempt.job_id
             ctx.jobattempt = attempt_no
             ctx.submitter = build_id
-            ctx.save()
-            scheduler_node.submit()  # tell the bunnies scheduler that the job has been submitted
+            try:
+                if ctx.jobtype == "local":
+                    # other builders can't look up local jobs. the record stays claimed until the job
+                    # finishes (see executors.LocalPoolExecutor.hold_claim)
+                    ctx.claim()
+                    executor.hold_claim(self._attempt, ctx)
+                else:
+                    ctx.save()
+            except exc.SubmissionConflict:
+                # our claim expired, and another builder took over. withdraw this submission.
+                job_obj, self._attempt = self._attempt, None
+                self._attempt_ids.pop()
+                executor.untrack_job(job_obj)
+                job_obj.cancel(reason="duplicate submission")
+                raise
+            self._held_on = None
+            _mark_submitted()
             return
 
         def _reuse_existing(ctx, job_obj, attempt_no):
             job_obj.meta['attempt_no'] = attempt_no
             self._attempt = compute_env.track_existing_job(job_obj)
             self._attempt_ids.append({'attempt_no': attempt_no, 'job_id': self._attempt.job_id})
-            scheduler_node.submit()  # tell the bunnies scheduler that the job has been submitted
+            _mark_submitted()
             return
 
-        with kvstore.submit_lock_context(build_id, job_id) as ctx:
+        def _schedule_with(ctx):
             ctx.load()
-            if ctx.jobtype != "batch":
+            while ctx.claimed_elsewhere():
+                # still claimed once the wait is over: the job runs on another builder's host
+                log.info("  job %s is running on builder %s. waiting...", job_id, ctx.submitter)
+                ctx.load()
+            if ctx.jobtype not in ("batch", "local"):
                 raise ValueError("unhandled job type")
 
             if not ctx.jobdata:
@@ -262,8 +365,8 @@ class BuildNode(object):
             last_attempt_id = ctx.jobdata
             last_attempt_no = int(ctx.jobattempt)
 
-            # see if it's still tracked by AWS Batch
-            job_obj = AWSBatchSimpleJob.from_job_id(last_attempt_id)
+            # see if it's still tracked by AWS Batch (or the local executor)
+            job_obj = compute_env.job_from_id(last_attempt_id)
             if not job_obj:
                 # no longer tracked
                 log.debug("  job information no longer available for %s. submitting new.", last_attempt_id)
@@ -272,14 +375,27 @@ class BuildNode(object):
             job_desc = job_obj.get_desc()
             job_status = job_desc['status']
             if job_status == "FAILED":
+                # jobs which never ran, because a job they depended on failed, don't use up an attempt
+                next_attempt_no = last_attempt_no if jobs.is_dependency_failure(job_desc.get('statusReason')) \
+                    else last_attempt_no + 1
                 log.debug("  %s state=%s attempt=%d. submitting new attempt=%d",
-                          last_attempt_id, job_status, last_attempt_no, last_attempt_no + 1)
-                return _submit_new_job(ctx, attempt_no=last_attempt_no + 1)
+                          last_attempt_id, job_status, last_attempt_no, next_attempt_no)
+                return _submit_new_job(ctx, attempt_no=next_attempt_no, failed_desc=job_desc)
             else:
                 log.debug("  %s state=%s attempt=%d. can be reused",
                           last_attempt_id, job_status, last_attempt_no)
                 return _reuse_existing(ctx, job_obj, last_attempt_no)
 
+        # records are updated optimistically. when another builder gets there first,
+        # look again at what it did.
+        for _ in range(MAX_SUBMISSION_CONFLICTS):
+            try:
+                with compute_env.submission_context(build_id, job_id) as ctx:
+                    return _schedule_with(ctx)
+            except exc.SubmissionConflict as conflict:
+                log.info("%s. reloading.", conflict)
+        raise exc.BunniesException("could not schedule %s: too many concurrent updates" % (job_id,))
+
     def execution_transfer_script(self, resources):
         """
         Create a self-standing script that executes just the one node.
@@ -291,6 +407,11 @@ class BuildNode(object):
         #
         manifest_s = repr(json.dumps(self.data.manifest()))
         canonical_s = repr(json.dumps(self.data.canonical()))
+
+        # the results of upstream transforms travel with the job, so that
+        # their ls() doesn't go back to s3 at startup.
+        upstream = [inp.node for inp in self.data.inputs.values() if isinstance(inp.node, Transform)]
+        upstream_s = repr(json.dumps(graph.embed_results(upstream), sort_keys=True, separators=(",", ":")))
         resources_s = repr(resources)
 
         # this doesn't get carried on the other side
@@ -300,6 +421,7 @@ class BuildNode(object):
 
         return """#!/usr/bin/env python3
 import bunnies.runtime
+import bunnies.graph
 import bunnies.constants as C
 from bunnies.unmarshall import unmarshall
 import os, os.path
@@ -319,6 +441,8 @@ manifest_s  = %(manifest_s)s
 
 manifest_obj = json.loads(manifest_s)
 
+upstream_s  = %(upstream_s)s
+
 canonical_obj = json.loads(canonical_s)
 
 bunnies.setup_logging()
@@ -331,6 +455,12 @@ os.environ['AWS_DEFAULT_REGION'] = %(default_region)s
 transform = unmarshall(manifest_obj)
 log.info("%%s", json.dumps(manifest_obj, indent=4))
 
+# results of upstream transforms, as resolved at submission. anything
+# missing is fetched concurrently, ahead of ls().
+bunnies.graph.load_embedded_results(json.loads(upstream_s), verify=C.VERIFY_EMBEDDED_RESULTS)
+bunnies.graph.prefetch_ls([inp.node for inp in transform.inputs.values()
+                           if isinstance(inp.node, bunnies.graph.Transform)])
+
 params = {
         'workdir': os.environ.get('BUNNIES_WORKDIR'),
         'scriptdir': os.path.dirname(__file__),
@@ -353,6 +483,7 @@ bunnies.runtime.update_result(result_path,
         environment=env_copy)
 """ % {
     'manifest_s': manifest_s,
+    'upstream_s': upstream_s,
     'canonical_s': canonical_s,
     'default_region': repr(default_region),
     'uid_s': repr(self.uid),
@@ -375,6 +506,9 @@ class BuildGraph(object):
 
         self.scheduler = Scheduler()
 
+        # timing of build phases
+        self.tracer = tracing.Tracer()
+
     def _log_progress(self, task):
         self.counters[task] = self.counters.setdefault(task, 0) + 1
         if self.counters[task] % 100 == 0:
@@ -437,7 +571,8 @@ class BuildGraph(object):
             targets = list([targets])
 
         log.info("adding %d targets to build graph...", len(targets))
-        all_targets = self.targets + self._dealias(targets)
+        with self.tracer.activate(), tracing.span("dealias", targets=len(targets)):
+            all_targets = self.targets + self._dealias(targets)
         self.targets[:] = [x for x in set(all_targets)]
 
     def dependency_order(self):
@@ -488,7 +623,63 @@ class BuildGraph(object):
     def build(self, run_name, **build_args):
         """run all the jobs that need to be run. managed resources created to build the chosen targets will be tagged with the
         given run_name. reusing the same name on a subsequent run will allow resources to be reused.
+
+        the time spent in each phase of the build (and the api calls made) is logged at the end. pass
+        trace_file=PATH (or set BUNNIES_TRACE) to also save it as a chrome trace.
+
+        a local_executor (executors.LocalPoolExecutor) is shut down when the build ends. its
+        unfinished jobs are cancelled.
+        """
+        trace_file = build_args.pop("trace_file", constants.TRACE_FILE)
+        local_executor = build_args.get("local_executor", None)
+        try:
+            with self.tracer.activate(), tracing.span("build", run_name=run_name):
+                return self._build(run_name, **build_args)
+        finally:
+            if local_executor is not None:
+                local_executor.shutdown()
+            log.info("build phases:\n%s", self.tracer.format_summary())
+            if trace_file:
+                self.tracer.write_chrome_trace(trace_file)
+
+    def simulate(self, run_name="simulation", check_outputs=False, **sim_args):
+        """run the build in a simulated compute environment, in virtual time, and return the
+           report of the simulation (see simulate.SimComputeEnv.report): makespan, utilisation,
+           queue times. nothing is submitted.
+
+           sim_args are the parameters of simulate.SimComputeEnv (max_vcpus, history, defaults, ...),
+           and those of build() (max_attempt, min_attempt, eager, vcpu_budget, memory_budget).
+
+           unless check_outputs is True, the outputs of all transforms are assumed missing and
+           all other inputs present, so that the whole graph is simulated.
         """
+        build_args = {k: sim_args.pop(k) for k in ("max_attempt", "min_attempt", "eager", "trace_file",
+                                                   "vcpu_budget", "memory_budget", "escalation")
+                      if k in sim_args}
+        compute_env = simulate.SimComputeEnv(run_name, **sim_args)
+
+        self._reset_build_state()
+        if not check_outputs:
+            for build_node in self.by_uid.values():
+                build_node._output_ready = not isinstance(build_node.data, Transform)
+
+        try:
+            self.build(run_name, compute_env=compute_env, **build_args)
+        except exc.BuildException:
+            log.info("the simulated build failed")
+        return compute_env.report()
+
+    def _reset_build_state(self):
+        """forget the submissions of previous builds"""
+        self.scheduler = Scheduler()
+        for build_node in self.by_uid.values():
+            build_node._sched_node = None
+            build_node._attempt = None
+            build_node._attempt_ids = []
+            build_node._usage = []
+            build_node._held_on = None
+
+    def _build(self, run_name, **build_args):
 
         env_args = {
             "global_scratch_gb": build_args.pop("global_scratch_gb", 0),
@@ -496,15 +687,18 @@ class BuildGraph(object):
             "max_vcpus": build_args.pop("max_vcpus", 4096)
         }
 
+        # submit jobs with batch dependencies on running upstream jobs, instead of
+        # waiting for them to complete.
+        eager = build_args.pop("eager", False)
+
         schedule_opts = {
             "max_attempt": build_args.pop("max_attempt", 3),
             "min_attempt": build_args.pop("min_attempt", 1),
+            # resources of the attempts following a failure. None leaves them to task_resources()
+            "escalation": build_args.pop("escalation", EscalationPolicy()),
             "build_id": run_name + "." + str(uuid.uuid4())
         }
 
-        if build_args:
-            raise ValueError("unrecognized parameters: %s" % (build_args,))
-
         if schedule_opts["max_attempt"] <= 0:
             raise ValueError("max attempt number must be >= 0")
 
@@ -514,31 +708,54 @@ class BuildGraph(object):
         if schedule_opts["min_attempt"] > schedule_opts["max_attempt"]:
             raise ValueError("min and max attempt numbers provided are incompatible")
 
-        compute_env = ComputeEnv(run_name, **env_args)
+        # environments which simulate execution can be provided (see simulate.py)
+        compute_env = build_args.pop("compute_env", None)
+        # jobs which opt in run on the build host (see executors.LocalPoolExecutor)
+        local_executor = build_args.pop("local_executor", None)
+
+        # jobs are only submitted while the resources requested by those in flight
+        # fit these budgets. None picks the default, 0 lifts the limit.
+        vcpu_budget = build_args.pop("vcpu_budget", None)
+        memory_budget = build_args.pop("memory_budget", None)
+
+        if build_args:
+            raise ValueError("unrecognized parameters: %s" % (build_args,))
+        if compute_env is None:
+            compute_env = ComputeEnv(run_name, **env_args)
+        if vcpu_budget is None:
+            vcpu_budget = constants.ADMISSION_VCPU_FACTOR * compute_env.max_vcpus
+        if local_executor is not None:
+            compute_env = executors.RoutingComputeEnv(compute_env, local_executor)
+        self.scheduler.eager_deps = jobs.MAX_DEPENDS_ON if eager else 0
+        self.scheduler.admission = Admission(vcpus=vcpu_budget, memory=memory_budget)
 
         nodei = -1
-        for nodei, build_node in enumerate(self.build_order()):
-            # check compatibility with compute_environment
-            # wrap container images.
-            # create schedulable entities
-            build_node.register_job_definition(compute_env)
-
-            sched_node = self.scheduler.add_node(build_node.job_id, build_node)
-            build_node._sched_node = sched_node
-
-            # inform scheduler of graph dependencies
-            for dep in build_node.deps:
-                # nodes are iterated in dependency order. Just consider
-                # nodes which have to be built. skip those which aren't
-                # part of build order
-                if dep._sched_node:
-                    sched_node.depends_on(dep._sched_node)
+        with tracing.span("plan"):
+            # build_order() checks the existence of outputs as it goes
+            for nodei, build_node in enumerate(self.build_order()):
+                # check compatibility with compute_environment
+                # wrap container images.
+                # create schedulable entities
+                with tracing.accumulate("register_job_definition"):
+                    build_node.register_job_definition(compute_env)
+
+                sched_node = self.scheduler.add_node(build_node.job_id, build_node)
+                build_node._sched_node = sched_node
+
+                # inform scheduler of graph dependencies
+                for dep in build_node.deps:
+                    # nodes are iterated in dependency order. Just consider
+                    # nodes which have to be built. skip those which aren't
+                    # part of build order
+                    if dep._sched_node:
+                        sched_node.depends_on(dep._sched_node)
 
         num_jobs = nodei + 1
         log.info("current number of jobs: %d", num_jobs)
 
         log.info("initializing build graph...")
-        self.scheduler.initialize()
+        with tracing.span("scheduler.initialize"):
+            self.scheduler.initialize()
         log.info("build graph initialized.")
 
         if num_jobs == 0:
@@ -546,8 +763,15 @@ class BuildGraph(object):
             return
 
         # we'll have to execute jobs
-        compute_env.create()
-        compute_env.wait_ready()
+        with tracing.span("compute_env.create"):
+            compute_env.create()
+        with tracing.span("compute_env.wait_ready"):
+            compute_env.wait_ready()
+
+        # resumed builds find the submissions of their jobs in bulk
+        with tracing.span("preload", jobs=num_jobs):
+            compute_env.preload(schedule_opts["build_id"],
+                                [sched_node.data.job_id for sched_node in self.scheduler.nodes.values()])
 
         def _running_jobs_by_state(status_map):
             """return a dictionary summary of ids submitted to the compute environment, by state"""
@@ -596,52 +820,101 @@ class BuildGraph(object):
         def _wait_once(status_map):
             return True
 
+        # lookups of queues, compute environments and instances are shared for the whole build
+        usage_collector = compute_env.usage_collector()
+
         status = {}
 
         last_scheduler_state = {}
         last_execution_state = {}
 
+        def _is_current(sched_node, job_obj):
+            # revoked submissions can still be reported once
+            attempt = sched_node.data._attempt
+            return attempt is not None and attempt.job_id == job_obj.job_id
+
+        def _requested_resources(sched_node):
+            return sched_node.data.requested_resources()
+
+        def _withdraw_revoked():
+            for revoked_node in self.scheduler.pop_revoked():
+                with tracing.span("revoke", job=revoked_node.data.job_id):
+                    revoked_node.data.revoke(compute_env)
+
         # build loop
         while True:
+            _withdraw_revoked()
             status = self.scheduler.status()
 
-            if not (status['ready'] or status['waiting'] or status['submitted']):
+            if not (status['ready'] or status['waiting'] or status['submitted'] or status['blocked']):
                 # all done
                 log.info("schedule complete")
                 break
 
-            # process ready nodes
-            if status['ready']:
-                for sched_node in status['ready']:
+            # process ready nodes, as the admission budget allows
+            admitted = self.scheduler.admit(status['ready'], _requested_resources)
+            if admitted:
+                for sched_node in admitted:
                     build_node = sched_node.data
-                    build_node.schedule(compute_env, sched_node, **schedule_opts)
+                    with tracing.span("submit", job=build_node.job_id):
+                        build_node.schedule(compute_env, sched_node, **schedule_opts)
                 # jobs have either been submitted or cancelled. states have
                 # propagated
                 continue
 
+            # submit downstream jobs ahead of time. ready jobs held back by the budget come first.
+            eager_nodes = []
+            if not status['ready']:
+                eager_nodes = self.scheduler.admit([sched_node for sched_node in status['eager']
+                                                    if sched_node.data.can_submit_eagerly()], _requested_resources)
+            if eager_nodes:
+                for sched_node in eager_nodes:
+                    with tracing.span("submit", job=sched_node.data.job_id, eager=True):
+                        sched_node.data.schedule(compute_env, sched_node, **schedule_opts)
+                continue
+
             exec_completion = None
 
-            if status['submitted']:
+            if status['submitted'] or status['blocked']:
                 # check for status of completed jobs
-                exec_completion = compute_env.wait_for_jobs(condition=_wait_once)
+                with tracing.span("poll"):
+                    exec_completion = compute_env.wait_for_jobs(condition=_wait_once)
 
                 running_jobs_changed = False
 
                 success_jobs = exec_completion.get('SUCCEEDED', [])
+                # failures of jobs which were running come first. they revoke blocked jobs downstream.
+                failed_jobs = sorted(exec_completion.get('FAILED', []),
+                                     key=lambda item: self.scheduler.get_node(item[0].name).state == 'blocked')
+
+                # one round of describe calls for all the jobs that just completed
+                completed_ids = [update_job.job_id for update_job, _ in success_jobs + failed_jobs]
+                with tracing.span("collect_usage", jobs=len(completed_ids)):
+                    usages = usage_collector.collect(completed_ids) if completed_ids else {}
+
                 for update_job, _ in success_jobs:
                     sched_node = self.scheduler.get_node(update_job.name)
-                    sched_node.data.job_done(True)
+                    if not _is_current(sched_node, update_job):
+                        continue
+                    sched_node.data.job_done(True, usage=usages.get(update_job.job_id, None))
                     sched_node.done()
                     running_jobs_changed = True
 
-                failed_jobs = exec_completion.get('FAILED', [])
                 for update_job, update_reason in failed_jobs:
                     sched_node = self.scheduler.get_node(update_job.name)
-                    sched_node.data.job_done(False)
-                    sched_node.failed(update_reason)
+                    if not _is_current(sched_node, update_job):
+                        continue
                     running_jobs_changed = True
-
-                time.sleep(5.0)
+                    if sched_node.state == 'blocked':
+                        # failed before its dependencies were seen to complete
+                        sched_node.data.revoke(compute_env, cancel=False, hold=True)
+                        sched_node.revoke(None if jobs.is_dependency_failure(update_reason) else update_reason)
+                    else:
+                        sched_node.data.job_done(False, usage=usages.get(update_job.job_id, None))
+                        sched_node.failed(update_reason)
+                    _withdraw_revoked()
+
+                compute_env.sleep(5.0)
                 if running_jobs_changed:
                     continue
 
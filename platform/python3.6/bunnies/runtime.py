@@ -9,10 +9,9 @@ import logging
 import shutil
 import tempfile
 import zipfile
-import boto3
 import requests
 
-from .utils import get_blob_ctx, walk_tree, run_cmd
+from .utils import get_blob_ctx, walk_tree, run_cmd, aws_client
 from .exc import NoSuchFile
 
 from . import transfers
@@ -82,7 +81,7 @@ def setenv_batch_metadata():
     if not os.environ.get("AWS_BATCH_JOB_ID", None):
         return
     batch_job_id = os.environ.get("AWS_BATCH_JOB_ID")
-    batch = boto3.client('batch')
+    batch = aws_client('batch')
     job_descs = batch.describe_jobs(
             jobs=[batch_job_id]
     )['jobs']
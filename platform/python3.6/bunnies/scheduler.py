@@ -21,13 +21,20 @@ class SchedNode(object):
     failing a node that is submitted just logs the failure and places the
     node back in ready state (this allows retries). it needs to be explitly
     cancelled to be considered fatal.
+
+    with eager submission (see Scheduler), a waiting node whose dependencies
+    are all submitted (or done) can be submitted ahead of time, and becomes
+    'blocked'. it turns 'submitted' once its dependencies are done. if one of
+    them fails instead, the node is revoked: it goes back to waiting (or
+    cancelled), and is listed in the scheduler's revoked nodes, so that the
+    user can withdraw the submission.
     """
     __slots__ = ("uid", "sched", "state", "failures", "deps", "rdeps", "data")
 
     def __init__(self, uid, sched, data):
         self.uid = uid
         self.sched = sched
-        self.state = 'waiting'  # waiting, ready, done, cancelled, submitted
+        self.state = 'waiting'  # waiting, ready, done, cancelled, submitted, blocked
         self.failures = []
         self.deps = {}
         self.rdeps = {}
@@ -58,7 +65,11 @@ class SchedNode(object):
                     rdep.cascade()
             return
 
-        # node is either: ready, waiting, submitted
+        # node is either: ready, waiting, submitted, blocked
+
+        if self.state == "blocked":
+            self._cascade_blocked()
+            return
 
         if self.state == "submitted":
             # we're not going to change that state. we need to wait for
@@ -88,7 +99,7 @@ class SchedNode(object):
             # cancel explicitly (we let the job finish)
             return
 
-        if 'waiting' in dep_states or 'submitted' in dep_states:
+        if 'waiting' in dep_states or 'submitted' in dep_states or 'blocked' in dep_states:
             assert self.state != "submitted"
             self.state = 'waiting'
             return
@@ -97,6 +108,45 @@ class SchedNode(object):
             self.sched.enqueue(self)
             return
 
+    def _cascade_blocked(self):
+        dep_states = {d.state for d in self.deps.values()}
+
+        if dep_states <= {'done'}:
+            # the submission is no longer held back
+            self.state = 'submitted'
+            return
+
+        if 'cancelled' in dep_states:
+            self.sched.revoked[self.uid] = self
+            self.cancel()
+            return
+
+        if dep_states & {'waiting', 'ready'}:
+            # a dependency failed and will be retried
+            self.sched.revoked[self.uid] = self
+            self.state = 'waiting'
+            self._cascade_blocked_rdeps()
+            return
+
+    def _cascade_blocked_rdeps(self):
+        for rdep in list(self.rdeps.values()):
+            if rdep.state == 'blocked':
+                rdep.cascade()
+
+    def eager_ready(self, max_pending):
+        """True if the node can be submitted ahead of its dependencies (see submit_blocked).
+           At most max_pending dependencies may be unfinished.
+        """
+        if self.state != 'waiting' or max_pending <= 0:
+            return False
+        pending = 0
+        for dep in self.deps.values():
+            if dep.state in ('submitted', 'blocked'):
+                pending += 1
+            elif dep.state != 'done':
+                return False
+        return 0 < pending <= max_pending
+
     def depends_on(self, dep_node):
         self.__expect_state("depends_on", ('waiting', 'ready'))
         self.deps[dep_node.uid] = dep_node
@@ -106,21 +156,44 @@ class SchedNode(object):
         self.__expect_state("failed", ('submitted',))
         self.failures.append(reason)
         self.state = 'waiting'
+        self.sched.release(self)
         self.cascade()
+        self._cascade_blocked_rdeps()
 
     def submit(self):
         self.__expect_state("submit", ("ready",))
         self.state = 'submitted'
         self.cascade()
 
+    def submit_blocked(self):
+        """submitted ahead of time, while dependencies are still running"""
+        self.__expect_state("submit_blocked", ("waiting",))
+        self.state = 'blocked'
+        self.cascade()
+
+    def revoke(self, reason=None):
+        """the blocked submission was withdrawn (e.g. it failed before its
+           dependencies were seen to complete). the node waits again.
+        """
+        self.__expect_state("revoke", ("blocked",))
+        if reason is not None:
+            self.failures.append(reason)
+        self.state = 'waiting'
+        self.sched.release(self)
+        self.cascade()
+        self._cascade_blocked_rdeps()
+
     def done(self):
-        self.__expect_state("done", ("ready", "submitted"))
+        # a blocked node can complete before its dependencies are seen to be done
+        self.__expect_state("done", ("ready", "submitted", "blocked"))
         self.state = 'done'
+        self.sched.release(self)
         self.cascade()
 
     def cancel(self):
-        self.__expect_state("cancel", ("waiting", "ready", "submitted"))
+        self.__expect_state("cancel", ("waiting", "ready", "submitted", "blocked"))
         self.state = 'cancelled'
+        self.sched.release(self)
         self.cascade()
 
 
@@ -149,6 +222,55 @@ def get_leaves(n, visited=None):
                 yield leaf
 
 
+class Admission(object):
+    """
+    admits nodes for submission while the summed resource requests of the nodes
+    in flight fit a budget, e.g. Admission(vcpus=4915, memory=None). limits which
+    are None (or 0) are unbounded.
+
+    candidates are considered in order. those which don't fit are passed over, so
+    that smaller ones use the leftover capacity. when nothing is in flight, the
+    first candidate is admitted regardless of its size.
+    """
+    __slots__ = ("limits", "requests", "used")
+
+    def __init__(self, **limits):
+        self.limits = {name: limit for name, limit in limits.items() if limit}
+        self.requests = {}  # uid: {resource: amount}
+        self.used = {name: 0 for name in self.limits}
+
+    def fits(self, request):
+        if not self.requests:
+            return True
+        return all(self.used[name] + (request.get(name) or 0) <= limit for name, limit in self.limits.items())
+
+    def admit(self, uid, request):
+        self.release(uid)
+        self.requests[uid] = {name: request.get(name) or 0 for name in self.limits}
+        for name, amount in self.requests[uid].items():
+            self.used[name] += amount
+
+    def release(self, uid):
+        request = self.requests.pop(uid, None)
+        for name, amount in (request or {}).items():
+            self.used[name] -= amount
+
+    def select(self, nodes, request_fn):
+        """the nodes admitted, in order. request_fn(node) -> {resource: amount}. it isn't
+           called for nodes already admitted.
+        """
+        admitted = []
+        for node in nodes:
+            if node.uid in self.requests:
+                admitted.append(node)
+                continue
+            request = request_fn(node)
+            if self.fits(request):
+                self.admit(node.uid, request)
+                admitted.append(node)
+        return admitted
+
+
 class Scheduler(object):
     """the design of this scheduler is that it should be invoked
        iteratively to obtain a list of nodes that are "ready" to process.
@@ -159,9 +281,15 @@ class Scheduler(object):
           - be cancelled: node.cancelled()
     """
 
-    def __init__(self):
+    def __init__(self, eager_deps=0):
         self.nodes = OrderedDict()
         self.ready = OrderedDict()
+        self.revoked = OrderedDict()
+        # nodes with at most this many unfinished dependencies can be submitted
+        # eagerly (see SchedNode.submit_blocked). 0 disables eager submission.
+        self.eager_deps = eager_deps
+        # caps the resources of submitted and blocked nodes. see admit()
+        self.admission = None
 
     def initialize(self):
         visited = {}
@@ -185,6 +313,25 @@ class Scheduler(object):
     def dequeue(self, node):
         self.ready.pop(node.uid, None)
 
+    def admit(self, nodes, request_fn):
+        """the nodes (ready, or eager) which can be submitted within the admission budget,
+           in order. their requests count against the budget until they're done,
+           cancelled, failed, or revoked.
+        """
+        if self.admission is None:
+            return list(nodes)
+        return self.admission.select(nodes, request_fn)
+
+    def release(self, node):
+        if self.admission is not None:
+            self.admission.release(node.uid)
+
+    def pop_revoked(self):
+        """nodes whose blocked submission was revoked since the last call"""
+        revoked = list(self.revoked.values())
+        self.revoked.clear()
+        return revoked
+
     def status(self):
         """
         get a list of nodes that are ready for submission
@@ -194,6 +341,8 @@ class Scheduler(object):
           'cancelled': [...]
           'waiting': [...]
           'submitted': [...]
+          'blocked': [...]
+          'eager': [...]    # waiting nodes which can be submitted eagerly
         }
 
         For updates, users should:
@@ -202,6 +351,10 @@ class Scheduler(object):
                - inspect failures (len(node.failures) != 0)
                - submit() or cancel()
 
+          - optionally, process eager nodes: submit_blocked() or leave them waiting
+
+          - withdraw the submissions of pop_revoked() nodes
+
         node.submit(), node.done(), and node.cancel() will propagate
         state to nodes that depend on them.
         """
@@ -210,8 +363,12 @@ class Scheduler(object):
             'done': [],
             'cancelled': [],
             'waiting': [],
-            'submitted': []
+            'submitted': [],
+            'blocked': [],
+            'eager': []
         }
         for node in self.nodes.values():
             status[node.state].append(node)
+            if self.eager_deps > 0 and node.eager_ready(self.eager_deps):
+                status['eager'].append(node)
         return status
@@ -0,0 +1,435 @@
+"""
+   Simulated compute environment, to predict the makespan of builds.
+
+   SimComputeEnv stands in for environment.ComputeEnv. The build loop runs as it
+   does against AWS Batch (scheduling, retries, polling), but jobs execute in
+   virtual time, so that a build of days is simulated in seconds:
+
+   >>> history = UsageHistory(usage.UsageStore())    # filled by `bunnies usage sync`
+   >>> report = build_pipeline(targets).simulate(history=history, max_vcpus=256)
+   >>> print(format_report(report))
+
+   The duration of each job attempt is drawn from the attempts of the same
+   transform in the usage history (or from per-transform defaults), and so is
+   its probability of failing. Jobs hold the vcpus and memory requested by their
+   task_resources() while running, and wait in the queue until those are free.
+"""
+import heapq
+import logging
+import random
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from . import jobs
+from . import usage
+from .utils import percentiles
+
+log = logging.getLogger(__name__)
+
+DEFAULT_DURATION_S = 600.0
+SIMULATED_FAILURE_REASON = jobs.CONTAINER_EXIT_REASON + " (simulated failure)"
+TIMEOUT_REASON = jobs.TIMEOUT_REASON
+
+
+class UsageHistory(object):
+    """attempt durations and failure rates of previous jobs, by transform name: a view of
+       a usage.UsageStore (by default, a new one in memory). an attempt failed if its job
+       was attempted again.
+    """
+
+    __slots__ = ("store", "cache")
+
+    def __init__(self, store=None):
+        self.store = store if store is not None else usage.UsageStore(":memory:")
+        self.cache = {}  # name => ([seconds, ...], failures)
+
+    def load(self, *paths):
+        """adds usage files (local paths or s3 urls). see usage.UsageStore.load"""
+        self.store.load(*paths)
+        self.cache.clear()
+        return self
+
+    def scan(self, prefix_url):
+        """adds all the usage files found under an s3 prefix (e.g. a storage write_url)"""
+        self.store.sync(prefix_url)
+        self.cache.clear()
+        return self
+
+    def _history(self, name):
+        if name not in self.cache:
+            rows = self.store.attempts(name)
+            last = {}
+            for row in rows:
+                last[row['folder']] = max(last.get(row['folder'], 0), row['attempt_no'])
+            self.cache[name] = ([row['duration_s'] for row in rows],
+                                sum(1 for row in rows if row['attempt_no'] < last[row['folder']]))
+        return self.cache[name]
+
+    def durations(self, name):
+        """durations of the attempts of the transform's jobs, in seconds"""
+        return self._history(name)[0]
+
+    def failure_rate(self, name):
+        durations, failures = self._history(name)
+        return failures / len(durations) if durations else None
+
+
+class SimJob(object):
+    """stands in for jobs.AWSBatchSimpleJob"""
+
+    jobtype = "batch"
+
+    __slots__ = ("env", "name", "transform", "job_id", "overrides", "meta", "vcpus", "memory", "timeout",
+                 "depends_on", "status", "reason", "created_at", "started_at", "stopped_at", "outcome")
+
+    def __init__(self, env, name, transform, job_id, **overrides):
+        self.env = env
+        self.name = name
+        self.transform = transform
+        self.job_id = job_id
+        self.overrides = overrides
+        self.meta = {}
+        self.vcpus = overrides.get('vcpus') or 1
+        self.memory = overrides.get('memory') or 0
+        self.timeout = overrides.get('timeout') or -1
+        self.depends_on = list(overrides.get('depends_on') or ())
+        self.status = "SUBMITTED"
+        self.reason = ""
+        self.created_at = env.clock
+        self.started_at = None
+        self.stopped_at = None
+        self.outcome = None  # (duration, failure reason or None), drawn at start
+
+    def get_desc(self, client=None):
+        return self.env.describe(self)
+
+    def cancel(self, reason=None, terminate=True, client=None):
+        return self.env.cancel(self, reason=reason)
+
+    def get_usage(self, collector=None):
+        return self.env.collect([self.job_id])[self.job_id]
+
+
+class _SubmissionRecord(object):
+    """stands in for kvstore.SubmissionEntry, in memory"""
+
+    __slots__ = ("jobname", "submitter", "jobtype", "jobdata", "jobattempt", "updated_on")
+
+    def __init__(self, jobname, submitter=""):
+        self.jobname = jobname
+        self.submitter = submitter
+        self.jobtype = "batch"
+        self.jobdata = ""
+        self.jobattempt = 1
+        self.updated_on = 0
+
+    def claimed_elsewhere(self, now=None):
+        return False
+
+    def load(self):
+        pass
+
+    def claim(self):
+        pass
+
+    def save(self):
+        self.updated_on = time.time()
+
+
+class SimComputeEnv(object):
+    """a compute environment of max_vcpus (and optionally max_memory MiB) running jobs in virtual time.
+
+       history: UsageHistory of previous runs, or the usage.UsageStore it views
+       defaults: {transform_name: {'duration': seconds or [seconds, ...], 'failure_rate': 0.1}}
+                 for transforms absent from the history (or to override it).
+       default_duration: duration of the jobs of other transforms, in seconds.
+       startup_s: time it takes for the environment to become ready.
+
+       The virtual clock starts at the current time, so that the jobs' timestamps look real.
+    """
+
+    def __init__(self, name, global_scratch_gb=0, local_scratch_gb=1280, max_vcpus=4096, max_memory=None,
+                 history=None, defaults=None, default_duration=DEFAULT_DURATION_S, startup_s=0.0, seed=0, **kwargs):
+        if kwargs:
+            raise ValueError("unrecognized parameters: %s" % (kwargs,))
+        self.name = name
+        self.max_vcpus = max_vcpus or 4096
+        self.max_memory = max_memory
+        self.history = history if isinstance(history, UsageHistory) else UsageHistory(history)
+        self.defaults = defaults or {}
+        self.default_duration = default_duration
+        self.startup_s = startup_s
+        self.rng = random.Random(seed)
+
+        self.clock = self.t0 = time.time()
+        self.submissions = {}      # job_name: submitted_job_obj
+        self.tracker = jobs.JobPollTracker(describe_fn=self.describe_jobs)
+        self.job_definitions = {}
+        self.records = {}          # job_name: _SubmissionRecord
+        self.jobs = OrderedDict()  # job_id: SimJob, in submission order
+        self.queued = OrderedDict()
+        self.running = []          # heap of (stopped_at, job_id)
+        self.used_vcpus = 0
+        self.used_memory = 0
+        self.failed_since_dispatch = False
+        self.seq = 0
+
+        self.disks = {}
+        for diskname, size_gb in (('scratch', global_scratch_gb), ('localscratch', local_scratch_gb)):
+            if size_gb > 0:
+                self.disks[diskname] = {'name': diskname, 'instance_mountpoint': "/mnt/%s-%s" % (self.name, diskname)}
+
+    #
+    # ComputeEnv interface
+    #
+    def get_disk(self, diskname):
+        return dict(self.disks[diskname]) if diskname in self.disks else None
+
+    def create(self):
+        self.sleep(self.startup_s)
+
+    def wait_ready(self):
+        pass
+
+    def register_simple_batch_jobdef(self, name, container_image):
+        return self.job_definitions.setdefault((name, container_image), {'name': name, 'image': container_image})
+
+    @contextmanager
+    def submission_context(self, owner_name, jobname):
+        record = self.records.get(jobname, None)
+        if record is None:
+            record = self.records[jobname] = _SubmissionRecord(jobname, owner_name)
+        yield record
+
+    def job_from_id(self, job_id):
+        return self.jobs.get(job_id, None)
+
+    def executor_for(self, build_node, resources, depends_on=()):
+        return self
+
+    def preload(self, owner_name, job_names):
+        pass
+
+    def stage_job(self, job_id, build_node, resources):
+        return {'BUNNIES_TRANSFER_SCRIPT': "sim://%s/jobscript" % (job_id,),
+                'BUNNIES_USER_DEPS': "sim://user_context.zip"}
+
+    def submit_simple_batch_job(self, job_name, job_def, expected_runtime=None, **job_params):
+        if job_name in self.submissions:
+            raise ValueError("a job with that name has already been submitted: %s", job_name)
+        self.seq += 1
+        job_obj = SimJob(self, job_name, job_def['name'], "sim-%08d" % (self.seq,), **job_params)
+        job_obj.meta['expected_runtime'] = expected_runtime
+        job_obj.meta['timeout'] = job_params.get('timeout', None)
+        self.jobs[job_obj.job_id] = job_obj
+        self.queued[job_obj.job_id] = job_obj
+        self.submissions[job_name] = job_obj
+        self.tracker.track(job_obj.job_id, state="SUBMITTED", expected_runtime=expected_runtime,
+                           timeout=job_obj.meta['timeout'], now=self.clock)
+        self._dispatch()
+        return job_obj
+
+    def track_existing_job(self, job_obj):
+        self.submissions[job_obj.name] = job_obj
+        self.tracker.track(job_obj.job_id, expected_runtime=job_obj.meta.get('expected_runtime'),
+                           timeout=job_obj.meta.get('timeout'), now=self.clock)
+        return job_obj
+
+    def untrack_job(self, job_obj):
+        if self.submissions.get(job_obj.name, None) is job_obj:
+            del self.submissions[job_obj.name]
+        self.tracker.untrack(job_obj.job_id)
+
+    def wait_for_jobs(self, condition=None, interval=2*60):
+        """advances the clock to the next poll of the tracked jobs. see ComputeEnv.wait_for_jobs"""
+        if not self.submissions:
+            return {}
+
+        id_map = {obj.job_id: obj for obj in self.submissions.values()}
+        while True:
+            next_due = self.tracker.next_due()
+            if next_due is not None:
+                self.sleep(max(0.0, min(interval, next_due - self.clock)))
+            id_status = self.tracker.poll(now=self.clock)
+            if next_due is None or condition is None or condition(id_status):
+                break
+
+        obj_status = {}
+        for state in id_status:
+            obj_status[state] = [(id_map[job_id], reason) for (job_id, reason) in id_status[state]
+                                 if job_id in id_map]
+
+        for (job_obj, _) in obj_status.get('SUCCEEDED', []) + obj_status.get('FAILED', []):
+            del self.submissions[job_obj.name]
+            self.tracker.untrack(job_obj.job_id)
+        return obj_status
+
+    def usage_collector(self):
+        return self
+
+    def sleep(self, seconds):
+        """advances the virtual clock"""
+        self._advance(self.clock + seconds)
+
+    #
+    # job execution
+    #
+    def _draw(self, job_obj):
+        """(duration, failure reason or None) of a job's attempt"""
+        name = job_obj.transform
+        settings = self.defaults.get(name, {})
+        samples = self.history.durations(name)
+        duration = settings.get('duration', None)
+        if duration is None:
+            duration = samples if samples else self.default_duration
+        if isinstance(duration, (list, tuple)):
+            duration = self.rng.choice(duration)
+
+        failure_rate = settings.get('failure_rate', None)
+        if failure_rate is None:
+            failure_rate = self.history.failure_rate(name) or 0.0
+
+        reason = None
+        if self.rng.random() < failure_rate:
+            # failures happen at some point during the run
+            duration = self.rng.uniform(0.0, duration)
+            reason = SIMULATED_FAILURE_REASON
+        if job_obj.timeout > 0 and duration > job_obj.timeout:
+            duration, reason = job_obj.timeout, TIMEOUT_REASON
+        return duration, reason
+
+    def _fits(self, job_obj):
+        if self.used_vcpus + job_obj.vcpus > self.max_vcpus:
+            return False
+        return self.max_memory is None or self.used_memory + job_obj.memory <= self.max_memory
+
+    def _stop(self, job_obj, status, reason):
+        self.queued.pop(job_obj.job_id, None)
+        self.failed_since_dispatch = self.failed_since_dispatch or status == "FAILED"
+        job_obj.status = status
+        job_obj.reason = reason
+        job_obj.stopped_at = self.clock
+
+    def _dispatch(self):
+        """fails the queued jobs whose dependencies failed, and starts those which can run, in queue order"""
+        changed = True
+        while changed:
+            changed = False
+            if self.used_vcpus >= self.max_vcpus and not self.failed_since_dispatch:
+                # nothing can start, and no dependency failed
+                return
+            self.failed_since_dispatch = False
+            for job_obj in list(self.queued.values()):
+                deps = [self.jobs[dep_id].status for dep_id in job_obj.depends_on if dep_id in self.jobs]
+                if "FAILED" in deps:
+                    self._stop(job_obj, "FAILED", jobs.DEPENDENCY_FAILED_REASON)
+                    changed = True
+                    continue
+                if any(dep != "SUCCEEDED" for dep in deps):
+                    job_obj.status = "PENDING"
+                    continue
+                too_big = job_obj.vcpus > self.max_vcpus or \
+                    (self.max_memory is not None and job_obj.memory > self.max_memory)
+                if too_big:
+                    # batch would leave it runnable forever
+                    self._stop(job_obj, "FAILED", "simulation: the job needs more resources than the environment has")
+                    log.warning("job %s (%d vcpus, %d MiB) can never run in %s", job_obj.name, job_obj.vcpus,
+                                job_obj.memory, self.name)
+                    continue
+                job_obj.status = "RUNNABLE"
+                if not self._fits(job_obj):
+                    continue
+                del self.queued[job_obj.job_id]
+                job_obj.status = "RUNNING"
+                job_obj.started_at = self.clock
+                job_obj.outcome = self._draw(job_obj)
+                self.used_vcpus += job_obj.vcpus
+                self.used_memory += job_obj.memory
+                heapq.heappush(self.running, (self.clock + job_obj.outcome[0], job_obj.job_id))
+
+    def _advance(self, until):
+        """runs the jobs up to the given time"""
+        while self.running and self.running[0][0] <= until:
+            stopped_at, job_id = heapq.heappop(self.running)
+            job_obj = self.jobs[job_id]
+            self.clock = max(self.clock, stopped_at)
+            self.used_vcpus -= job_obj.vcpus
+            self.used_memory -= job_obj.memory
+            reason = job_obj.outcome[1]
+            self._stop(job_obj, "FAILED" if reason else "SUCCEEDED", reason or "Essential container in task exited")
+            self._dispatch()
+        self.clock = max(self.clock, until)
+
+    def cancel(self, job_obj, reason=None):
+        # like batch, only jobs which haven't started can be cancelled
+        if job_obj.job_id not in self.queued:
+            return False
+        self._stop(job_obj, "FAILED", reason if reason is not None else "cancelled by user")
+        self._dispatch()
+        return True
+
+    def describe(self, job_obj):
+        return jobs.describe_unbatched_job(job_obj, job_obj.vcpus, job_obj.memory, timeout=job_obj.timeout,
+                                           jobDefinition=job_obj.transform)
+
+    def describe_jobs(self, job_ids):
+        return [self.describe(self.jobs[job_id]) for job_id in job_ids if job_id in self.jobs]
+
+    def collect(self, job_ids):
+        """usage documents of the given jobs, as a jobs.UsageCollector would return"""
+        return {job_id: jobs.unbatched_job_usage(self.describe(self.jobs[job_id]), self.jobs[job_id].vcpus,
+                                                 self.jobs[job_id].memory)
+                for job_id in job_ids}
+
+    def report(self):
+        """makespan, utilisation and queue times of the jobs run so far"""
+        started = [job_obj for job_obj in self.jobs.values() if job_obj.started_at is not None]
+        finished = [job_obj for job_obj in started if job_obj.stopped_at is not None]
+        makespan = max([job_obj.stopped_at for job_obj in finished] or [self.t0]) - self.t0
+        vcpu_s = sum(job_obj.vcpus * (job_obj.stopped_at - job_obj.started_at) for job_obj in finished)
+
+        transforms = OrderedDict()
+        for job_obj in self.jobs.values():
+            stats = transforms.setdefault(job_obj.transform, {'jobs': 0, 'failed': 0, 'compute_s': 0.0})
+            stats['jobs'] += 1
+            if job_obj.status == "FAILED":
+                stats['failed'] += 1
+            if job_obj in finished:
+                stats['compute_s'] += job_obj.stopped_at - job_obj.started_at
+
+        return OrderedDict([
+            ('jobs', len(self.jobs)),
+            ('succeeded', len([job_obj for job_obj in self.jobs.values() if job_obj.status == "SUCCEEDED"])),
+            ('failed', len([job_obj for job_obj in self.jobs.values() if job_obj.status == "FAILED"])),
+            ('makespan_s', makespan),
+            ('build_s', self.clock - self.t0),
+            ('max_vcpus', self.max_vcpus),
+            ('vcpu_s', vcpu_s),
+            ('utilisation', vcpu_s / (self.max_vcpus * makespan) if makespan > 0 else 0.0),
+            ('queue_s', percentiles([job_obj.started_at - job_obj.created_at for job_obj in started])),
+            ('run_s', percentiles([job_obj.stopped_at - job_obj.started_at for job_obj in finished])),
+            ('transforms', transforms)
+        ])
+
+
+def format_report(report):
+    """a human readable summary of SimComputeEnv.report()"""
+    def _dist(dist):
+        if not dist:
+            return "-"
+        return "  ".join("%s %.0fs" % (k, v) for k, v in dist.items())
+
+    lines = [
+        "jobs: %d (%d succeeded, %d failed)" % (report['jobs'], report['succeeded'], report['failed']),
+        "makespan: %.0fs (%.2fh)  build loop: %.0fs" % (report['makespan_s'], report['makespan_s'] / 3600.0,
+                                                        report['build_s']),
+        "utilisation: %.1f%% of %d vcpus" % (100.0 * report['utilisation'], report['max_vcpus']),
+        "queue time: %s" % (_dist(report['queue_s']),),
+        "run time:   %s" % (_dist(report['run_s']),),
+    ]
+    for name, stats in report['transforms'].items():
+        lines.append("  %-30s %6d jobs %4d failed %12.0f compute s" % (name[:30], stats['jobs'], stats['failed'],
+                                                                      stats['compute_s']))
+    return "\n".join(lines)
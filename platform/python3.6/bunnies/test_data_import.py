@@ -0,0 +1,200 @@
+import hashlib
+import io
+import json
+import pytest
+from bunnies import data_import, constants, digest_index
+from bunnies.data_import import DataImport
+from bunnies.exc import NoSuchFile, ImportError
+
+MD5_A = "d41d8cd98f00b204e9800998ecf8427e"
+MD5_B = "9dc5c71abae60eec7ac0a27406789b24"
+
+
+class FakeStore(object):
+    """records imports and copies, and serves heads for existing objects"""
+    def __init__(self):
+        self.objects = {}
+        self.imported = []
+        self.copied = []
+
+    def head(self, url, logprefix="", **kwargs):
+        if url not in self.objects:
+            raise NoSuchFile(url)
+        return {'ContentLength': 0, 'Metadata': {constants.DIGEST_HEADER_PREFIX + "md5": self.objects[url]}}
+
+    def import_file(self, src_url, dst_url, digest_urls=None):
+        self.imported.append((src_url, dst_url))
+        self.objects[dst_url] = digest_urls['md5'] if digest_urls else None
+        return {'imported': dst_url}
+
+    def copy(self, src_url, dst_url, logprefix="", **kwargs):
+        self.copied.append((src_url, dst_url))
+        self.objects[dst_url] = self.objects[src_url]
+        return {'copied': dst_url}
+
+
+@pytest.fixture
+def store(monkeypatch):
+    fake = FakeStore()
+    monkeypatch.setattr(constants, "USE_DIGEST_INDEX", False)
+    monkeypatch.setattr(data_import.utils, "get_blob_meta", fake.head)
+    monkeypatch.setattr(data_import.transfers, "s3_copy_object", fake.copy)
+    monkeypatch.setattr(DataImport, "_import_file", fake.import_file)
+    return fake
+
+
+def test_import_many_dedups_sources(store):
+    results = DataImport(update_index=False).import_many([
+        {'src_url': "https://example.org/a.fq", 'dst_url': "s3://b/1/", 'digest_urls': {'md5': MD5_A}},
+        {'src_url': "https://mirror.example.org/a.fq", 'dst_url': "s3://b/2/a.fq", 'digest_urls': {'md5': MD5_A}},
+        {'src_url': "https://example.org/b.fq", 'dst_url': "s3://b/1/", 'digest_urls': {'md5': MD5_B}},
+    ], concurrency=2)
+
+    assert sorted(store.imported) == [("https://example.org/a.fq", "s3://b/1/a.fq"),
+                                      ("https://example.org/b.fq", "s3://b/1/b.fq")]
+    assert store.copied == [("s3://b/1/a.fq", "s3://b/2/a.fq")]
+    assert [res['status'] for res in results] == ["imported", "copied", "imported"]
+    assert all(res['elapsed_s'] >= 0 for res in results)
+
+
+def test_import_many_skips_matching(store):
+    store.objects["s3://b/a.fq"] = MD5_A
+    store.objects["s3://b/b.fq"] = MD5_A
+    results = DataImport(update_index=False).import_many([
+        {'src_url': "https://example.org/a.fq", 'dst_url': "s3://b/a.fq", 'digest_urls': {'md5': MD5_A}},
+        {'src_url': "https://example.org/b.fq", 'dst_url': "s3://b/b.fq", 'digest_urls': {'md5': MD5_B}},
+    ])
+    assert store.imported == []
+    assert results[0]['status'] == "exists"
+    assert results[1]['status'] == "error"
+    assert "digest mismatch" in results[1]['error']
+
+
+@pytest.fixture
+def direct(s3, monkeypatch):
+    monkeypatch.setattr(digest_index.load_index, "cache", {})
+    monkeypatch.setattr(digest_index.load_listing, "cache", {})
+
+    def _no_lambda(*args, **kwargs):
+        raise AssertionError("lambda invoked")
+    monkeypatch.setattr(data_import.lambdas, "invoke_sync", _no_lambda)
+    return s3
+
+
+def test_direct_local_import(direct, tmp_path):
+    src = tmp_path / "reads.fq"
+    src.write_bytes(b"@read1\nACGT\n+\nIIII\n")
+    md5 = hashlib.md5(src.read_bytes()).hexdigest()
+
+    res = DataImport().import_file("file://" + str(src), "s3://bucket/reads.fq", digest_urls={'md5': md5})
+
+    body = direct.objects()["s3://bucket/reads.fq"]
+    meta = direct.head_object(Bucket="bucket", Key="reads.fq")['Metadata']
+    assert body == src.read_bytes()
+    assert meta["digest-md5"] == md5
+    assert meta["digest-sha1"] == hashlib.sha1(body).hexdigest()
+    assert meta["digest-sha256"] == hashlib.sha256(body).hexdigest()
+    assert meta[constants.IMPORT_DIGESTS_HEADER] == "md5"
+    assert res['digests']['sha1'] == meta["digest-sha1"]
+
+
+def test_direct_local_import_mismatch(direct, tmp_path):
+    src = tmp_path / "reads.fq"
+    src.write_bytes(b"@read1\nACGT\n+\nIIII\n")
+    with pytest.raises(ImportError):
+        DataImport().import_file("file://" + str(src), "s3://bucket/reads.fq", digest_urls={'md5': MD5_A})
+    assert direct.objects() == {}
+
+
+def test_direct_import_updates_index(direct, tmp_path, monkeypatch):
+    src = tmp_path / "reads.fq"
+    src.write_bytes(b"@read1\nACGT\n+\nIIII\n")
+    md5 = hashlib.md5(src.read_bytes()).hexdigest()
+    DataImport().import_file("file://" + str(src), "s3://bucket/run1/", digest_urls={'md5': md5})
+
+    index_body = direct.objects()["s3://bucket/run1/" + constants.DIGEST_INDEX_FILE]
+    entry = json.loads(index_body.decode('utf-8'))
+    assert entry['key'] == "reads.fq"
+    assert entry['digests']['md5'] == md5
+    assert entry['size'] == len(src.read_bytes())
+
+    # re-imports are resolved from the index, without a HEAD
+    monkeypatch.setattr(digest_index.load_index, "cache", {})
+
+    def _no_head(*args, **kwargs):
+        raise AssertionError("HEAD issued")
+    monkeypatch.setattr(direct, "head_object", _no_head)
+    results = DataImport().import_many([{'src_url': str(src), 'dst_url': "s3://bucket/run1/reads.fq",
+                                         'digest_urls': {'md5': md5}}])
+    assert results[0]['status'] == "exists"
+    assert digest_index.lookup_many(["s3://bucket/run1/reads.fq", "s3://bucket/run1/other.fq"]) == {
+        "s3://bucket/run1/reads.fq": {k: v for k, v in entry.items() if k != 'key'}}
+
+
+def _local_files(tmp_path, count):
+    files = []
+    for i in range(count):
+        src = tmp_path / ("reads%d.fq" % (i,))
+        src.write_bytes(b"@read%d\nACGT\n+\nIIII\n" % (i,))
+        files.append((str(src), hashlib.md5(src.read_bytes()).hexdigest()))
+    return files
+
+
+def test_import_many_writes_index_once(direct, tmp_path):
+    files = _local_files(tmp_path, 6)
+    results = DataImport().import_many([{'src_url': src, 'dst_url': "s3://bucket/run1/", 'digest_urls': {'md5': md5}}
+                                        for src, md5 in files], concurrency=4)
+    assert [res['status'] for res in results] == ["imported"] * 6
+    index_url = "s3://bucket/run1/" + constants.DIGEST_INDEX_FILE
+    assert direct.requested("PutObject") == [index_url]
+    assert len(direct.objects()[index_url].splitlines()) == 6
+
+
+def test_stale_index_entry_ignored(direct, tmp_path):
+    (src, md5), = _local_files(tmp_path, 1)
+    DataImport().import_file(src, "s3://bucket/run1/", digest_urls={'md5': md5})
+    # the blob is deleted after it was indexed
+    direct.delete_object(Bucket="bucket", Key="run1/reads0.fq")
+
+    results = DataImport().import_many([{'src_url': src, 'dst_url': "s3://bucket/run1/", 'digest_urls': {'md5': md5}}])
+    assert results[0]['status'] == "imported"
+    assert "s3://bucket/run1/reads0.fq" in direct.objects()
+
+
+def test_index_not_forced_without_conditional_writes(direct, tmp_path, monkeypatch):
+    monkeypatch.setattr(digest_index, "supports_param", lambda *args: False)
+    (src, md5), = _local_files(tmp_path, 1)
+    DataImport().import_file(src, "s3://bucket/run1/", digest_urls={'md5': md5})
+    assert list(direct.objects()) == ["s3://bucket/run1/reads0.fq"]
+
+
+def test_direct_import_created_concurrently(direct, tmp_path):
+    (src, md5), = _local_files(tmp_path, 1)
+    data = open(src, "rb").read()
+    # created meanwhile by the data-rehash path, which doesn't compute sha256
+    direct.seed("bucket", "reads0.fq", data, Metadata={"digest-md5": md5,
+                                                       "digest-sha1": hashlib.sha1(data).hexdigest()})
+    res = DataImport().import_file(src, "s3://bucket/", digest_urls={})
+    assert res['Metadata']["digest-md5"] == md5
+
+    direct.seed("bucket", "other.fq", b"other", Metadata={"digest-md5": MD5_A})
+    with pytest.raises(ImportError):
+        DataImport().import_file(src, "s3://bucket/other.fq", digest_urls={})
+
+
+def test_direct_import_needs_conditional_writes(direct, tmp_path, monkeypatch):
+    monkeypatch.setattr(data_import.transfers, "supports_param", lambda *args: False)
+    requests = []
+
+    def _rehash(name, Payload, **kwargs):
+        requests.append(Payload)
+        res = {'Bucket': Payload['dst_bucket'], 'Key': Payload['dst_key'], 'ContentLength': 1, 'ETag': '"e"',
+               'digests': {'md5': Payload['digests']['md5']}}
+        return 0, {'Payload': io.BytesIO(json.dumps(res).encode('ascii'))}
+    monkeypatch.setattr(data_import.lambdas, "invoke_sync", _rehash)
+
+    # the temporary object path: the destination is only written by data-rehash
+    (src, md5), = _local_files(tmp_path, 1)
+    DataImport(update_index=False).import_file(src, "s3://bucket/run1/", digest_urls={'md5': md5})
+    assert [(req['dst_key'], req['index']) for req in requests] == [("run1/reads0.fq", False)]
+    assert "s3://bucket/run1/reads0.fq" not in direct.objects()
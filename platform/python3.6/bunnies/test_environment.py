@@ -0,0 +1,36 @@
+from bunnies import environment, kvstore
+from bunnies.environment import ComputeEnv
+from bunnies.kvstore import SubmissionEntry
+
+
+def test_preload(tmp_path, monkeypatch):
+    monkeypatch.setattr(kvstore.backend, "instance", kvstore.SQLiteBackend(str(tmp_path / "kv.sqlite3")))
+    for name, job_id in (("done", "batch-1"), ("purged", "batch-2")):
+        entry = SubmissionEntry(name, "build-0", jobdata=job_id)
+        entry.save()
+
+    described = []
+
+    def _describe(job_ids):
+        described.append(list(job_ids))
+        return [{'jobId': "batch-1", 'jobName': "done", 'jobDefinition': "def", 'status': "SUCCEEDED"}]
+
+    def _from_job_id(job_id):
+        raise AssertionError("job described again")
+    monkeypatch.setattr(environment.jobs, "describe_jobs", _describe)
+    monkeypatch.setattr(environment.jobs.AWSBatchSimpleJob, "from_job_id", _from_job_id)
+
+    env = ComputeEnv("test", local_scratch_gb=0)
+    env.preload("build-1", ["done", "purged", "new"])
+    assert described == [["batch-1", "batch-2"]]
+
+    with env.submission_context("build-1", "new") as ctx:
+        assert ctx.load() is None
+    with env.submission_context("build-1", "purged") as ctx:
+        assert ctx.load() is ctx
+        # batch no longer knows the job
+        assert env.job_from_id(ctx.jobdata) is None
+    with env.submission_context("build-1", "done") as ctx:
+        ctx.load()
+        job = env.job_from_id(ctx.jobdata)
+        assert (job.job_id, job.get_desc()['status']) == ("batch-1", "SUCCEEDED")
@@ -0,0 +1,50 @@
+import pytest
+from bunnies import escalation, jobs
+from bunnies.escalation import EscalationPolicy, classify
+
+
+def _desc(reason, exit_code=None, container_reason=None, memory=2048, timeout=None):
+    container = {'exitCode': exit_code} if exit_code is not None else {}
+    if container_reason:
+        container['reason'] = container_reason
+    desc = {'jobName': "job", 'status': "FAILED", 'statusReason': reason,
+            'container': {'vcpus': 1, 'memory': memory},
+            'attempts': [{'statusReason': reason, 'container': container}]}
+    if timeout:
+        desc['timeout'] = {'attemptDurationSeconds': timeout}
+    return desc
+
+
+@pytest.mark.parametrize("desc,kind", [
+    (_desc(jobs.CONTAINER_EXIT_REASON, 137, "OutOfMemoryError: Container killed due to memory usage"),
+     escalation.OOM),
+    (_desc(jobs.CONTAINER_EXIT_REASON, 137), escalation.OOM),
+    (_desc(jobs.TIMEOUT_REASON), escalation.TIMEOUT),
+    (_desc("Host EC2 (instance i-0123) terminated."), escalation.RECLAIMED),
+    (_desc(jobs.CONTAINER_EXIT_REASON, 1), escalation.APPLICATION),
+    (_desc(jobs.DEPENDENCY_FAILED_REASON), escalation.DEPENDENCY),
+    (_desc("CannotPullContainerError"), escalation.UNKNOWN),
+])
+def test_classify(desc, kind):
+    assert classify(desc) == kind
+
+
+def test_oom_escalates_from_previous_attempt():
+    policy = EscalationPolicy(memory_factor=1.5, max_memory=5000)
+    oom = _desc(jobs.CONTAINER_EXIT_REASON, 137, memory=2048)
+    assert policy.escalate({'vcpus': 1, 'memory': 1024, 'timeout': 60}, oom) == \
+        {'vcpus': 1, 'memory': 3072, 'timeout': 60}
+    # capped
+    assert policy.escalate({'memory': 1024}, _desc(jobs.CONTAINER_EXIT_REASON, 137, memory=4000)) == \
+        {'memory': 5000}
+    # never below what the transform asks for
+    assert policy.escalate({'memory': 8000}, oom) == {'memory': 8000}
+
+
+def test_timeout_and_other_failures():
+    policy = EscalationPolicy(timeout_factor=2.0)
+    resources = {'vcpus': 2, 'memory': 1024, 'timeout': 600}
+    assert policy.escalate(resources, _desc(jobs.TIMEOUT_REASON, timeout=900))['timeout'] == 1800
+    assert policy.escalate(resources, _desc(jobs.TIMEOUT_REASON))['timeout'] == 1200
+    assert policy.escalate(resources, _desc("Host EC2 (instance i-0123) terminated.")) == resources
+    assert policy.escalate(resources, _desc(jobs.CONTAINER_EXIT_REASON, 1)) == resources
@@ -0,0 +1,100 @@
+import pytest
+from bunnies import executors, jobs, kvstore, simulate
+from bunnies.executors import LocalPoolExecutor, RoutingComputeEnv
+from bunnies.kvstore import SubmissionEntry
+
+
+class FakeNode(object):
+    """a build node whose job script is given"""
+    def __init__(self, script):
+        self.script = script
+
+    def execution_transfer_script(self, resources):
+        return self.script
+
+
+@pytest.fixture
+def local(tmp_path):
+    executor = LocalPoolExecutor(max_workers=2, max_vcpus=4, workdir=str(tmp_path))
+    yield executor
+    executor.shutdown()
+
+
+def _submit(executor, name, script, timeout=-1):
+    staged = executor.stage_job(name, FakeNode(script), {})
+    return executor.submit_simple_batch_job(name, None, timeout=timeout,
+                                            environment={'BUNNIES_TRANSFER_SCRIPT': staged['BUNNIES_TRANSFER_SCRIPT']})
+
+
+def _wait_all(executor):
+    done = {}
+    while executor.submissions:
+        for state, pairs in executor.wait_for_jobs(condition=lambda status: True, interval=1).items():
+            done.setdefault(state, []).extend(pairs)
+        executor.sleep(0.05)
+    return done
+
+
+def test_routing(local):
+    routed = RoutingComputeEnv(simulate.SimComputeEnv("test"), local)
+    # short jobs still need the tools of their container image: only those which opt in run locally
+    assert routed.executor_for(FakeNode(""), {'vcpus': 2, 'timeout': 30}) is routed.compute_env
+    assert routed.executor_for(FakeNode(""), {'vcpus': 2, 'executor': "batch"}) is routed.compute_env
+    assert routed.executor_for(FakeNode(""), {'vcpus': 2, 'executor': "local"}) is local
+    assert routed.executor_for(FakeNode(""), {'vcpus': 8, 'executor': "local"}) is routed.compute_env
+    # eager submissions wait on batch jobs
+    assert routed.executor_for(FakeNode(""), {'executor': "local"}, depends_on=["batch-id"]) is routed.compute_env
+
+
+def test_local_jobs_run(local):
+    ok = _submit(local, "ok", "import os\nassert os.environ['BUNNIES_WORKDIR']\n")
+    bad = _submit(local, "bad", "raise SystemExit(3)\n")
+    done = _wait_all(local)
+
+    assert [job_obj for job_obj, _ in done['SUCCEEDED']] == [ok]
+    assert done['FAILED'] == [(bad, jobs.CONTAINER_EXIT_REASON)]
+    desc = bad.get_desc()
+    assert desc['attempts'][0]['container']['exitCode'] == 3
+    usage = ok.get_usage()
+    assert usage['total']['compute_time_s'] >= 0
+    assert len(usage['attempts']) == 1
+    assert local.job_from_id(ok.job_id) is ok
+
+
+def test_local_job_timeout(local):
+    slow = _submit(local, "slow", "import time\ntime.sleep(30)\n", timeout=0.5)
+    done = _wait_all(local)
+    assert done['FAILED'] == [(slow, jobs.TIMEOUT_REASON)]
+
+
+def test_local_job_holds_claim(local, tmp_path, monkeypatch):
+    monkeypatch.setattr(kvstore.backend, "instance", kvstore.SQLiteBackend(str(tmp_path / "kv.sqlite3")))
+    monkeypatch.setattr(executors, "CLAIM_RENEWAL", 0.1)
+    job_obj = _submit(local, "slow", "import time\ntime.sleep(0.5)\n")
+    entry = SubmissionEntry("slow", "build-1")
+    entry.load()
+    entry.jobtype, entry.jobdata = job_obj.jobtype, job_obj.job_id
+    entry.claim()
+    local.hold_claim(job_obj, entry)
+
+    # another builder can't look the job up: it waits, rather than submitting it again
+    other = SubmissionEntry("slow", "build-2")
+    other.load(wait=0)
+    assert other.claimed_elsewhere() and other.jobdata == job_obj.job_id
+    _wait_all(local)
+    job_obj.future.result()
+
+    other.load(wait=0)
+    assert not other.claimed_elsewhere()
+    # claimed again while the job ran, and released when it finished
+    assert other.revision > 2 and other.claim_expires == 0
+
+
+def test_shutdown_cancels_unfinished(local):
+    running = [_submit(local, "slow%d" % (i,), "import time\ntime.sleep(30)\n") for i in range(2)]
+    queued = _submit(local, "queued", "")
+    while any(job_obj.status != "RUNNING" for job_obj in running):
+        local.sleep(0.01)
+    local.shutdown()
+    assert [job_obj.status for job_obj in running + [queued]] == ["FAILED"] * 3
+    assert queued.reason == "executor shut down"
@@ -0,0 +1,130 @@
+import json
+import pytest
+from bunnies import constants, digest_index, graph
+from bunnies.exc import NoSuchFile
+
+from benchmarks.standins import Step
+
+
+@pytest.fixture
+def repo(s3, monkeypatch):
+    monkeypatch.setitem(graph.config, 'storage', {'write_url': "s3://write/", 'read_urls': ["s3://read/"]})
+    monkeypatch.setattr(graph.load_result, "cache", {})
+    return s3
+
+
+def _publish(repo, transform, bucket, output):
+    url = transform.result_urls()[["write", "read"].index(bucket)]
+    key = url[len("s3://%s/" % (bucket,)):]
+    repo.seed(bucket, key, json.dumps({'output': output}).encode('utf-8'))
+    return url
+
+
+def test_output_prefix(repo):
+    step = Step("a")
+    assert step.output_prefix() == "s3://write/a-1-%s/" % (step.canonical_id,)
+
+
+def test_ls_memoized_with_fallback(repo):
+    step = Step("a")
+    url = _publish(repo, step, "read", {'bam': "s3://read/a.bam"})
+
+    assert step.ls() == {'bam': "s3://read/a.bam"}
+    assert step.ls() == {'bam': "s3://read/a.bam"}
+    assert step.exists() == url
+    # one miss on the write repository, one hit on the read one. no HEAD.
+    assert len(repo.requested("GetObject")) == 2
+    assert repo.requested("HeadObject") == []
+
+
+def test_ls_missing(repo):
+    with pytest.raises(NoSuchFile):
+        Step("missing").ls()
+
+
+def test_prefetch_ls(repo):
+    steps = [Step("s%d" % (i,)) for i in range(10)]
+    for i, step in enumerate(steps[:-1]):
+        _publish(repo, step, "write", {'i': i})
+
+    res = graph.prefetch_ls(steps + [steps[0]], threads=4)
+    assert len(res) == 10
+    assert res[steps[-1].canonical_id] is None
+    assert res[steps[3].canonical_id] == {'i': 3}
+
+    gets = len(repo.requested("GetObject"))
+    assert [step.ls() for step in steps[:-1]] == [{'i': i} for i in range(9)]
+    assert len(repo.requested("GetObject")) == gets
+
+
+def test_embedded_results(repo):
+    up = Step("up")
+    _publish(repo, up, "write", {'bam': "s3://write/up.bam"})
+    missing = Step("missing")
+    embedded = json.loads(json.dumps(graph.embed_results([up, missing])))
+    assert list(embedded['nodes']) == [up.canonical_id]
+
+    # in the job: ls() is answered without requests
+    graph.load_result.cache.clear()
+    gets = len(repo.requested("GetObject"))
+    assert graph.load_embedded_results(embedded) == 1
+    assert up.ls() == {'bam': "s3://write/up.bam"}
+    assert len(repo.requested("GetObject")) == gets
+
+
+def test_embedded_results_verify(repo):
+    up = Step("up")
+    _publish(repo, up, "write", {'bam': "s3://write/up.bam"})
+    embedded = graph.embed_results([up])
+    graph.load_result.cache.clear()
+
+    # the result file has been rewritten since submission
+    real_head = repo.head_object
+    repo.head_object = lambda **kwargs: dict(real_head(**kwargs), ETag='"y"')
+    assert graph.load_embedded_results(embedded, verify=True) == 0
+    assert graph.load_result.cache == {}
+
+    repo.head_object = real_head
+    assert graph.load_embedded_results(embedded, verify=True) == 1
+
+
+def test_embedded_results_corrupt(repo):
+    up = Step("up")
+    _publish(repo, up, "write", {'bam': "s3://write/up.bam"})
+    embedded = graph.embed_results([up])
+    graph.load_result.cache.clear()
+    for doc in embedded['results'].values():
+        doc['output']['bam'] = "s3://elsewhere/up.bam"
+    assert graph.load_embedded_results(embedded) == 0
+
+
+def test_jobscript_embeds_upstream(repo):
+    from bunnies.pipeline import BuildNode
+    up = Step("up")
+    _publish(repo, up, "write", {'bam': "s3://write/up.bam"})
+    down = Step("down")
+    down.add_input("aligned", up)
+
+    script = BuildNode(down).execution_transfer_script({'vcpus': 1})
+    compile(script, "jobscript", "exec")
+    assert "s3://write/up.bam" in script
+
+
+def test_blob_manifest_checks_index(repo, monkeypatch):
+    monkeypatch.setattr(digest_index.load_index, "cache", {})
+    monkeypatch.setattr(digest_index.load_listing, "cache", {})
+    md5 = "d41d8cd98f00b204e9800998ecf8427e"
+    repo.seed("data", "run/a.fq", b"", Metadata={constants.DIGEST_HEADER_PREFIX + "md5": md5})
+    etag = repo.head_object(Bucket="data", Key="run/a.fq")['ETag']
+    index = [{'key': "a.fq", 'etag': etag, 'size': 0, 'digests': {'md5': md5}},
+             {'key': "b.fq", 'etag': etag, 'size': 0, 'digests': {'md5': md5}}]
+    repo.seed("data", "run/" + constants.DIGEST_INDEX_FILE,
+              "\n".join(json.dumps(entry) for entry in index).encode('utf-8'))
+    # b.fq was rewritten since it was indexed
+    repo.seed("data", "run/b.fq", b"new", Metadata={constants.DIGEST_HEADER_PREFIX + "md5": "0" * 32})
+    repo.requests.clear()
+
+    assert graph.S3Blob("s3://data/run/a.fq").manifest()['digests'] == {'md5': md5}
+    assert graph.S3Blob("s3://data/run/b.fq").manifest()['digests'] == {'md5': "0" * 32}
+    assert repo.requested("HeadObject") == ["s3://data/run/b.fq"]
+    assert repo.requested("ListObjectsV2") == ["s3://data/run/"]
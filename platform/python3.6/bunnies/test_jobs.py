@@ -0,0 +1,186 @@
+import pytest
+from datetime import datetime, timezone
+from botocore.exceptions import ClientError
+from bunnies import jobs
+from bunnies.jobs import JobPollTracker, UsageCollector
+
+
+@pytest.fixture
+def tracker(batch):
+    return JobPollTracker(min_interval=10, max_interval=300, queued_interval=60, backoff=0.1,
+                          describe_fn=jobs.describe_jobs)
+
+
+def test_unknown_state_is_due(tracker, batch):
+    batch.seed('a', status="SUCCEEDED")
+    tracker.track('a', now=0)
+    assert tracker.due_jobs(now=0) == ['a']
+    status = tracker.poll(now=0)
+    assert status == {'SUCCEEDED': [('a', '')]}
+
+
+def test_new_submission_not_polled(tracker, batch):
+    batch.seed('a', status="RUNNABLE")
+    tracker.track('a', state="SUBMITTED", now=0)
+    status = tracker.poll(now=1)
+    assert batch.requested("DescribeJobs") == []
+    assert status == {'SUBMITTED': [('a', '')]}
+
+    tracker.poll(now=60)
+    assert batch.requested("DescribeJobs") == [['a']]
+    assert tracker.state('a') == "RUNNABLE"
+
+
+def test_only_due_jobs_described(tracker, batch):
+    batch.seed('a', status="RUNNING", startedAt=0)
+    batch.seed('b', status="RUNNING", startedAt=0)
+    tracker.track('a', now=0)
+    tracker.poll(now=0)
+    tracker.track('b', now=5)
+    tracker.poll(now=5)
+    assert batch.requested("DescribeJobs") == [['a'], ['b']]
+
+
+def test_running_backoff(tracker, batch):
+    batch.seed('a', status="RUNNING", startedAt=0)
+    tracker.track('a', now=0)
+    tracker.poll(now=100)
+    # 10% of elapsed time
+    assert tracker.next_due() == pytest.approx(110)
+
+    # no measured runtime: the job could end at any time
+    tracker.poll(now=1000)
+    assert tracker.next_due() == pytest.approx(1030)
+
+    # a timeout is only an upper bound
+    tracker.track('b', expected_runtime=None, timeout=7*24*3600, now=0)
+    batch.seed('b', status="RUNNING", startedAt=0)
+    tracker.poll(now=10000)
+    assert tracker.next_due() == pytest.approx(10030)
+
+
+def test_measured_runtime_backoff(tracker, batch):
+    batch.seed('a', status="RUNNING", startedAt=0)
+    tracker.track('a', expected_runtime=100000, timeout=10100, now=0)
+    tracker.poll(now=1000)
+    assert tracker.next_due() == pytest.approx(1100)
+    tracker.poll(now=5000)
+    # capped
+    assert tracker.next_due() == pytest.approx(5300)
+    tracker.poll(now=9900)
+    # the timeout approaches
+    assert tracker.next_due() == pytest.approx(10000)
+
+
+def test_expected_runtime_shortens_interval(tracker, batch):
+    batch.seed('a', status="RUNNING", startedAt=0)
+    tracker.track('a', expected_runtime=1100, now=0)
+    tracker.poll(now=1000)
+    assert tracker.next_due() == pytest.approx(1050)
+
+
+def test_terminal_not_polled(tracker, batch):
+    batch.seed('a', status="FAILED", statusReason="oom")
+    tracker.track('a', now=0)
+    assert tracker.poll(now=0) == {'FAILED': [('a', 'oom')]}
+    assert tracker.next_due() is None
+    tracker.poll(now=1000)
+    assert batch.requested("DescribeJobs") == [['a']]
+
+
+class FakeUsageClients(object):
+    """stands in for the batch, ecs and ec2 clients used by UsageCollector"""
+    def __init__(self, num_jobs):
+        self.calls = []
+        self.job_descs = [{
+            'jobId': "job-%d" % (i,),
+            'jobQueue': "arn:queue",
+            'createdAt': 0,
+            'container': {'vcpus': 2, 'memory': 1024},
+            'attempts': [{'startedAt': 1000, 'stoppedAt': 3000,
+                          'container': {'containerInstanceArn': "arn:ci-%d" % (i,),
+                                        'logStreamName': "def/default/%d" % (i,)}}]
+        } for i in range(num_jobs)]
+        self.gone = set()
+
+    def describe_jobs(self, job_ids):
+        self.calls.append(('describe_jobs', len(job_ids)))
+        return [desc for desc in self.job_descs if desc['jobId'] in job_ids]
+
+    def describe_job_queues(self, jobQueues):
+        self.calls.append(('describe_job_queues', len(jobQueues)))
+        return {'jobQueues': [{'jobQueueArn': "arn:queue", 'jobQueueName': "queue",
+                               'computeEnvironmentOrder': [{'computeEnvironment': "arn:ce"}]}]}
+
+    def describe_compute_environments(self, computeEnvironments):
+        self.calls.append(('describe_compute_environments', len(computeEnvironments)))
+        return {'computeEnvironments': [{'computeEnvironmentArn': "arn:ce", 'computeEnvironmentName': "ce",
+                                         'ecsClusterArn': "arn:cluster"}]}
+
+    def describe_container_instances(self, containerInstances, cluster):
+        self.calls.append(('describe_container_instances', len(containerInstances)))
+        return {'containerInstances': [{'containerInstanceArn': arn, 'ec2InstanceId': arn.replace("arn:ci", "i")}
+                                       for arn in containerInstances]}
+
+    def describe_instances(self, InstanceIds):
+        self.calls.append(('describe_instances', len(InstanceIds)))
+        if self.gone.intersection(InstanceIds):
+            raise ClientError({'Error': {'Code': "InvalidInstanceID.NotFound"}}, "DescribeInstances")
+        return {'Reservations': [{'Instances': [{
+            'InstanceId': iid, 'InstanceType': "c5.large",
+            'LaunchTime': datetime.fromtimestamp(0, timezone.utc),
+            'CpuOptions': {'CoreCount': 1, 'ThreadsPerCore': 2}} for iid in InstanceIds]}]}
+
+
+def _collector(clients):
+    return UsageCollector(describe_fn=clients.describe_jobs, batch=clients, ecs=clients, ec2=clients)
+
+
+def test_usage_batched_describes():
+    clients = FakeUsageClients(150)
+    usages = _collector(clients).collect(["job-%d" % (i,) for i in range(150)])
+    assert len(usages) == 150
+    assert [call for call in clients.calls if call[0] == 'describe_container_instances'] == \
+        [('describe_container_instances', 100), ('describe_container_instances', 50)]
+    assert [call for call in clients.calls if call[0] == 'describe_instances'] == \
+        [('describe_instances', 100), ('describe_instances', 50)]
+
+    usage = usages["job-7"]
+    assert usage['total']['vcpu_secs'] == pytest.approx(4.0)
+    assert usage['attempts'][0]['instance'] == [{'instanceId': "i-7", 'instanceType': "c5.large",
+                                                 'coreCount': 1, 'threadsPerCore': 2, 'startedAt': 0}]
+
+
+def test_usage_lookups_shared_between_calls():
+    clients = FakeUsageClients(2)
+    collector = _collector(clients)
+    collector.collect(["job-0"])
+    collector.collect(["job-0", "job-1"])
+    names = [name for name, _ in clients.calls]
+    assert names.count('describe_job_queues') == 1
+    assert names.count('describe_compute_environments') == 1
+    assert ('describe_container_instances', 1) in clients.calls
+    assert ('describe_container_instances', 2) not in clients.calls
+
+
+def test_usage_missing_ec2_instance():
+    clients = FakeUsageClients(3)
+    clients.gone.add("i-1")
+    usages = _collector(clients).collect(["job-0", "job-1", "job-2"])
+    assert usages["job-1"]['attempts'][0]['instance'][0]['instanceType'] is None
+    assert usages["job-2"]['attempts'][0]['instance'][0]['instanceType'] == "c5.large"
+
+
+def test_submit_job_depends_on(batch):
+    job_id = jobs.submit_job("name", "queue", "jobdef", depends_on=["up-1", "up-2"])['jobId']
+    assert batch.jobs[job_id]['dependsOn'] == [{'jobId': "up-1"}, {'jobId': "up-2"}]
+
+    with pytest.raises(ValueError):
+        jobs.submit_job("name", "queue", "jobdef", depends_on=["up"] * (jobs.MAX_DEPENDS_ON + 1))
+
+
+def test_dependency_failure_reasons():
+    assert jobs.is_dependency_failure("Dependent Job failed")
+    assert jobs.is_dependency_failure(jobs.REVOKED_REASON)
+    assert not jobs.is_dependency_failure("Essential container in task exited")
+    assert not jobs.is_dependency_failure(None)
@@ -0,0 +1,118 @@
+import pytest
+from bunnies import kvstore
+from bunnies.exc import SubmissionConflict
+from bunnies.kvstore import SubmissionEntry
+
+
+@pytest.fixture
+def ddb(dynamodb, monkeypatch):
+    monkeypatch.setattr(kvstore.backend, "instance", kvstore.DynamoDBBackend())
+    return dynamodb
+
+
+def test_concurrent_builders_conflict(ddb):
+    first, second = SubmissionEntry("job", "build-1"), SubmissionEntry("job", "build-2")
+    assert first.load() is None
+    assert second.load() is None
+
+    first.claim()
+    with pytest.raises(SubmissionConflict):
+        second.claim()
+
+    first.jobdata = "batch-id"
+    first.save()
+    assert ddb.requests == ["GetItem", "GetItem", "PutItem", "PutItem", "PutItem"]
+
+    # the loser looks again, and finds the submission
+    assert second.load() is second
+    assert (second.jobdata, second.submitter, second.revision, second.claim_expires) == \
+        ("batch-id", "build-1", 2, 0)
+    assert not second.claimed_elsewhere()
+
+
+def test_load_waits_for_foreign_claim(ddb, monkeypatch):
+    first, second = SubmissionEntry("job", "build-1"), SubmissionEntry("job", "build-2")
+    first.load()
+    first.claim()
+
+    def _sleep(seconds):
+        # the claimant submits while we wait
+        first.jobdata = "batch-id"
+        first.save()
+    monkeypatch.setattr(kvstore.time, "sleep", _sleep)
+
+    second.load()
+    assert second.jobdata == "batch-id"
+
+
+def test_records_written_before_revisions(ddb):
+    ddb.seed(kvstore.TABLE_NAME, {'jobname': {'S': "job"}, 'submitter': {'S': "old"}, 'jobtype': {'S': "batch"},
+                                  'jobdata': {'S': "batch-id"}, 'jobattempt': {'N': "1"}, 'updated_on': {'N': "0"}})
+    entry = SubmissionEntry("job", "build-1")
+    entry.load()
+    assert entry.revision == 0
+    entry.claim()
+    assert ddb.item(kvstore.TABLE_NAME, "job")['revision'] == {'N': "1"}
+    stale = SubmissionEntry("job", "build-2")
+    stale.set_item({k: v for k, v in ddb.item(kvstore.TABLE_NAME, "job").items() if k != "revision"})
+    with pytest.raises(SubmissionConflict):
+        stale.save()
+
+
+def test_load_entries_in_bulk(ddb):
+    done = SubmissionEntry("job-7", "build-1")
+    done.load()
+    done.jobdata = "batch-id"
+    done.save()
+    del ddb.requests[:]
+
+    names = ["job-%d" % (i,) for i in range(250)]
+    entries = kvstore.load_entries("build-2", names)
+    assert ddb.requests == ["BatchGetItem"] * 3
+    assert sorted(entries) == sorted(names)
+    assert entries["job-7"].jobdata == "batch-id" and entries["job-7"].revision == 1
+    assert entries["job-8"].revision is None
+
+    # answered from the bulk read, once
+    assert entries["job-7"].load() is entries["job-7"]
+    assert entries["job-8"].load() is None
+    assert ddb.requests == ["BatchGetItem"] * 3
+    entries["job-7"].load()
+    assert ddb.requests[-1] == "GetItem"
+
+    # a stale preloaded record still cannot overwrite a newer one
+    with kvstore.submission_context("build-2", "job-8", entry=entries["job-8"]) as ctx:
+        assert ctx is entries["job-8"]
+        SubmissionEntry("job-8", "build-3").claim()
+        with pytest.raises(SubmissionConflict):
+            ctx.claim()
+
+
+def test_sqlite_backend_shared_by_builders(tmp_path, monkeypatch):
+    path = str(tmp_path / "kv.sqlite3")
+    # two builders on the host, each with its own connection
+    first_db, second_db = kvstore.SQLiteBackend(path), kvstore.SQLiteBackend(path)
+    assert first_db.conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    first, second = SubmissionEntry("job", "build-1"), SubmissionEntry("job", "build-2")
+    monkeypatch.setattr(kvstore.backend, "instance", second_db)
+    assert second.load() is None
+    monkeypatch.setattr(kvstore.backend, "instance", first_db)
+    assert first.load() is None
+    first.claim()
+    monkeypatch.setattr(kvstore.backend, "instance", second_db)
+    with pytest.raises(SubmissionConflict):
+        second.claim()
+    assert second.revision is None
+    assert second.load(wait=0) is second
+    assert second.claimed_elsewhere() and second.revision == 1
+
+    monkeypatch.setattr(kvstore.backend, "instance", first_db)
+    first.jobdata = ""
+    first.save()
+    monkeypatch.setattr(kvstore.backend, "instance", second_db)
+    entries = kvstore.load_entries("build-2", ["job", "other"])
+    assert (entries["job"].revision, entries["job"].jobdata, entries["job"].submitter) == (2, "", "build-1")
+    assert entries["other"].load() is None
+    entries["other"].claim()
+    assert second_db.get("other")['submitter'] == "build-2"
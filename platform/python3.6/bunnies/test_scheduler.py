@@ -176,6 +176,99 @@ def test_failure(sched):
     assert len(b.failures) == 1
 
 
+def _chain(eager_deps=20):
+    """
+    C -> B -> A
+    """
+    sched = S.Scheduler(eager_deps=eager_deps)
+    a, b, c = sched.add_node("a"), sched.add_node("b"), sched.add_node("c")
+    b.depends_on(a)
+    c.depends_on(b)
+    sched.initialize()
+    return sched, a, b, c
+
+
+def test_eager_disabled():
+    sched, a, b, c = _chain(eager_deps=0)
+    a.submit()
+    assert sched.status()['eager'] == []
+
+
+def test_eager_chain():
+    sched, a, b, c = _chain()
+    assert sched.status()['eager'] == []
+    a.submit()
+    assert sched.status()['eager'] == [b]
+    b.submit_blocked()
+    assert sched.status()['eager'] == [c]
+    c.submit_blocked()
+    assert sched.status()['blocked'] == [b, c]
+
+    a.done()
+    assert b.state == 'submitted'
+    assert c.state == 'blocked'
+    b.done()
+    assert c.state == 'submitted'
+    assert sched.pop_revoked() == []
+
+
+def test_eager_failure_revokes():
+    sched, a, b, c = _chain()
+    a.submit()
+    b.submit_blocked()
+    c.submit_blocked()
+
+    a.failed("oom")
+    assert (a.state, b.state, c.state) == ('ready', 'waiting', 'waiting')
+    assert sched.pop_revoked() == [b, c]
+    assert sched.pop_revoked() == []
+    assert b.failures == [] and c.failures == []
+
+    # the retry can be followed eagerly again
+    a.submit()
+    assert sched.status()['eager'] == [b]
+
+
+def test_eager_cancel_cascades():
+    sched, a, b, c = _chain()
+    a.submit()
+    b.submit_blocked()
+    c.submit_blocked()
+    a.cancel()
+    assert (b.state, c.state) == ('cancelled', 'cancelled')
+    assert sched.pop_revoked() == [b, c]
+
+
+def test_blocked_revoke_and_done():
+    sched, a, b, c = _chain()
+    a.submit()
+    b.submit_blocked()
+    c.submit_blocked()
+    b.revoke("app error")
+    assert b.failures == ["app error"]
+    assert c.state == 'waiting'
+    assert sched.pop_revoked() == [c]
+
+    # a blocked job may be seen done before its dependencies
+    b.submit_blocked()
+    b.done()
+    a.done()
+    assert c.state == 'ready'
+
+
+def test_eager_max_pending():
+    sched = S.Scheduler(eager_deps=1)
+    a, b, c = sched.add_node("a"), sched.add_node("b"), sched.add_node("c")
+    c.depends_on(a)
+    c.depends_on(b)
+    sched.initialize()
+    a.submit()
+    b.submit()
+    assert sched.status()['eager'] == []
+    a.done()
+    assert sched.status()['eager'] == [c]
+
+
 def setup_module(module):
     """ setup any state specific to the execution of the given module."""
     print(2)
@@ -188,3 +281,52 @@ def teardown_module(module):
     print(3)
 
 
+
+
+def test_admission_packs_smaller_nodes():
+    sched = S.Scheduler()
+    sched.admission = S.Admission(vcpus=4, memory=None)
+    sizes = {1: 3, 2: 2, 3: 1, 4: 4}
+    nodes = [sched.add_node(uid) for uid in sizes]
+    sched.initialize()
+
+    def _request(node):
+        return {'vcpus': sizes[node.uid], 'memory': 1000}
+
+    admitted = sched.admit(sched.status()['ready'], _request)
+    assert [node.uid for node in admitted] == [1, 3]
+    for node in admitted:
+        node.submit()
+    assert sched.admit(sched.status()['ready'], _request) == []
+
+    nodes[0].done()
+    assert [node.uid for node in sched.admit(sched.status()['ready'], _request)] == [2]
+    assert sched.admission.used == {'vcpus': 3}
+
+
+def test_admission_oversized_node_runs_alone():
+    sched = S.Scheduler()
+    sched.admission = S.Admission(vcpus=4)
+    big = sched.add_node(1)
+    sched.initialize()
+    assert sched.admit([big], lambda node: {'vcpus': 16}) == [big]
+    big.submit()
+    big.failed("oom")
+    assert sched.admission.used == {'vcpus': 0}
+
+
+def test_admission_requests_once():
+    sched = S.Scheduler()
+    sched.admission = S.Admission(vcpus=4)
+    nodes = [sched.add_node(uid) for uid in (1, 2)]
+    sched.initialize()
+    requested = []
+
+    def _request(node):
+        requested.append(node.uid)
+        return {'vcpus': 3}
+
+    assert sched.admit(nodes, _request) == [nodes[0]]
+    # admitted nodes keep their request
+    assert sched.admit(nodes, _request) == [nodes[0]]
+    assert requested == [1, 2, 2]
@@ -0,0 +1,91 @@
+import json
+import pytest
+from bunnies import graph
+from bunnies import simulate
+from bunnies.pipeline import build_pipeline
+
+from benchmarks.standins import Step
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    monkeypatch.setitem(graph.config, 'storage', {'write_url': "s3://write/", 'read_urls': [],
+                                                  'tmp_bucket': "tmp"})
+
+
+def test_capacity_limits_makespan(storage):
+    leaves = [Step("leaf%d" % (i,)) for i in range(4)]
+    root = Step("root", params={'vcpus': 4}, deps=leaves)
+    report = build_pipeline([root]).simulate(max_vcpus=4, default_duration=100.0, vcpu_budget=0)
+
+    assert report['jobs'] == 5
+    assert report['succeeded'] == 5
+    # two leaves at a time, then the root, once the build loop sees the leaves done
+    assert 300.0 <= report['makespan_s'] < 330.0
+    assert report['vcpu_s'] == pytest.approx(1200.0)
+    assert 0.9 < report['utilisation'] <= 1.0
+    assert report['queue_s']['max'] >= 100.0
+    assert report['build_s'] >= report['makespan_s']
+
+
+def test_admission_budget_keeps_queue_short(storage):
+    leaves = [Step("leaf%d" % (i,)) for i in range(8)]
+    flooded = build_pipeline(leaves).simulate(max_vcpus=4, default_duration=100.0, vcpu_budget=0)
+    admitted = build_pipeline(leaves).simulate(max_vcpus=4, default_duration=100.0)
+
+    assert flooded['queue_s']['max'] >= 300.0
+    assert admitted['queue_s']['max'] == 0.0
+    assert admitted['succeeded'] == 8
+
+
+def test_task_resources_asked_once_per_attempt(storage, monkeypatch):
+    asked = []
+    task_resources = Step.task_resources
+
+    def _counted(self, **kwargs):
+        asked.append((self.name, kwargs['attempt']))
+        return task_resources(self, **kwargs)
+    monkeypatch.setattr(Step, "task_resources", _counted)
+
+    leaves = [Step("leaf%d" % (i,)) for i in range(8)]
+    report = build_pipeline(leaves).simulate(max_vcpus=4, default_duration=100.0)
+    assert report['succeeded'] == 8
+    assert sorted(asked) == [("leaf%d" % (i,), 1) for i in range(8)]
+
+
+def test_unrecognized_parameters(storage):
+    with pytest.raises(ValueError):
+        build_pipeline([Step("leaf")]).simulate(max_vcpu=256)
+
+
+def test_failures_are_retried(storage):
+    report = build_pipeline([Step("flaky")]).simulate(max_attempt=3, defaults={'flaky': {'failure_rate': 1.0}})
+
+    assert report['jobs'] == 3
+    assert report['failed'] == 3
+    assert report['transforms']['flaky'] == {'jobs': 3, 'failed': 3, 'compute_s': pytest.approx(report['vcpu_s'] / 2)}
+    assert "3 failed" in simulate.format_report(report)
+
+
+def test_usage_history(storage, tmp_path):
+    folder = tmp_path / "align-1-abcdef"
+    folder.mkdir()
+    usage = {'attempts': [{'startedAt': 1000, 'stoppedAt': 11000},
+                          {'startedAt': 20000, 'stoppedAt': 50000}]}
+    (folder / "bunnies.usage.json").write_text(json.dumps(usage))
+
+    history = simulate.UsageHistory().load(str(folder / "bunnies.usage.json"))
+    assert history.durations('align') == [10.0, 30.0]
+    assert history.failure_rate('align') == 0.5
+    assert history.failure_rate('other') is None
+
+    # the same rows as the usage store's
+    assert [row['duration_s'] for row in history.store.attempts('align')] == [10.0, 30.0]
+    report = build_pipeline([Step("align")]).simulate(history=history.store, seed=1)
+    assert 0 < report['transforms']['align']['compute_s'] <= 30.0
+
+
+def test_percentiles():
+    assert simulate.percentiles([]) is None
+    dist = simulate.percentiles(list(range(1, 101)))
+    assert list(dist.items()) == [('p50', 50), ('p90', 90), ('p99', 99), ('max', 100)]
@@ -0,0 +1,73 @@
+import json
+import time
+
+from bunnies import tracing
+from bunnies.tracing import Tracer
+
+
+def test_inactive_is_noop():
+    assert tracing.active() is None
+    with tracing.span("nothing") as frame:
+        assert frame is None
+    with tracing.accumulate("nothing"):
+        pass
+
+
+def test_nested_spans_attribute_api_calls():
+    tracer = Tracer()
+    with tracer.activate():
+        assert tracing.active() is tracer
+        with tracing.span("build", run_name="r1"):
+            with tracing.span("plan"):
+                for _ in range(3):
+                    with tracing.accumulate("exists"):
+                        now = time.perf_counter()
+                        tracer.record_call("s3", "HeadObject", now, now + 0.001)
+            with tracing.span("submit", job="j1"):
+                now = time.perf_counter()
+                tracer.record_call("batch", "SubmitJob", now, now + 0.002)
+    assert tracing.active() is None
+
+    rows = {row['name']: row for row in tracer.summary()['spans']}
+    assert rows['build']['calls'] == {'s3': 3, 'batch': 1}
+    assert rows['plan']['calls'] == {'s3': 3}
+    assert rows['exists']['count'] == 3
+    assert rows['exists']['calls'] == {'s3': 3}
+    assert rows['submit']['calls'] == {'batch': 1}
+    assert tracer.summary()['api'] == {'s3': {'calls': 3, 'seconds': rows['plan']['api_seconds']['s3']},
+                                       'batch': {'calls': 1, 'seconds': rows['submit']['api_seconds']['batch']}}
+
+
+def test_chrome_trace(tmp_path):
+    tracer = Tracer()
+    with tracer.activate():
+        with tracing.span("build", run_name="r1"):
+            with tracing.accumulate("canonical_id"):
+                pass
+            now = time.perf_counter()
+            tracer.record_call("s3", "GetObject", now, now)
+
+    path = tmp_path / "trace.json"
+    tracer.write_chrome_trace(str(path))
+    trace = json.loads(path.read_text())
+
+    # accumulated spans are not emitted individually
+    names = sorted(event['name'] for event in trace['traceEvents'])
+    assert names == ["build", "s3.GetObject"]
+    build = [event for event in trace['traceEvents'] if event['name'] == "build"][0]
+    assert build['ph'] == "X"
+    assert build['args'] == {'run_name': "r1", 'api_calls': {'s3': 1}}
+    assert {row['name'] for row in trace['otherData']['summary']['spans']} == {"build", "canonical_id"}
+
+
+def test_format_summary():
+    tracer = Tracer()
+    with tracer.activate():
+        with tracing.span("poll"):
+            now = time.perf_counter()
+            tracer.record_call("batch", "DescribeJobs", now, now)
+    lines = tracer.format_summary().splitlines()
+    assert lines[0].split()[0] == "phase"
+    assert lines[1].split()[0] == "poll"
+    assert "batch:1/" in lines[1]
+    assert lines[-1].startswith("api calls (all threads): batch:1/")
@@ -0,0 +1,98 @@
+import gzip
+import io
+import threading
+import time
+import pytest
+from botocore.exceptions import ClientError
+from bunnies import transfers, constants
+from bunnies.exc import ImportError
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(constants, "UPLOAD_CHUNK_SIZE", 1024)
+
+
+def test_iter_reader_gzip_roundtrip():
+    lines = [("line %d\n" % (i,)).encode('ascii') for i in range(1000)]
+    reader = transfers.IterReader(transfers.gzip_chunks(lines))
+    data = b""
+    while True:
+        chunk = reader.read(100)
+        if not chunk:
+            break
+        assert len(chunk) <= 100
+        data += chunk
+    assert reader.tell() == len(data)
+    assert gzip.decompress(data) == b"".join(lines)
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_streaming_put_parts_in_order(s3, threads):
+    payload = bytes(range(256)) * 50
+    transfers.s3_streaming_put(transfers.IterReader([payload]), "s3://bucket/key",
+                               content_encoding="gzip", threads=threads)
+    assert s3.calls["UploadPart"] == 13
+    head = s3.head_object(Bucket="bucket", Key="key")
+    assert s3.objects() == {"s3://bucket/key": payload}
+    assert head['ContentEncoding'] == "gzip"
+    assert head['ETag'].endswith('-13"')
+    assert "AbortMultipartUpload" not in s3.calls
+
+
+def test_conditional_put_unsupported(s3, monkeypatch):
+    monkeypatch.setattr(transfers, "supports_param", lambda *args: False)
+    with pytest.raises(ImportError):
+        transfers.s3_streaming_put(transfers.IterReader([b"data"]), "s3://bucket/key", if_none_match="*")
+    assert s3.calls == {}
+
+
+class FakeRangeS3(object):
+    """serves ranged GETs, recording the most requests in flight at once"""
+    def __init__(self, data):
+        self.data = data
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def get_object(self, Bucket, Key, Range, IfMatch=None):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(0.001)
+        start, end = [int(x) for x in Range[len("bytes="):].split("-")]
+        with self.lock:
+            self.in_flight -= 1
+        return {'Body': io.BytesIO(self.data[start:end + 1])}
+
+
+def test_ranged_chunks_ordered_and_bounded():
+    data = bytes(range(256)) * 100
+    s3 = FakeRangeS3(data)
+    chunks = list(transfers.s3_ranged_chunks(s3, "bucket", "key", len(data), chunk_size=1000,
+                                             threads=3, read_ahead=4, etag='"x"'))
+    assert b"".join(chunks) == data
+    assert all(len(chunk) == 1000 for chunk in chunks[:-1])
+    assert s3.max_in_flight <= 3
+
+
+def test_multipart_copy_parts(s3):
+    data = bytes(range(250)) * 10
+    s3.seed("src", "a", data, etag='"x"')
+    transfers.s3_multipart_copy(s3, "src", "a", "dst", "b", 2500, part_size=1000, threads=3,
+                                create_args={'Metadata': {'k': "v"}}, part_args={'CopySourceIfMatch': '"x"'})
+    assert s3.calls["UploadPartCopy"] == 3
+    assert s3.objects()["s3://dst/b"] == data
+    assert s3.head_object(Bucket="dst", Key="b")['Metadata'] == {'k': "v"}
+    assert "AbortMultipartUpload" not in s3.calls
+
+
+def test_multipart_copy_aborts_on_failure(s3):
+    s3.seed("src", "a", bytes(5000), etag='"x"')
+    # the source changes during the copy
+    with pytest.raises(ClientError):
+        transfers.s3_multipart_copy(s3, "src", "a", "dst", "b", 5000, part_size=1000, threads=2,
+                                    part_args={'CopySourceIfMatch': '"y"'})
+    assert s3.calls["AbortMultipartUpload"] == 1
+    assert s3.uploads == {}
+    assert "s3://dst/b" not in s3.objects()
@@ -0,0 +1,106 @@
+import pytest
+from bunnies import constants as C
+from bunnies.exc import UnmarshallException
+from bunnies.graph import Input, Transform, ExternalFile
+from bunnies.unmarshall import unmarshall
+
+from benchmarks.standins import Step
+
+MD5 = "d41d8cd98f00b204e9800998ecf8427e"
+
+
+def _merge_manifest(n):
+    merge = Step("merge")
+    for i in range(n):
+        align = Step("align", params={'sample': i})
+        align.add_input("ref", ExternalFile("s3://bucket/ref.fa", digests={'md5': MD5}))
+        merge.add_input("align%d" % (i,), align)
+    return merge.manifest()
+
+
+def test_shared_subdocuments_interned():
+    merge = unmarshall(_merge_manifest(50))
+    refs = {id(merge.inputs[k].node.inputs['ref'].node) for k in merge.inputs}
+    assert len(refs) == 1
+    aligns = {id(merge.inputs[k].node) for k in merge.inputs}
+    assert len(aligns) == 50
+
+
+def test_roundtrip_canonical_id():
+    manifest = _merge_manifest(3)
+    assert unmarshall(manifest).manifest() == manifest
+
+
+def test_plain_containers_not_shared():
+    doc = unmarshall({'a': {'x': [1]}, 'b': {'x': [1]}, 'c': (0.0, -0.0)})
+    assert doc == {'a': {'x': [1]}, 'b': {'x': [1]}, 'c': (0.0, -0.0)}
+    assert doc['a'] is not doc['b']
+
+
+def test_deep_documents():
+    doc = leaf = []
+    for _ in range(20000):
+        nested = []
+        leaf.append(nested)
+        leaf = nested
+    res, depth = unmarshall(doc), 0
+    while res:
+        res, depth = res[0], depth + 1
+    assert depth == 20000
+
+
+def test_error_path():
+    doc = {'outer': [{'x': 1}, {C.MANIFEST_KIND_ATTR: "no.such.kind"}]}
+    with pytest.raises(UnmarshallException, match=r"path \.outer\.\[1\]:"):
+        unmarshall(doc)
+
+
+def _v1_manifest(node):
+    """the nested manifest format, as written by earlier versions"""
+    if isinstance(node, Transform):
+        return node.manifest_entry(_v1_manifest)
+    return node.manifest()
+
+
+def test_manifest_table():
+    manifest = _merge_manifest(20)
+    assert manifest[C.MANIFEST_KIND_ATTR] == C.MANIFEST_TABLE_KIND
+    # merge, 20 aligns, and the shared reference
+    assert len(manifest['nodes']) == 22
+    merge = unmarshall(manifest)
+    assert manifest['root'] == merge.canonical_id
+    assert len({id(inp.node.inputs['ref'].node) for inp in merge.inputs.values()}) == 1
+
+
+def test_manifest_v1_readable():
+    merge = unmarshall(_merge_manifest(5))
+    legacy = unmarshall(_v1_manifest(merge))
+    assert legacy.canonical_id == merge.canonical_id
+    assert legacy.manifest() == merge.manifest()
+
+
+def test_input_of_transform():
+    align = unmarshall(_merge_manifest(2)).inputs['align1'].node
+    inp = unmarshall(Input("x", align, desc="upstream").manifest())
+    assert (inp.name, inp.desc) == ("x", "upstream")
+    assert inp.node.canonical_id == align.canonical_id
+    # the tables nested in a document share their nodes
+    doc = unmarshall([Input("x", align).manifest(), Input("y", align).manifest()])
+    assert doc[0].node is doc[1].node
+
+
+def test_manifest_table_same_contents():
+    top = Step("top")
+    top.add_input("a", ExternalFile("s3://bucket/a.fa", digests={'md5': MD5}))
+    top.add_input("b", ExternalFile("s3://bucket/b.fa", digests={'md5': MD5}))
+    manifest = top.manifest()
+    assert len(manifest['nodes']) == 3
+    top2 = unmarshall(manifest)
+    assert sorted(inp.node.url for inp in top2.inputs.values()) == ["s3://bucket/a.fa", "s3://bucket/b.fa"]
+
+
+def test_manifest_table_dangling():
+    manifest = _merge_manifest(1)
+    manifest['nodes'] = {k: v for k, v in manifest['nodes'].items() if v.get('name') != "align"}
+    with pytest.raises(UnmarshallException, match="unknown node"):
+        unmarshall(manifest)
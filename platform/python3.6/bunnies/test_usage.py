@@ -0,0 +1,66 @@
+import json
+import pytest
+from bunnies import constants, usage
+
+
+def _usage(*durations, memory=1000):
+    return {'attempts': [{'startedAt': 1000, 'stoppedAt': 1000 + int(duration * 1000),
+                          'resources': [{'vcpus': 2, 'memory': memory}],
+                          'instance': [{'instanceType': "m5.large"}]} for duration in durations]}
+
+
+def _result(name, params, size):
+    return {'output': {}, 'manifest': {
+        constants.MANIFEST_KIND_ATTR: constants.MANIFEST_TABLE_KIND, 'version': 2, 'root': "t",
+        'nodes': {'t': {'type': "transform", 'name': name, 'version': "1", 'params': params,
+                        'inputs': {'reads': {'name': "reads", 'node': {constants.MANIFEST_REF_ATTR: "b"}}}},
+                  'b': {'url': "s3://data/reads.fq", 'size': size}}}}
+
+
+@pytest.fixture
+def fake(s3):
+    for i, (params, size, durations) in enumerate([({'k': 1}, 100, (50, 100)), ({'k': 1}, 200, (200,)),
+                                                   ({'k': 2}, 100, (100,))]):
+        for name, doc in ((constants.JOB_USAGE_FILE, _usage(*durations, memory=1000 * (i + 1))),
+                          (constants.TRANSFORM_RESULT_FILE, _result("align", params, size))):
+            s3.seed("bucket", "pipe/align-1-%d/%s" % (i, name), json.dumps(doc).encode('utf-8'))
+    return s3
+
+
+def test_sync_skips_unchanged_folders(fake):
+    store = usage.UsageStore(":memory:")
+    assert store.sync("s3://bucket/pipe/") == 3
+    assert store.sync("s3://bucket/pipe/") == 0
+
+    rows = store.attempts("align", params={'k': 1})
+    assert sorted((row['duration_s'], row['succeeded'], row['input_bytes']) for row in rows) == \
+        [(50.0, 0, 100), (100.0, 1, 100), (200.0, 1, 200)]
+    assert rows[0]['instance_type'] == "m5.large"
+    assert rows[0]['version'] == "1"
+
+
+def test_predict(fake):
+    store = usage.UsageStore(":memory:")
+    store.sync("s3://bucket/pipe/")
+    predictor = usage.Predictor(store, min_samples=2)
+
+    # both parameter sets: too few samples for {'k': 2}
+    guess = predictor.predict("align", params={'k': 2})
+    assert guess['samples'] == 3
+    assert guess['runtime']['p50'] == 100.0
+    assert guess['memory_requested']['p95'] == 3000
+
+    # runtimes scaled to the input size
+    guess = predictor.predict("align", params={'k': 1}, input_bytes=400)
+    assert guess['samples'] == 2
+    assert list(guess['runtime'].values()) == [400.0, 400.0, 400.0]
+
+    assert predictor.predict("other") is None
+
+
+def test_store_of_earlier_version(tmp_path):
+    path = str(tmp_path / "usage.sqlite3")
+    store = usage.UsageStore(path)
+    store.conn.executescript("DROP TABLE attempts; CREATE TABLE attempts (folder TEXT, memory INTEGER);")
+    store.close()
+    assert usage.UsageStore(path).attempts("align") == []
@@ -0,0 +1,104 @@
+import hashlib
+import json
+import threading
+import time
+import pytest
+from bunnies import constants, utils
+from bunnies.graph import Transform, ExternalFile
+
+
+def _dumps(obj):
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"))
+
+
+@pytest.mark.parametrize("doc", [
+    {},
+    [],
+    "plain",
+    {'b': 1, 'a': [1, 2.5, -0.0, 1e300, None, True, False], 'c': {}},
+    {'name': "café ☃ \U0001f600", 'esc': "quote\" back\\ nl\n tab\t \x01"},
+    {'floats': [float("nan"), float("inf"), float("-inf"), 0.1, 1 / 3]},
+    {3: "int", 2.5: "float", True: "bool", -1: "neg"},
+    {None: "none"},
+    {'nested': [{'y': (1, 2), 'x': [[], [{}]]}], 'big': 2 ** 70},
+])
+def test_canonical_encode_matches_json(doc):
+    assert utils.canonical_encode(doc) == _dumps(doc)
+    assert utils.canonical_hash(doc) == utils.canonical_hash_encoded(_dumps(doc))
+
+
+def test_canonical_encode_memo():
+    sub = {'k': "v"}
+    doc = {'a': sub, 'b': [sub]}
+    memo = {id(sub): "MEMO"}
+    assert utils.canonical_encode(doc, memo=memo) == '{"a":MEMO,"b":[MEMO]}'
+
+
+def test_canonical_encode_rejects():
+    with pytest.raises(TypeError):
+        utils.canonical_encode({'a': object()})
+
+
+def test_transform_canonical_id_unchanged():
+    blob = ExternalFile("s3://bucket/reads.fq", digests={'md5': "d41d8cd98f00b204e9800998ecf8427e"})
+    left = Transform("left", version="1", params={'k': 2})
+    left.add_input("reads", blob)
+    top = Transform("top", version="2", image="img:1")
+    top.add_input("l", left)
+    top.add_input("r", blob)
+    for node in (left, top):
+        expected = "sha1_" + hashlib.sha1(_dumps(node.canonical()).encode('utf-8')).hexdigest()
+        assert node.canonical_id == expected
+
+
+class CountingSession(object):
+    """creates a new stand-in client per call, slowly"""
+    def __init__(self):
+        self.created = []
+
+    def client(self, service, region_name=None, config=None):
+        time.sleep(0.01)
+        client = (service, region_name, config)
+        self.created.append(client)
+        return client
+
+
+@pytest.fixture
+def session(monkeypatch):
+    session = CountingSession()
+    monkeypatch.setattr(utils.aws_client, "session", session)
+    return session
+
+
+def test_aws_client_shared(session):
+    s3 = utils.aws_client('s3')
+    assert utils.aws_client('s3') is s3
+    assert utils.aws_client('s3', region_name="us-west-2") is not s3
+    assert s3[2].max_pool_connections == constants.MAX_POOL_CONNECTIONS
+    assert len(session.created) == 2
+
+
+def test_aws_client_per_config(session):
+    default = utils.aws_client('lambda')
+    slow = utils.aws_client('lambda', read_timeout=910, retries={'max_attempts': 0})
+    assert slow is not default
+    assert slow[2].read_timeout == 910
+    assert utils.aws_client('lambda', retries={'max_attempts': 0}, read_timeout=910) is slow
+    assert len(session.created) == 2
+
+
+def test_aws_client_created_once(session):
+    barrier = threading.Barrier(8)
+    clients = []
+
+    def _get():
+        barrier.wait()
+        clients.append(utils.aws_client('batch'))
+
+    threads = [threading.Thread(target=_get) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(session.created) == 1
+    assert all(client is clients[0] for client in clients)
@@ -0,0 +1,207 @@
+"""
+   Timing of build phases.
+
+   Spans time the phases of a build, and count the AWS API calls made (by service)
+   while they are open:
+
+   >>> tracer = Tracer()
+   >>> with tracer.activate():
+   ...     with span("compute_env.create"):
+   ...         compute_env.create()
+   >>> tracer.write_chrome_trace("build.trace.json")
+   >>> print(tracer.format_summary())
+
+   Operations repeated for each node of a graph are timed in aggregate only, with
+   accumulate(): they appear in the summary, but not as individual trace events.
+
+   span() and accumulate() do nothing unless a tracer is active. The trace file can be
+   loaded in chrome://tracing or https://ui.perfetto.dev
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+_active = None
+
+
+class _NoSpan(object):
+    """stands in for spans when no tracer is active"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Tracer(object):
+    """collects spans and api calls. safe to use from multiple threads."""
+
+    __slots__ = ("events", "totals", "api", "lock", "local", "t0", "pid")
+
+    def __init__(self):
+        self.events = []   # chrome trace events
+        self.totals = {}   # span name => {count, seconds, max, calls: {service: n}, api_seconds: {service: s}}
+        self.api = {}      # service => [calls, seconds], over all threads
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.t0 = time.perf_counter()
+        self.pid = os.getpid()
+
+    def _stack(self):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def _us(self, t):
+        return round((t - self.t0) * 1e6, 1)
+
+    @contextmanager
+    def activate(self):
+        """makes this tracer the target of span() and accumulate() for the duration of the block"""
+        global _active
+        previous, _active = _active, self
+        try:
+            yield self
+        finally:
+            _active = previous
+
+    @contextmanager
+    def span(self, name, emit=True, **args):
+        """times the block. with emit=False, it only counts towards the summary."""
+        frame = {'calls': {}, 'api_seconds': {}}
+        stack = self._stack()
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield frame
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            self._close(name, frame, start, end, emit, args)
+
+    def _close(self, name, frame, start, end, emit, args):
+        elapsed = end - start
+        with self.lock:
+            total = self.totals.get(name, None)
+            if total is None:
+                total = self.totals[name] = {'count': 0, 'seconds': 0.0, 'max': 0.0, 'calls': {}, 'api_seconds': {}}
+            total['count'] += 1
+            total['seconds'] += elapsed
+            total['max'] = max(total['max'], elapsed)
+            for service, count in frame['calls'].items():
+                total['calls'][service] = total['calls'].get(service, 0) + count
+                total['api_seconds'][service] = total['api_seconds'].get(service, 0.0) + frame['api_seconds'][service]
+            if emit:
+                event_args = dict(args)
+                if frame['calls']:
+                    event_args['api_calls'] = dict(frame['calls'])
+                self.events.append({'name': name, 'cat': "phase", 'ph': "X", 'pid': self.pid,
+                                    'tid': threading.get_ident(), 'ts': self._us(start),
+                                    'dur': round(elapsed * 1e6, 1), 'args': event_args})
+
+    def record_call(self, service, operation, start, end):
+        """an api call made by the current thread. it counts towards all its open spans."""
+        elapsed = end - start
+        for frame in self._stack():
+            frame['calls'][service] = frame['calls'].get(service, 0) + 1
+            frame['api_seconds'][service] = frame['api_seconds'].get(service, 0.0) + elapsed
+        with self.lock:
+            api = self.api.setdefault(service, [0, 0.0])
+            api[0] += 1
+            api[1] += elapsed
+            self.events.append({'name': "%s.%s" % (service, operation), 'cat': "api", 'ph': "X",
+                                'pid': self.pid, 'tid': threading.get_ident(), 'ts': self._us(start),
+                                'dur': round(elapsed * 1e6, 1)})
+
+    def chrome_trace(self):
+        with self.lock:
+            events = list(self.events)
+        return {'traceEvents': events, 'displayTimeUnit': "ms", 'otherData': {'summary': self.summary()}}
+
+    def write_chrome_trace(self, path):
+        with open(path, "w") as fd:
+            json.dump(self.chrome_trace(), fd)
+        log.info("trace written to %s", path)
+
+    def summary(self):
+        """one row per span name, longest first"""
+        with self.lock:
+            rows = [dict(total, name=name, calls=dict(total['calls']), api_seconds=dict(total['api_seconds']))
+                    for name, total in self.totals.items()]
+            api = {service: {'calls': calls, 'seconds': seconds} for service, (calls, seconds) in self.api.items()}
+        rows.sort(key=lambda row: -row['seconds'])
+        return {'spans': rows, 'api': api}
+
+    def format_summary(self):
+        summary = self.summary()
+        lines = ["%-32s %8s %10s %10s %10s  %s" % ("phase", "count", "total(s)", "mean(ms)", "max(ms)", "api calls")]
+        for row in summary['spans']:
+            calls = " ".join("%s:%d/%.1fs" % (service, count, row['api_seconds'][service])
+                             for service, count in sorted(row['calls'].items()))
+            lines.append("%-32s %8d %10.3f %10.1f %10.1f  %s" % (
+                row['name'][:32], row['count'], row['seconds'], 1000.0 * row['seconds'] / row['count'],
+                1000.0 * row['max'], calls))
+        if summary['api']:
+            lines.append("api calls (all threads): " + " ".join(
+                "%s:%d/%.1fs" % (service, api['calls'], api['seconds'])
+                for service, api in sorted(summary['api'].items())))
+        return "\n".join(lines)
+
+
+def active():
+    """the active tracer, or None"""
+    return _active
+
+
+def span(name, **args):
+    """times the block with the active tracer, if any. see Tracer.span"""
+    tracer = _active
+    if tracer is None:
+        return _NO_SPAN
+    return tracer.span(name, **args)
+
+
+def accumulate(name):
+    """times the block in aggregate, with the active tracer, if any"""
+    tracer = _active
+    if tracer is None:
+        return _NO_SPAN
+    return tracer.span(name, emit=False)
+
+
+_START_KEY = "bunnies_trace_start"
+
+
+def _before_call(model=None, context=None, **kwargs):
+    if _active is not None and context is not None:
+        context[_START_KEY] = (model.service_model.service_name, model.name, time.perf_counter())
+
+
+def _after_call(context=None, **kwargs):
+    # errors (after-call-error) don't carry the operation model
+    tracer = _active
+    if tracer is None or context is None:
+        return
+    started = context.pop(_START_KEY, None)
+    if started is not None:
+        service, operation, start = started
+        tracer.record_call(service, operation, start, time.perf_counter())
+
+
+def instrument_session(session):
+    """counts the api calls made by clients of the given boto3 session, in the active tracer"""
+    session.events.register("before-call", _before_call, unique_id="bunnies-trace-before")
+    session.events.register("after-call", _after_call, unique_id="bunnies-trace-after")
+    session.events.register("after-call-error", _after_call, unique_id="bunnies-trace-error")
@@ -5,9 +5,10 @@ import logging
 import hashlib
 import threading
 import io
+import collections
 import concurrent.futures
-import boto3
 import base64
+import zlib
 from botocore.exceptions import ClientError
 
 from . import utils
@@ -112,10 +113,14 @@ class HashingReader(object):
 
         return chunk
 
-    def close(self):
+    def release(self):
+        """stop hashing, leaving the source file open"""
         if self._executor:
             self._executor.shutdown(wait=True)
             self._executor = None
+
+    def close(self):
+        self.release()
         return self._sourcefp.close()
 
     def seekable(self, *args):
@@ -139,6 +144,93 @@ def yield_in_chunks(fp, chunk_size_bytes):
         yield chunk
 
 
+def s3_ranged_chunks(s3, bucket, key, size, chunk_size=8*1024*1024, threads=4, read_ahead=None, etag=None,
+                     **get_kwargs):
+    """yields the content of s3://bucket/key in order, as chunks of chunk_size bytes.
+
+       Byte ranges are fetched over `threads` concurrent connections into an ordered
+       queue. At most `read_ahead` chunks (default 2 * threads) are buffered or in
+       flight at any time, which bounds memory to about read_ahead * chunk_size.
+
+       If etag is given, every range is fetched with IfMatch=etag, so that the
+       object cannot change between ranges.
+    """
+    threads = max(1, threads)
+    read_ahead = max(threads, read_ahead or 2 * threads)
+    if etag:
+        get_kwargs['IfMatch'] = etag
+
+    def _get_range(start, end):
+        resp = s3.get_object(Bucket=bucket, Key=key, Range="bytes=%d-%d" % (start, end), **get_kwargs)
+        with resp['Body'] as body:
+            return body.read()
+
+    ranges = ((start, min(start + chunk_size, size) - 1) for start in range(0, size, chunk_size))
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        try:
+            for start, end in ranges:
+                pending.append(executor.submit(_get_range, start, end))
+                if len(pending) >= read_ahead:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def gzip_chunks(chunks, level=6):
+    """compresses an iterable of bytes into a gzip stream, yielding compressed
+       data as it becomes available"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+class IterReader(object):
+    """read-only file object over an iterable of bytes. The iterable is consumed
+       lazily, only as far as needed to satisfy each read.
+    """
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buf = bytearray()
+        self._pos = 0
+        self._eof = False
+
+    def read(self, size=-1):
+        while not self._eof and (size is None or size < 0 or len(self._buf) < size):
+            try:
+                self._buf += next(self._chunks)
+            except StopIteration:
+                self._eof = True
+
+        if size is None or size < 0 or size >= len(self._buf):
+            out = bytes(self._buf)
+            self._buf.clear()
+        else:
+            out = bytes(self._buf[:size])
+            del self._buf[:size]
+        self._pos += len(out)
+        return out
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def tell(self):
+        return self._pos
+
+    def close(self):
+        self._eof = True
+        self._buf.clear()
+
+
 def s3_copy_object(src_url, dst_url, client=None, logprefix="", threads=1, **kwargs):
     """copies the source blob to the destination. If the object is small this is
        a simple operation. If the object is > 5GB this performs a multipart upload
@@ -162,7 +254,8 @@ def s3_copy_object(src_url, dst_url, client=None, logprefix="", threads=1, **kwa
 
     """
     if not client:
-        s3 = boto3.client('s3')
+        # the pool must fit all concurrent part copies
+        s3 = utils.aws_client('s3', max_pool_connections=max(threads, constants.MAX_POOL_CONNECTIONS))
     else:
         s3 = client
 
@@ -208,7 +301,6 @@ def s3_copy_object(src_url, dst_url, client=None, logprefix="", threads=1, **kwa
     #
     # multipart upload_part_copy. ugh
     #
-    mpart = None
     try:
         create_args = {}
         create_args.update(kwargs)
@@ -231,8 +323,6 @@ def s3_copy_object(src_url, dst_url, client=None, logprefix="", threads=1, **kwa
                 del create_args[k]
 
         create_args.update({
-            'Bucket': dst_bucket,
-            'Key': dst_key,
             'Metadata': new_meta
         })
         if 'ContentType' in src_meta:
@@ -242,94 +332,12 @@ def s3_copy_object(src_url, dst_url, client=None, logprefix="", threads=1, **kwa
         if 'ContentEncoding' in src_meta:
             create_args['ContentEncoding'] = src_meta['ContentEncoding']
 
-        mpart = s3.create_multipart_upload(**create_args)
-
-        def _gen_parts(size):
-            part_size = 128 * 1024 * 1024  # 128MB
-            num_parts = (size + (part_size - 1)) // part_size
-            for i in range(0, num_parts):
-                start = i * part_size
-                end = start + part_size - 1
-                if end >= size:
-                    end = size - 1
-
-                yield (i+1, num_parts, size, {
-                    'PartNumber': i+1, # must be a natural integer
-                    'CopySourceRange': "bytes=%d-%d" % (start, end)
-                })
-
-        parts = []
-        part_args.update({
-            "Key": dst_key,
-            "Bucket": dst_bucket,
-            "UploadId": mpart['UploadId'],
-            "CopySource": {"Bucket": src_bucket, "Key": src_key},
-        })
         if "CopySourceIfMatch" not in part_args and 'CopySourceIfNoneMatch' not in part_args:
             part_args["CopySourceIfMatch"] = src_etag
 
-        def _upload_part_copy(call_args, totalparts, totalsize):
-            part_res = s3.upload_part_copy(**call_args)
-            return (call_args["PartNumber"], part_res['CopyPartResult']['ETag'])
-
-        if threads < 2:
-            # upload_part_copy foreach chunk
-            for partnum, totalparts, totalsize, chunk_params in _gen_parts(src_size):
-                call_args = dict(part_args)
-                call_args.update(chunk_params)
-                parts.append(_upload_part_copy(call_args, totalparts, totalsize))
-        else:
-            upload_errors = []
-            future_to_partnum = {}
-            completed = 0
-            with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
-                for i, (partnum, totalparts, totalsize, chunk_params) in enumerate(_gen_parts(src_size)):
-                    call_args = dict(part_args)
-                    call_args.update(chunk_params)
-                    parts.append(None)
-                    future = executor.submit(_upload_part_copy, call_args, totalparts, totalsize)
-                    future_to_partnum[future] = (i, call_args)
-
-                for future in concurrent.futures.as_completed(future_to_partnum):
-                    (icall, call_args) = future_to_partnum[future]
-                    try:
-                        upload_res = future.result()
-                    except ClientError as clierr:
-                        upload_errors.append(clierr)
-                        if clierr.response['Error']['Code'] == "PreconditionFailed":
-                            for future in future_to_partnum:
-                                future.cancel()
-                    except concurrent.futures.CancelledError:
-                        pass
-
-                    except Exception as exc:
-                        log.error("%s part number %d generated an error: %s", logprefix,
-                                  call_args['PartNumber'], str(exc))
-                        upload_errors.append(exc)
-                        for future in future_to_partnum:
-                            future.cancel()
-                    else:
-                        parts[icall] = upload_res
-                        completed += 1
-                        log.info("%s %.2f%% / %dB copied. Part #%d/%d -- %s completed.",
-                                 logprefix, completed*100.0/totalparts, src_size,
-                                 call_args['PartNumber'], totalparts, call_args['CopySourceRange']
-                        )
-            if upload_errors:
-                raise upload_errors[0]
-
-        parts_document = {
-            'Parts': [{'ETag': etag, 'PartNumber': pnum} for pnum, etag in parts]
-        }
-
-        log.debug("%s completing multipart copy to bucket:%s key:%s", logprefix,
-                  dst_bucket, dst_key)
-        completed = s3.complete_multipart_upload(Bucket=dst_bucket, Key=dst_key,
-                                                 UploadId=mpart['UploadId'],
-                                                 MultipartUpload=parts_document)
-        mpart = None
-        log.debug("%s completed multipart copy to bucket:%s key:%s etag:%s size:%s", logprefix,
-                  dst_bucket, dst_key, completed['ETag'], src_size)
+        completed = s3_multipart_copy(s3, src_bucket, src_key, dst_bucket, dst_key, src_size,
+                                      create_args=create_args, part_args=part_args, threads=threads,
+                                      logprefix=logprefix)
         dst_meta = utils.get_blob_meta(dst_url, **meta_kwargs)
 
         # make the copy result uniform with the simple copy
@@ -353,12 +361,82 @@ def s3_copy_object(src_url, dst_url, client=None, logprefix="", threads=1, **kwa
         log.error("%s client error: %s", logprefix, str(clierr))
         raise ImportError("error in upload copy to bucket:%s key:%s: %s" %
                           (dst_bucket, dst_key, clierr.response['Error']['Code']))
+
+
+def s3_multipart_copy(s3, src_bucket, src_key, dst_bucket, dst_key, size, create_args=None, part_args=None,
+                      part_size=None, threads=1, logprefix=""):
+    """server-side copy of an object with a multipart upload of ranged part copies.
+
+       create_args are passed to create_multipart_upload (ContentType, Metadata, ...),
+       and part_args to every upload_part_copy (CopySourceIfMatch, RequestPayer, ...).
+
+       Parts are copied concurrently by a pool of `threads` workers. If any part fails,
+       the remaining parts are cancelled and the multipart upload is aborted.
+
+       Returns the complete_multipart_upload response.
+    """
+    part_size = part_size or constants.COPY_PART_SIZE
+    # s3 allows at most 10000 parts
+    part_size = max(part_size, (size + 9999) // 10000)
+    num_parts = max(1, (size + part_size - 1) // part_size)
+    part_args = part_args or {}
+
+    call_args = dict(create_args or {})
+    call_args.update(Bucket=dst_bucket, Key=dst_key)
+    mpart = s3.create_multipart_upload(**call_args)
+    upload_id = mpart['UploadId']
+    log.debug("%s multipart copy s3://%s/%s to s3://%s/%s in %d part(s) with %d thread(s)", logprefix,
+              src_bucket, src_key, dst_bucket, dst_key, num_parts, threads)
+    try:
+        def _copy_part(partnum):
+            start = (partnum - 1) * part_size
+            end = min(start + part_size, size) - 1
+            call_args = dict(part_args)
+            call_args.update({
+                'Bucket': dst_bucket,
+                'Key': dst_key,
+                'UploadId': upload_id,
+                'PartNumber': partnum,  # must be a natural integer
+                'CopySource': {"Bucket": src_bucket, "Key": src_key},
+                'CopySourceRange': "bytes=%d-%d" % (start, end)
+            })
+            part_res = s3.upload_part_copy(**call_args)
+            return (partnum, part_res['CopyPartResult']['ETag'])
+
+        parts = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, threads)) as executor:
+            futures = [executor.submit(_copy_part, partnum) for partnum in range(1, num_parts + 1)]
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    parts.append(future.result())
+                    log.info("%s %.2f%% / %dB copied. Part #%d/%d completed.", logprefix,
+                             len(parts) * 100.0 / num_parts, size, parts[-1][0], num_parts)
+            except BaseException as exc:
+                log.error("%s multipart copy failed: %s", logprefix, exc)
+                for future in futures:
+                    future.cancel()
+                raise
+
+        parts.sort()
+        parts_document = {
+            'Parts': [{'ETag': etag, 'PartNumber': pnum} for pnum, etag in parts]
+        }
+
+        log.debug("%s completing multipart copy to bucket:%s key:%s", logprefix,
+                  dst_bucket, dst_key)
+        completed = s3.complete_multipart_upload(Bucket=dst_bucket, Key=dst_key,
+                                                 UploadId=upload_id,
+                                                 MultipartUpload=parts_document)
+        upload_id = None
+        log.debug("%s completed multipart copy to bucket:%s key:%s etag:%s size:%s", logprefix,
+                  dst_bucket, dst_key, completed['ETag'], size)
+        return completed
     finally:
-        if mpart:
+        if upload_id:
             try:
-                s3.abort_multipart_upload(Bucket=dst_bucket, Key=dst_key, UploadId=mpart['UploadId'])
+                s3.abort_multipart_upload(Bucket=dst_bucket, Key=dst_key, UploadId=upload_id)
                 log.debug("%s multipart upload aborted bucket:%s key:%s uploadid:%s", logprefix,
-                          dst_bucket, dst_key, mpart['UploadId'])
+                          dst_bucket, dst_key, upload_id)
             except Exception as exc:
                 log.error("%s could not abort multipart upload:", logprefix, exc_info=exc)
 
@@ -383,7 +461,7 @@ def s3_streaming_put_simple(inputfp, outputurl, content_type=None, content_lengt
 
     meta = meta or {}
 
-    s3 = boto3.client('s3')
+    s3 = utils.aws_client('s3')
 
     base64_md5 = utils.hex2b64(content_md5)
 
@@ -427,7 +505,7 @@ def s3_upload_file(inputpath, outputurl, logprefix="", content_type=None, conten
         logprefix += " "
 
     log.info("%suploading %s => %s", logprefix, inputpath, outputurl)
-    s3 = boto3.client('s3')
+    s3 = utils.aws_client('s3')
     # this downloads it to a temp file
     extra_args = {
         "ContentType": content_type or "application/octet-stream"
@@ -452,7 +530,7 @@ def s3_download_file(inputurl, outputpath, logprefix=""):
         logprefix += " "
 
     log.info("%sdownloading %s => %s", logprefix, inputurl, outputpath)
-    s3 = boto3.client('s3')
+    s3 = utils.aws_client('s3')
     # this downloads it to a temp file
     s3.download_file(bucketname, keyname, outputpath)
     st_size = os.stat(outputpath).st_size
@@ -460,10 +538,29 @@ def s3_download_file(inputurl, outputpath, logprefix=""):
     return outputpath
 
 
-def s3_streaming_put(inputfp, outputurl, content_type=None, content_length=-1, content_encoding=None, meta=None, logprefix=""):
+def supports_param(client, operation, param):
+    """true if the client's service model accepts the given request parameter.
+       e.g. conditional writes (IfNoneMatch) are absent from older botocore releases.
+    """
+    try:
+        shape = client.meta.service_model.operation_model(operation).input_shape
+    except Exception:
+        return False
+    return shape is not None and param in shape.members
+
+
+def s3_streaming_put(inputfp, outputurl, content_type=None, content_length=-1, content_encoding=None, meta=None,
+                     logprefix="", threads=1, if_none_match=None):
     """
     Upload the inputfile (fileobj) using a multipart approach.
 
+    With threads > 1, parts are uploaded concurrently while the input is still
+    being read. At most `threads` parts are held in memory at any time.
+
+    if_none_match="*" makes the upload conditional on the key not existing yet
+    (the ClientError PreconditionFailed is raised otherwise). ImportError is raised,
+    before anything is uploaded, by botocore versions which predate conditional writes.
+
     FIXME -- The XML Schema breaks if there are no parts (size 0)
     """
     bucketname, keyname = utils.s3_split_url(outputurl)
@@ -473,7 +570,9 @@ def s3_streaming_put(inputfp, outputurl, content_type=None, content_length=-1, c
 
     meta = meta or {}
 
-    s3 = boto3.client('s3')
+    s3 = utils.aws_client('s3')
+    if if_none_match and not supports_param(s3, "CompleteMultipartUpload", "IfNoneMatch"):
+        raise ImportError("conditional writes are not supported by this botocore version")
     progress = ProgressPercentage(size=content_length, logprefix=logprefix, logger=log)
 
     extra_args = {
@@ -498,27 +597,49 @@ def s3_streaming_put(inputfp, outputurl, content_type=None, content_length=-1, c
         progress(0)
 
         chunk_iter = yield_in_chunks(inputfp, constants.UPLOAD_CHUNK_SIZE)
-        chunkfp = None
-
-        for chunk in chunk_iter:
-            partnumber += 1
 
+        def _upload_part(partnumber, chunk):
             chunklen = len(chunk)
             chunkdigest = hashlib.md5(chunk).digest()
-            chunkfp = io.BytesIO(chunk)
-            chunk = None
-
             base64_md5 = base64.b64encode(chunkdigest).decode('ascii')
-            part_res = s3.upload_part(Body=chunkfp, Bucket=bucketname, Key=keyname,
-                                      ContentLength=chunklen,
-                                      ContentMD5=base64_md5,
-                                      PartNumber=partnumber,
-                                      UploadId=mpart['UploadId'])
-            chunkfp.close()
-            chunkfp = None
-            parts.append((partnumber, part_res['ETag']))
-
+            with io.BytesIO(chunk) as chunkfp:
+                part_res = s3.upload_part(Body=chunkfp, Bucket=bucketname, Key=keyname,
+                                          ContentLength=chunklen,
+                                          ContentMD5=base64_md5,
+                                          PartNumber=partnumber,
+                                          UploadId=mpart['UploadId'])
             progress(chunklen)
+            return (partnumber, part_res['ETag'])
+
+        if threads < 2:
+            for chunk in chunk_iter:
+                partnumber += 1
+                parts.append(_upload_part(partnumber, chunk))
+        else:
+            # bounds the number of parts read ahead of the uploads
+            slots = threading.BoundedSemaphore(threads)
+            upload_errors = []
+            futures = []
+
+            def _part_done(future):
+                slots.release()
+                if future.exception() is not None:
+                    upload_errors.append(future.exception())
+
+            with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+                for chunk in chunk_iter:
+                    slots.acquire()
+                    if upload_errors:
+                        slots.release()
+                        break
+                    partnumber += 1
+                    future = executor.submit(_upload_part, partnumber, chunk)
+                    future.add_done_callback(_part_done)
+                    futures.append(future)
+                    chunk = None
+            if upload_errors:
+                raise upload_errors[0]
+            parts = [future.result() for future in futures]
         del chunk_iter
 
         # finish it
@@ -526,14 +647,22 @@ def s3_streaming_put(inputfp, outputurl, content_type=None, content_length=-1, c
             'Parts': [{'ETag': etag, 'PartNumber': pnum} for pnum, etag in parts]
         }
 
+        complete_args = {}
+        if if_none_match:
+            complete_args['IfNoneMatch'] = if_none_match
+
         log.debug("%s completing multipart upload bucket:%s key:%s %s...", logprefix, bucketname, keyname, parts_document)
         completed = s3.complete_multipart_upload(Bucket=bucketname, Key=keyname, UploadId=mpart['UploadId'],
-                                                 MultipartUpload=parts_document)
+                                                 MultipartUpload=parts_document, **complete_args)
         mpart = None
         log.debug("%s completed multipart upload bucket:%s key:%s etag:%s", logprefix, bucketname, keyname, completed['ETag'])
         return completed
 
     except ClientError as clierr:
+        # the key was created concurrently
+        if clierr.response['Error']['Code'] == "PreconditionFailed":
+            raise
+
         log.error("%s client error: %s", logprefix, str(clierr))
         raise ImportError("error in upload to bucket:%s key:%s: %s" %
                           (bucketname, keyname, clierr.response['Error']['Code']))
@@ -52,45 +52,232 @@ def register_kind(pickled_class, unmarshaller=None):
     _registry[kind] = unmarshaller
 
 
-def _unmarshall(obj, path):
-    def _pathstr():
-        return ".".join(path)
-
-    if isinstance(obj, list):
-        return [_unmarshall(o, path=path + ("[%d]" % (i,),)) for i, o in enumerate(obj)]
-    if isinstance(obj, tuple):
-        return tuple([_unmarshall(o, path=path + ("[%d]" % (i,),)) for i, o in enumerate(obj)])
-    if isinstance(obj, dict):
+class _Frame(object):
+    """a container being unmarshalled. the path to it is only computed for error messages."""
+    __slots__ = ("obj", "parent", "slot", "children", "pos", "values", "keys")
+
+    def __init__(self, obj, parent, slot):
+        self.obj = obj
+        self.parent = parent
+        self.slot = slot  # key or index of obj in parent.obj
+        self.children = list(obj.items()) if isinstance(obj, dict) else list(enumerate(obj))
+        self.pos = 0
+        self.values = []  # unmarshalled children
+        self.keys = []    # structural keys of children
+
+    def path(self):
+        parts = []
+        frame = self
+        while frame.parent is not None:
+            parts.append(frame.slot if isinstance(frame.parent.obj, dict) else "[%d]" % (frame.slot,))
+            frame = frame.parent
+        if frame.slot is not None:
+            # position of the root document in its manifest table
+            parts.append(frame.slot)
+        return ".".join([""] + parts[::-1])
+
+
+def _leaf_key(obj):
+    if isinstance(obj, float):
+        # distinguishes 0.0 from -0.0, and matches nan
+        return (float, float.__repr__(obj))
+    try:
+        hash(obj)
+    except TypeError:
+        return ("id", id(obj))
+    return (obj.__class__, obj)
+
+
+class _Interner(object):
+    """
+    hash-consing of unmarshalled documents.
+
+    each distinct container structure gets a small integer id, so that the key of a
+    container stays shallow no matter how deep the document is. registered objects
+    with the same structure are built only once, and shared. plain dicts, lists
+    and tuples are not shared, since callers may modify them.
+    """
+    __slots__ = ("ids", "objects")
+
+    def __init__(self):
+        self.ids = {}      # structure => id
+        self.objects = {}  # id => unmarshalled registered object
+
+    def structure_id(self, structure):
+        return self.ids.setdefault(structure, len(self.ids))
+
+    def finish(self, frame):
+        """returns (key, value) for the frame, once all its children are unmarshalled"""
+        obj = frame.obj
+        if isinstance(obj, list):
+            return self.structure_id(("l", tuple(frame.keys))), frame.values
+        if isinstance(obj, tuple):
+            return self.structure_id(("t", tuple(frame.keys))), tuple(frame.values)
+
+        names = [name for name, _ in frame.children]
+        fields = list(zip(names, frame.keys))
+        try:
+            fields.sort(key=lambda field: field[0])
+        except TypeError:
+            pass
+        key = self.structure_id(("d", tuple(fields)))
+        converted = dict(zip(names, frame.values))
+
         if C.MANIFEST_KIND_ATTR not in obj:
             # regular dict
-            unwrap = None
-        else:
-            kind = obj[C.MANIFEST_KIND_ATTR]
-            unwrap = _registry.get(kind)
-            if unwrap is None:
-                msg = "error at document path %s: %s is not a registered object kind" % (_pathstr(), kind)
-                logger.error("%s", msg)
-                raise exc.UnmarshallException(msg)
-
-        # recurse into each key of the dict
-        with_converted_deps = {k: _unmarshall(v, path=path + (k,)) for k, v in obj.items()}
+            return key, converted
+
+        kind = obj[C.MANIFEST_KIND_ATTR]
+        unwrap = _registry.get(kind)
+        if unwrap is None:
+            msg = "error at document path %s: %s is not a registered object kind" % (frame.path(), kind)
+            logger.error("%s", msg)
+            raise exc.UnmarshallException(msg)
+
+        if key in self.objects:
+            return key, self.objects[key]
 
         try:
             # custom object unmarshall
-            return unwrap(with_converted_deps) if callable(unwrap) else with_converted_deps
+            value = unwrap(converted)
         except Exception as _exc:
-            logger.error("error at document path %s (kind=%s): %s", _pathstr(), kind, _exc, exc_info=True)
-            logger.error("function was %s,  args were: %s", unwrap, with_converted_deps)
-            msg = "error at document path %s (kind=%s): %s" % (_pathstr(), kind, str(_exc))
+            logger.error("error at document path %s (kind=%s): %s", frame.path(), kind, _exc, exc_info=True)
+            logger.error("function was %s,  args were: %s", unwrap, converted)
+            msg = "error at document path %s (kind=%s): %s" % (frame.path(), kind, str(_exc))
             raise exc.UnmarshallException(msg)
-    else:
+        self.objects[key] = value
+        return key, value
+
+
+def _is_container(obj):
+    return isinstance(obj, (list, tuple, dict))
+
+
+def _ref_name(obj):
+    """the node name if obj is a reference to a node of a manifest table, None otherwise"""
+    if isinstance(obj, dict) and len(obj) == 1 and C.MANIFEST_REF_ATTR in obj:
+        return obj[C.MANIFEST_REF_ATTR]
+    return None
+
+
+def _is_table(obj):
+    return isinstance(obj, dict) and obj.get(C.MANIFEST_KIND_ATTR) == C.MANIFEST_TABLE_KIND
+
+
+def _unmarshall(obj, interner, refs=None, prefix=None):
+    """
+    returns (key, value). key identifies the structure of obj (see _Interner).
+
+    refs maps node names to the (key, value) of nodes already unmarshalled. references
+    to them are replaced by their value.
+    """
+    if not _is_container(obj):
         # string, int, other object, etc.
-        return obj
+        return _leaf_key(obj), obj
+
+    # depth-first, post-order walk. children are converted before their parent.
+    stack = [_Frame(obj, None, prefix)]
+    while True:
+        frame = stack[-1]
+        if frame.pos < len(frame.children):
+            slot, child = frame.children[frame.pos]
+            frame.pos += 1
+            name = _ref_name(child) if refs is not None else None
+            if name is not None:
+                key, value = refs[name]
+                frame.values.append(value)
+                frame.keys.append(key)
+            elif _is_table(child):
+                # e.g. the manifest of an Input of a transform
+                key, value = _unmarshall_table(child, interner)
+                frame.values.append(value)
+                frame.keys.append(key)
+            elif _is_container(child):
+                stack.append(_Frame(child, frame, slot))
+            else:
+                frame.values.append(child)
+                frame.keys.append(_leaf_key(child))
+            continue
+
+        stack.pop()
+        key, value = interner.finish(frame)
+        if not stack:
+            return key, value
+        stack[-1].values.append(value)
+        stack[-1].keys.append(key)
+
+
+def _refs_in(obj):
+    """the names of the nodes referenced in obj"""
+    names = []
+    pending = [obj]
+    while pending:
+        obj = pending.pop()
+        name = _ref_name(obj)
+        if name is not None:
+            names.append(name)
+        elif isinstance(obj, dict):
+            pending.extend(obj.values())
+        elif isinstance(obj, (list, tuple)):
+            pending.extend(obj)
+    return names
+
+
+def _table_order(nodes):
+    """orders the node names of a manifest table so that nodes come after the nodes they refer to"""
+    deps = {name: _refs_in(node) for name, node in nodes.items()}
+    order = []
+    state = {}  # name => False while visiting, True when done
+
+    for start in nodes:
+        if start in state:
+            continue
+        state[start] = False
+        stack = [(start, iter(deps[start]))]
+        while stack:
+            name, pending = stack[-1]
+            for dep in pending:
+                if dep not in nodes:
+                    raise exc.UnmarshallException("error at document path .nodes.%s: reference to unknown node %s" %
+                                                  (name, dep))
+                if dep not in state:
+                    state[dep] = False
+                    stack.append((dep, iter(deps[dep])))
+                    break
+                if state[dep] is False:
+                    raise exc.UnmarshallException("error at document path .nodes.%s: cyclic reference to node %s" %
+                                                  (name, dep))
+            else:
+                stack.pop()
+                state[name] = True
+                order.append(name)
+    return order
+
+
+def _unmarshall_table(doc, interner):
+    """returns the (key, value) of the root of a manifest table"""
+    if doc.get('version') != C.MANIFEST_VERSION:
+        raise exc.UnmarshallException("unsupported manifest version: %s" % (doc.get('version'),))
+
+    nodes = doc['nodes']
+    refs = {}
+    for name in _table_order(nodes):
+        refs[name] = _unmarshall(nodes[name], interner, refs=refs, prefix="nodes.%s" % (name,))
+
+    if doc['root'] not in refs:
+        raise exc.UnmarshallException("manifest root %s is not in the node table" % (doc['root'],))
+    return refs[doc['root']]
 
 
 def unmarshall(obj):
     """
-    reconstruct the graph of objects based on basic objects
+    reconstruct the graph of objects based on basic objects.
+
+    both manifest formats are understood: node tables (v2, see constants.MANIFEST_TABLE_KIND),
+    and nested documents (v1). tables may appear nested in documents. identical sub-documents of a registered kind are
+    unmarshalled into a single shared object.
     """
-    # recurse in basic structures
-    return _unmarshall(obj, path=("",))
+    interner = _Interner()
+    if _is_table(obj):
+        return _unmarshall_table(obj, interner)[1]
+    return _unmarshall(obj, interner)[1]
@@ -0,0 +1,328 @@
+"""
+   Store of the resource usage of past jobs, and predictions drawn from it.
+
+   Jobs leave a usage file (constants.JOB_USAGE_FILE) next to their result, in their
+   output folder. `bunnies usage sync s3://bucket/prefix/` gathers them in a local
+   sqlite database (constants.USAGE_DB), along with what the result's manifest says
+   of the job: transform name, version, parameters, and the size of its input files.
+
+   Transforms can size their timeouts from it:
+
+   >>> def task_resources(self, **kwargs):
+   ...     guess = usage.predict(self)
+   ...     timeout = int(guess['runtime']['p95'] * 2) if guess else 4*3600
+   ...     return {'vcpus': 4, 'memory': 4000, 'timeout': timeout}
+
+   Batch doesn't report the peak memory of jobs: the store only knows the memory
+   they requested, which says nothing of the memory they needed.
+"""
+import json
+import logging
+import os
+import os.path
+import sqlite3
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from . import constants
+from . import graph
+from . import utils
+from .exc import NoSuchFile
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    folder       TEXT PRIMARY KEY,   -- output folder url
+    name         TEXT NOT NULL,
+    version      TEXT,
+    params       TEXT,               -- canonical json encoding
+    input_bytes  INTEGER,            -- total size of input files, if known
+    usage_etag   TEXT,
+    synced_at    REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_name ON jobs (name, version);
+CREATE TABLE IF NOT EXISTS attempts (
+    folder        TEXT NOT NULL,
+    attempt_no    INTEGER NOT NULL,
+    vcpus         INTEGER,
+    memory_requested INTEGER,        -- MiB
+    duration_s    REAL,
+    instance_type TEXT,
+    succeeded     INTEGER,
+    PRIMARY KEY (folder, attempt_no)
+);
+"""
+
+
+def _manifest_root(manifest):
+    """(root transform document, lookup of referenced nodes) of a v1 or v2 manifest"""
+    if manifest.get(constants.MANIFEST_KIND_ATTR, None) == constants.MANIFEST_TABLE_KIND:
+        nodes = manifest['nodes']
+
+        def _lookup(ref):
+            return nodes.get(ref.get(constants.MANIFEST_REF_ATTR, None), ref)
+        return nodes[manifest['root']], _lookup
+    return manifest, lambda doc: doc
+
+
+def transform_name(output_folder):
+    """the transform name of an output folder: name-version-canonicalid"""
+    folder = os.path.basename(output_folder.rstrip("/"))
+    parts = folder.rsplit("-", 2)
+    return parts[0] if len(parts) == 3 else folder
+
+
+def job_record(folder, usage_doc, result_doc):
+    """the job and attempt rows of an output folder"""
+    root, lookup = _manifest_root(result_doc.get('manifest', None) or {})
+    sizes = [lookup(entry.get('node', {})).get('size', None) for entry in root.get('inputs', {}).values()]
+    sizes = [size for size in sizes if size is not None]
+
+    job = {
+        'folder': folder,
+        'name': root.get('name', None) or transform_name(folder),
+        'version': root.get('version', None),
+        'params': utils.canonical_encode(root.get('params', None) or {}),
+        'input_bytes': sum(sizes) if sizes else None
+    }
+
+    attempts = []
+    num_attempts = len(usage_doc.get('attempts', []))
+    for attempt_no, attempt in enumerate(usage_doc.get('attempts', []), 1):
+        if not attempt.get('startedAt') or not attempt.get('stoppedAt'):
+            continue
+        instance_types = [instance.get('instanceType', None) for instance in attempt.get('instance', None) or []
+                          if instance]
+        attempts.append({
+            'attempt_no': attempt_no,
+            'vcpus': sum(res.get('vcpus', None) or 0 for res in attempt.get('resources', [])),
+            'memory_requested': sum(res.get('memory', None) or 0 for res in attempt.get('resources', [])),
+            'duration_s': (attempt['stoppedAt'] - attempt['startedAt']) / 1000.0,
+            'instance_type': ",".join(itype for itype in instance_types if itype) or None,
+            # a result was written: the last attempt succeeded
+            'succeeded': 1 if attempt_no == num_attempts and result_doc.get('output', None) is not None else 0
+        })
+    return job, attempts
+
+
+def _read_json(url):
+    """the json document at a local path or s3 url, or None if there is none"""
+    try:
+        if url.startswith("s3://"):
+            with utils.get_blob_ctx(url) as (body, _):
+                return json.loads(body.read().decode('utf-8'))
+        with open(url) as fd:
+            return json.load(fd)
+    except (NoSuchFile, FileNotFoundError):
+        return None
+
+
+def read_job(folder):
+    """the job and attempt rows (see job_record) of an output folder, a local path or
+       s3 url ending with a slash. None if the folder has no usage file.
+    """
+    usage_doc = _read_json(folder + constants.JOB_USAGE_FILE)
+    if usage_doc is None:
+        return None
+    return job_record(folder, usage_doc, _read_json(folder + constants.TRANSFORM_RESULT_FILE) or {})
+
+
+class UsageStore(object):
+    """sqlite database of job usage. see SCHEMA"""
+
+    def __init__(self, path=None):
+        self.path = path or constants.USAGE_DB
+        if self.path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.row_factory = sqlite3.Row
+        columns = [row['name'] for row in self.conn.execute("PRAGMA table_info(attempts)")]
+        if columns and "memory_requested" not in columns:
+            # written by an earlier version. the store only caches the usage files: sync again.
+            self.conn.executescript("DROP TABLE attempts; DROP TABLE jobs;")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def put(self, job, attempts, usage_etag=None):
+        with self.conn:
+            self.conn.execute("DELETE FROM attempts WHERE folder = ?", (job['folder'],))
+            self.conn.execute("INSERT OR REPLACE INTO jobs (folder, name, version, params, input_bytes, usage_etag, "
+                              "synced_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                              (job['folder'], job['name'], job['version'], job['params'], job['input_bytes'],
+                               usage_etag, time.time()))
+            self.conn.executemany("INSERT INTO attempts (folder, attempt_no, vcpus, memory_requested, duration_s, "
+                                  "instance_type, succeeded) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                  [(job['folder'], att['attempt_no'], att['vcpus'], att['memory_requested'],
+                                    att['duration_s'], att['instance_type'], att['succeeded']) for att in attempts])
+
+    def etags(self):
+        """{folder: etag of the usage file synced}"""
+        return {row['folder']: row['usage_etag'] for row in self.conn.execute("SELECT folder, usage_etag FROM jobs")}
+
+    def attempts(self, name, version=None, params=None, succeeded=None):
+        """the attempts of the jobs of a transform, joined with their job"""
+        query = "SELECT * FROM attempts JOIN jobs USING (folder) WHERE name = ?"
+        args = [name]
+        if version is not None:
+            query += " AND version = ?"
+            args.append(version)
+        if params is not None:
+            query += " AND params = ?"
+            args.append(utils.canonical_encode(params))
+        if succeeded is not None:
+            query += " AND succeeded = ?"
+            args.append(1 if succeeded else 0)
+        return [dict(row) for row in self.conn.execute(query, args)]
+
+    def load(self, *paths):
+        """adds the jobs of usage files (constants.JOB_USAGE_FILE), given by local path or s3 url.
+           returns the number added.
+        """
+        added = 0
+        for path in paths:
+            record = read_job(os.path.dirname(path) + "/")
+            if record is not None:
+                self.put(record[0], record[1])
+                added += 1
+        return added
+
+    def sync(self, prefix_url, threads=16, force=False):
+        """adds the usage of the jobs whose output folders are under prefix_url. folders
+           whose usage file hasn't changed since the last sync are skipped, unless force.
+
+           returns the number of folders added or updated.
+        """
+        bucket, prefix = utils.s3_split_url(prefix_url)
+        paginator = utils.aws_client('s3').get_paginator('list_objects_v2')
+        found = {}
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for info in page.get('Contents', []):
+                if os.path.basename(info['Key']) == constants.JOB_USAGE_FILE:
+                    folder = "s3://%s/%s" % (bucket, os.path.dirname(info['Key']) + "/")
+                    found[folder] = info['ETag']
+
+        known = {} if force else self.etags()
+        stale = [folder for folder, etag in found.items() if known.get(folder, None) != etag]
+        log.info("found %d usage files under %s. %d to sync.", len(found), prefix_url, len(stale))
+        if not stale:
+            return 0
+
+        synced = 0
+        with ThreadPoolExecutor(max_workers=max(1, min(threads, len(stale)))) as pool:
+            for folder, record in zip(stale, pool.map(read_job, stale)):
+                if record is None:
+                    continue
+                self.put(record[0], record[1], usage_etag=found[folder])
+                synced += 1
+        return synced
+
+
+class Predictor(object):
+    """runtime predictions for new jobs, from the successful attempts of similar
+       past jobs: same transform (and version), and the same parameters when enough jobs
+       ran with them.
+
+       when the size of the inputs is known, runtimes are scaled by it. the vcpus and memory
+       the attempts requested are given alongside (batch doesn't report what they used).
+    """
+    __slots__ = ("store", "min_samples")
+
+    def __init__(self, store, min_samples=3):
+        self.store = store
+        self.min_samples = min_samples
+
+    def predict(self, name, version=None, params=None, input_bytes=None, points=(50, 95)):
+        """returns {'runtime': {'p50': s, 'p95': s, 'max': s}, 'memory_requested': {...}, 'vcpus': {...},
+           'samples': n},
+           or None if no similar job succeeded.
+        """
+        samples = []
+        if params is not None:
+            samples = self.store.attempts(name, version=version, params=params, succeeded=True)
+        if len(samples) < self.min_samples:
+            samples = self.store.attempts(name, version=version, succeeded=True)
+        if not samples:
+            return None
+
+        def _runtime(sample):
+            if input_bytes and sample['input_bytes']:
+                return sample['duration_s'] * input_bytes / sample['input_bytes']
+            return sample['duration_s']
+
+        return {
+            'runtime': utils.percentiles([_runtime(sample) for sample in samples], points=points),
+            'memory_requested': utils.percentiles([sample['memory_requested'] for sample in samples], points=points),
+            'vcpus': utils.percentiles([sample['vcpus'] for sample in samples], points=points),
+            'samples': len(samples)
+        }
+
+
+def input_bytes(transform):
+    """the total size of the blobs a transform reads directly, or None if there are none"""
+    sizes = [inp.node.manifest()['size'] for inp in transform.inputs.values() if isinstance(inp.node, graph.S3Blob)]
+    return sum(sizes) if sizes else None
+
+
+def predict(transform, store=None):
+    """Predictor.predict() for a transform, from the default usage store"""
+    if store is None:
+        with predict.lock:
+            if predict.store is None:
+                predict.store = UsageStore()
+            store = predict.store
+    return Predictor(store).predict(transform.name, version=transform.version, params=transform.params,
+                                    input_bytes=input_bytes(transform))
+
+
+predict.store = None
+predict.lock = threading.Lock()
+
+
+def _cmd_usage_sync(prefixes, db=None, threads=16, force=False, **kwargs):
+    store = UsageStore(db)
+    try:
+        for prefix in prefixes:
+            synced = store.sync(prefix, threads=threads, force=force)
+            log.info("synced %d job(s) from %s into %s", synced, prefix, store.path)
+    finally:
+        store.close()
+
+
+def _cmd_usage_predict(name, db=None, version=None, **kwargs):
+    store = UsageStore(db)
+    try:
+        prediction = Predictor(store).predict(name, version=version)
+    finally:
+        store.close()
+    if prediction is None:
+        log.error("no successful job of transform %s in %s", name, store.path)
+        return 1
+    print(json.dumps(prediction, indent=4))
+
+
+def configure_parser(main_subparsers):
+    parser = main_subparsers.add_parser("usage", help="resource usage of past jobs")
+    subparsers = parser.add_subparsers(help="Commands:", dest="usage_command")
+
+    subp = subparsers.add_parser("sync", help="gather the usage files of output folders in the local usage database")
+    subp.set_defaults(func=_cmd_usage_sync)
+    subp.add_argument("prefixes", metavar="PREFIX", type=str, nargs="+",
+                      help="output folders under this url prefix (e.g. s3://my-bucket/pipeline/)")
+    subp.add_argument("--db", metavar="PATH", type=str, default=None,
+                      help="sqlite database (default: %s)" % (constants.USAGE_DB,))
+    subp.add_argument("--threads", metavar="THREADS", type=int, default=16,
+                      help="folders fetched concurrently")
+    subp.add_argument("--force", action="store_true", default=False,
+                      help="fetch folders again even if their usage file hasn't changed")
+
+    subp = subparsers.add_parser("predict", help="runtime percentiles of a transform's jobs")
+    subp.set_defaults(func=_cmd_usage_predict)
+    subp.add_argument("name", metavar="NAME", type=str, help="transform name")
+    subp.add_argument("--version", metavar="VERSION", type=str, default=None, help="transform version")
+    subp.add_argument("--db", metavar="PATH", type=str, default=None,
+                      help="sqlite database (default: %s)" % (constants.USAGE_DB,))
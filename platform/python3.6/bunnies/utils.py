@@ -9,15 +9,21 @@ from urllib.parse import urlparse
 import hashlib
 import json
 import logging
+import math
 import boto3
 import base64
+import collections
 import glob
 import fnmatch
 import subprocess
 import sys
+import threading
 
+import botocore.config
 from botocore.exceptions import ClientError
 from .exc import NoSuchFile
+from . import constants
+from . import tracing
 
 logger = logging.getLogger(__package__)
 
@@ -80,6 +86,44 @@ def user_region():
     return session.region_name
 
 
+def aws_client(service, region_name=None, **config_kwargs):
+    """returns a boto3 client for the given service, shared by all callers.
+
+       clients are created once per (service, region_name, config_kwargs) and reused,
+       so that their HTTP connections are kept alive across calls. boto3 clients are
+       thread-safe, but creating them isn't -- creation is serialized here.
+
+       config_kwargs are passed to botocore.config.Config. max_pool_connections
+       defaults to constants.MAX_POOL_CONNECTIONS.
+
+    >>> s3 = aws_client('s3')
+    >>> lambda_client = aws_client('lambda', read_timeout=910, retries={'max_attempts': 0})
+    """
+    config_kwargs.setdefault('max_pool_connections', constants.MAX_POOL_CONNECTIONS)
+    key = (service, region_name, json.dumps(config_kwargs, sort_keys=True))
+
+    client = aws_client.clients.get(key, None)
+    if client is not None:
+        return client
+
+    with aws_client.lock:
+        client = aws_client.clients.get(key, None)
+        if client is None:
+            if aws_client.session is None:
+                aws_client.session = boto3.session.Session()
+                tracing.instrument_session(aws_client.session)
+            logger.debug("creating shared %s client (region=%s config=%s)", service, region_name, key[2])
+            client = aws_client.session.client(service, region_name=region_name,
+                                               config=botocore.config.Config(**config_kwargs))
+            aws_client.clients[key] = client
+    return client
+
+
+aws_client.clients = {}
+aws_client.lock = threading.Lock()
+aws_client.session = None
+
+
 def s3_split_url(objecturl):
     """splits an s3://foo/bar/baz url into bucketname, keyname: ("foo", "bar/baz")
 
@@ -125,7 +169,7 @@ def get_blob_meta(objecturl, logprefix="", **kwargs):
     bucketname, keyname = s3_split_url(objecturl)
     logprefix = logprefix + " " if logprefix else logprefix
     logger.debug("%sfetching meta for URL: %s", logprefix, objecturl)
-    s3 = boto3.client('s3')
+    s3 = aws_client('s3')
     try:
         # if 'RequestPayer' not in kwargs:
         #     kwargs['RequestPayer'] = 'requester'
@@ -167,7 +211,7 @@ def get_blob_ctx(objecturl, logprefix="", **kwargs):
     bucketname, keyname = s3_split_url(objecturl)
     logprefix = logprefix + " " if logprefix else logprefix
     logger.info("%sfetching URL: %s", logprefix, objecturl)
-    s3 = boto3.client('s3')
+    s3 = aws_client('s3')
     try:
         res = s3.get_object(Bucket=bucketname, Key=keyname, **kwargs)
     except ClientError as clierr:
@@ -189,14 +233,106 @@ def hash_data(data, algo='md5', encoding="hex"):
     return digest_obj
 
 
-def canonical_hash(canon_obj, algo='sha1'):
+def _encode_float(o):
+    # same as the json module (allow_nan=True)
+    if o != o:
+        return 'NaN'
+    if o == float("+inf"):
+        return 'Infinity'
+    if o == float("-inf"):
+        return '-Infinity'
+    return float.__repr__(o)
+
+
+def _encode_key(key):
+    if isinstance(key, str):
+        return key
+    if key is True:
+        return 'true'
+    if key is False:
+        return 'false'
+    if key is None:
+        return 'null'
+    if isinstance(key, float):
+        return _encode_float(key)
+    if isinstance(key, int):
+        return int.__repr__(key)
+    raise TypeError("keys must be str, int, float, bool or None, not %s" % (key.__class__.__name__,))
+
+
+def _canonical_pieces(obj, out, memo):
+    """appends the string pieces of the canonical encoding of obj to out"""
+    if memo and id(obj) in memo:
+        out.append(memo[id(obj)])
+    elif isinstance(obj, str):
+        out.append(_encode_string(obj))
+    elif obj is None:
+        out.append('null')
+    elif obj is True:
+        out.append('true')
+    elif obj is False:
+        out.append('false')
+    elif isinstance(obj, int):
+        out.append(int.__repr__(obj))
+    elif isinstance(obj, float):
+        out.append(_encode_float(obj))
+    elif isinstance(obj, dict):
+        if not obj:
+            out.append('{}')
+            return
+        sep = '{'
+        for key, value in sorted(obj.items()):
+            out.append(sep)
+            out.append(_encode_string(_encode_key(key)))
+            out.append(':')
+            _canonical_pieces(value, out, memo)
+            sep = ','
+        out.append('}')
+    elif isinstance(obj, (list, tuple)):
+        if not obj:
+            out.append('[]')
+            return
+        sep = '['
+        for value in obj:
+            out.append(sep)
+            _canonical_pieces(value, out, memo)
+            sep = ','
+        out.append(']')
+    else:
+        raise TypeError("Object of type %s is not JSON serializable" % (obj.__class__.__name__,))
+
+
+_encode_string = json.encoder.encode_basestring_ascii
+
+
+def canonical_encode(canon_obj, memo=None):
+    """the canonical encoding of a canonical dictionary representation, as a str.
+
+    the output is identical to json.dumps(canon_obj, sort_keys=True, separators=(",", ":")).
+
+    memo maps id(sub-document) => canonical_encode(sub-document). Sub-documents found in
+    the memo are not encoded again. Only memoize sub-documents which are not modified
+    afterwards.
+    """
+    out = []
+    _canonical_pieces(canon_obj, out, memo)
+    return "".join(out)
+
+
+def canonical_hash(canon_obj, algo='sha1', memo=None):
     """hash a canonical dictionary representation into a hexdigest.
 
     contained objects must be JSONSerializable, and strings must be unicode, otherwise a TypeError is raised.
+
+    see canonical_encode for memo.
     """
-    serialized = json.dumps(canon_obj, sort_keys=True, separators=(",",  ":")).encode('utf-8')
+    return canonical_hash_encoded(canonical_encode(canon_obj, memo=memo), algo=algo)
+
+
+def canonical_hash_encoded(encoded, algo='sha1'):
+    """same as canonical_hash, given the output of canonical_encode"""
     digest_obj = getattr(hashlib, algo)()
-    digest_obj.update(serialized)
+    digest_obj.update(encoded.encode('utf-8'))
     return "%s_%s" % (algo, digest_obj.hexdigest())
 
 
@@ -260,6 +396,19 @@ def hex2b64(hexstr):
     return base64.b64encode(hexbits).decode('ascii')
 
 
+def percentiles(values, points=(50, 90, 99)):
+    """nearest-rank percentiles of values, and their max. None if there are no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    out = collections.OrderedDict()
+    for point in points:
+        rank = max(0, int(math.ceil(point / 100.0 * len(ordered))) - 1)
+        out['p%d' % (point,)] = ordered[min(rank, len(ordered) - 1)]
+    out['max'] = ordered[-1]
+    return out
+
+
 def walk_tree(rootdir, excludes=(), exclude_patterns=()):
     """
     yield files under rootdir, recursively, including empty folders, but
@@ -333,7 +482,7 @@ def read_log_stream(log_group_name, stream_name, startTime=None, endTime=None, s
     """
     # containerInstanceArn would likely allow obtaining logs for the instance.
 
-    client = boto3.client('logs')
+    client = aws_client('logs')
 
     extra = {}
     if startTime is not None:
@@ -0,0 +1,53 @@
+import os.path
+import sys
+
+import pytest
+
+from bunnies import utils
+
+# the aws stand-ins are shared with the benchmarks, at the root of the repository
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from benchmarks.standins import FakeBatch, FakeDynamoDB, FakeS3  # noqa: E402
+
+
+class FakeSession(object):
+    """stands in for the boto3 session of utils.aws_client. clients of the services
+       a test hasn't faked can't be created.
+    """
+    def __init__(self):
+        self.services = {}  # service name: stand-in
+
+    def client(self, service, region_name=None, config=None):
+        if service not in self.services:
+            raise AssertionError("test reached the %s api" % (service,))
+        return self.services[service]
+
+
+@pytest.fixture(autouse=True)
+def aws(monkeypatch):
+    """the session behind utils.aws_client, whatever name the client is imported under"""
+    session = FakeSession()
+    monkeypatch.setattr(utils.aws_client, "clients", {})
+    monkeypatch.setattr(utils.aws_client, "session", session)
+    return session
+
+
+@pytest.fixture
+def s3(aws):
+    """an in-memory s3, recording requests"""
+    fake = aws.services['s3'] = FakeS3(record=True)
+    return fake
+
+
+@pytest.fixture
+def batch(aws):
+    """an in-memory batch, recording requests"""
+    fake = aws.services['batch'] = FakeBatch(record=True)
+    return fake
+
+
+@pytest.fixture
+def dynamodb(aws):
+    """an in-memory dynamodb, recording requests"""
+    fake = aws.services['dynamodb'] = FakeDynamoDB(record=True)
+    return fake
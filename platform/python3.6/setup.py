@@ -144,10 +144,10 @@ setup(
         'dev': ['pylint', 'flake8'],
         'lambda': ['requests',
                    'boto3==1.9.35'],
+        # digest indexes (bunnies.digest_index) are only written with botocore 1.36+
         'build': ['requests',
                   'boto3==1.9.227',
-                  'awscli==1.16.237',
-                  'python-dynamodb-lock==0.9.1']
+                  'awscli==1.16.237']
     },
 
     # If there are data files included in your packages that need to be
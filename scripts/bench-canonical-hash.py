@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+   Microbenchmark of canonical id computation over a synthetic pipeline graph.
+
+   Compares the previous approach (json.dumps of the full canonical document of
+   each node) with Transform.canonical_id, which reuses the encodings of the
+   inputs. The ids produced are checked to be identical.
+
+   usage: bench-canonical-hash.py [--width W] [--depth D] [--fan-in F]
+"""
+import argparse
+import hashlib
+import json
+import random
+import time
+
+from bunnies.graph import Transform, ExternalFile
+
+
+def build_graph(width, depth, fan_in, seed=0):
+    rng = random.Random(seed)
+    layer = [ExternalFile("s3://bench/sample%d.fq.gz" % (i,),
+                          digests={'md5': hashlib.md5(b"%d" % (i,)).hexdigest()})
+             for i in range(width)]
+    nodes = []
+    for level in range(depth):
+        next_layer = []
+        for i in range(width):
+            node = Transform("step%d" % (level,), version="1.%d" % (level,), image="bench:latest",
+                             params={'threads': 4, 'sample': i, 'opts': ["-q", "-k%d" % (level,)]})
+            for j, src in enumerate(rng.sample(layer, min(fan_in, len(layer)))):
+                node.add_input("in%d" % (j,), src)
+            next_layer.append(node)
+        nodes.extend(next_layer)
+        layer = next_layer
+    return nodes
+
+
+def old_canonical_id(node):
+    serialized = json.dumps(node.canonical(), sort_keys=True, separators=(",", ":"))
+    return "sha1_" + hashlib.sha1(serialized.encode('utf-8')).hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--width", type=int, default=200, help="nodes per layer")
+    parser.add_argument("--depth", type=int, default=8, help="number of layers")
+    parser.add_argument("--fan-in", type=int, default=3, help="inputs per transform")
+    args = parser.parse_args()
+
+    nodes = build_graph(args.width, args.depth, args.fan_in)
+
+    start = time.perf_counter()
+    old_ids = [old_canonical_id(node) for node in nodes]
+    old_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    new_ids = [node.canonical_id for node in nodes]
+    new_s = time.perf_counter() - start
+
+    assert old_ids == new_ids, "canonical ids differ"
+    print(json.dumps({
+        'nodes': len(nodes),
+        'json_dumps_s': round(old_s, 4),
+        'canonical_id_s': round(new_s, 4),
+        'speedup': round(old_s / new_s, 2) if new_s else None
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()